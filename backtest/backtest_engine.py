@@ -0,0 +1,430 @@
+# backtest/backtest_engine.py
+
+"""
+WEEKLY PIPELINE BACKTEST.
+Replays the Phase 3 decision engine (budget -> health -> harvest -> actions) week by week
+over the stored indicator history, as if the system had been running back then.
+Indicator history is read once and laid out as (week x ETF x field) matrices; each replay
+step slices them into an IndicatorSnapshot (no per-week DataFrame or history lookups),
+so a multi-year, multi-ETF replay takes seconds.
+Orders are filled against the following days' bars: GTT buys fill on the first day whose
+(intraday) low reaches the GTT price, trims sell at the next open.
+Tracks equity, drawdown, GTT fill rate and the hit rate of buys/trims.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from utils.logger import setup_logger
+from data_pipeline.indicator_store import get_history_dir, read_history, read_manifest
+from data_pipeline.indicator_snapshot import IndicatorSnapshot, resolve_columns
+from decision_engine.calculate_budget import calculate_weekly_budget
+from decision_engine.check_health import run_health_checks
+from decision_engine.check_harvest import find_harvest_triggers
+from decision_engine.generate_actions import generate_weekly_actions
+
+log = setup_logger()
+
+WEEKLY_TF = '1W'
+DAILY_TF = '1d'
+MARKET_ARRAYS = ['weekly', 'daily_asof', 'close', 'day_open', 'day_low']
+MARKET_META_FILE = '_market.json'
+
+
+def run_backtest(universal_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Main Entry Point: Backtests the weekly pipeline over the stored indicator history.
+    Results go to universal_data['analysis']['backtest'] and 'backtest_output_dir'.
+    """
+    log.info("=== BACKTEST STARTED ===", tags=["BACKTEST", "START"])
+
+    settings = universal_data['configs']['system_settings'].get('backtest', {})
+    etfs = universal_data['configs']['universe_settings']['etfs_to_track']
+
+    market = prepare_market(get_history_dir(universal_data), etfs,
+                            start=settings.get('start_date') or None, end=settings.get('end_date') or None)
+    if not len(market['weeks']):
+        log.error("No weekly indicator history to backtest. Run the pipeline first.", tags=["BACKTEST", "ERROR"])
+        return universal_data
+
+    configs = {key: universal_data['configs'][key] for key in ('system_params', 'etf_lineup', 'strategy_settings')}
+    result = replay(market, configs, hit_horizon=int(settings.get('hit_horizon_weeks', 4)))
+    universal_data['analysis']['backtest'] = result
+
+    summary = result['summary']
+    log.info(f"Backtest {summary['start']} -> {summary['end']} ({summary['weeks']} weeks, {len(market['etfs'])} ETFs) "
+             f"in {summary['elapsed_seconds']}s", tags=["BACKTEST", "SUCCESS"])
+    log.info(f"Return {summary['total_return_%']}% | Max DD {summary['max_drawdown_%']}% | "
+             f"GTT fill rate {summary['fill_rate_%']}% | Buy hit rate {summary['buy_hit_rate_%']}%", tags=["BACKTEST", "SUCCESS"])
+
+    _save_results(universal_data, result)
+    return universal_data
+
+
+def prepare_market(history_dir: str, etfs: List[str], start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Reads the weekly and daily indicator history once and lays it out as aligned matrices:
+    weeks (W), etfs (N), fields (F), weekly (W x N x F), daily_asof (W x N x F, last daily
+    row at each week's close), close (W x N, last known weekly close), day_ts (D),
+    day_open / day_low (D x N).
+    """
+    history = read_history(history_dir, etfs=etfs, timeframes=[WEEKLY_TF, DAILY_TF])
+    if end is not None and not history.empty:
+        history = history[history['timestamp'] <= _as_of(end, history['timestamp'].dt.tz)]
+    stored = set(history['ETF']) if not history.empty else set()
+    etfs = [etf for etf in etfs if etf in stored]
+    empty = pd.DatetimeIndex([])
+    if not etfs:
+        return {'weeks': empty, 'etfs': [], 'fields': [], 'weekly': np.empty((0, 0, 0)), 'daily_asof': np.empty((0, 0, 0)),
+                'close': np.empty((0, 0)), 'day_ts': empty, 'day_open': np.empty((0, 0)), 'day_low': np.empty((0, 0))}
+
+    columns = resolve_columns(history.drop(columns=['ETF', 'Timeframe']))
+    fields = list(columns)
+    weekly_rows = history[history['Timeframe'] == WEEKLY_TF]
+    daily_rows = history[history['Timeframe'] == DAILY_TF]
+
+    weeks = pd.DatetimeIndex(weekly_rows['timestamp'].unique()).sort_values()
+    weekly = _to_matrix(weekly_rows, weeks, etfs, [columns[f] for f in fields])
+
+    day_ts = pd.DatetimeIndex(daily_rows['timestamp'].unique()).sort_values()
+    daily = _to_matrix(daily_rows, day_ts, etfs, [columns[f] for f in fields])
+    close_pos = fields.index('close')
+    asof = day_ts.searchsorted(weeks, side='right') - 1
+    daily_asof = np.where((asof >= 0)[:, None, None], _ffill(daily, ~np.isnan(daily[:, :, close_pos]))[np.maximum(asof, 0)], np.nan)
+
+    if start is not None:
+        keep = weeks >= _as_of(start, weeks.tz)
+        weeks, weekly, daily_asof = weeks[keep], weekly[keep], daily_asof[keep]
+
+    return {
+        'weeks': weeks,
+        'etfs': etfs,
+        'fields': fields,
+        'weekly': weekly,
+        'daily_asof': daily_asof,
+        'close': _ffill(weekly[:, :, close_pos], ~np.isnan(weekly[:, :, close_pos])),
+        'day_ts': day_ts,
+        'day_open': daily[:, :, fields.index('open')] if 'open' in fields else daily[:, :, close_pos],
+        'day_low': daily[:, :, fields.index('low')] if 'low' in fields else daily[:, :, close_pos],
+    }
+
+
+def load_or_prepare_market(history_dir: str, etfs: List[str], market_dir: str, start: Optional[str] = None,
+                           end: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Memory-mapped market from 'market_dir' if it was built from the same indicator history
+    (manifest entries) and date range; otherwise prepares and saves it first.
+    """
+    manifest = read_manifest(history_dir)['series']
+    series = {key: entry for key, entry in manifest.items() if key.split('/')[0] in etfs and key.split('/')[1] in (WEEKLY_TF, DAILY_TF)}
+    payload = {'etfs': list(etfs), 'start': start, 'end': end, 'series': series}
+    input_key = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    try:
+        with open(os.path.join(market_dir, MARKET_META_FILE), 'r') as f:
+            cached = json.load(f).get('input_key') == input_key
+    except (OSError, json.JSONDecodeError):
+        cached = False
+
+    if not cached:
+        market = prepare_market(history_dir, etfs, start=start, end=end)
+        if not len(market['weeks']):
+            return market
+        save_market(market, market_dir, input_key)
+    return load_market(market_dir, mmap=True)
+
+
+def save_market(market: Dict[str, Any], market_dir: str, input_key: Optional[str] = None) -> None:
+    """Writes a prepared market as one .npy file per matrix (memory-mappable) plus a JSON index."""
+    os.makedirs(market_dir, exist_ok=True)
+    for name in MARKET_ARRAYS:
+        np.save(os.path.join(market_dir, f"{name}.npy"), np.ascontiguousarray(market[name]))
+    meta = {
+        'etfs': market['etfs'],
+        'fields': market['fields'],
+        'tz': str(market['weeks'].tz) if market['weeks'].tz is not None else None,
+        'weeks': market['weeks'].strftime('%Y-%m-%dT%H:%M:%S').tolist(),
+        'day_ts': market['day_ts'].strftime('%Y-%m-%dT%H:%M:%S').tolist(),
+        'input_key': input_key
+    }
+    path = os.path.join(market_dir, MARKET_META_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_market(market_dir: str, mmap: bool = True) -> Dict[str, Any]:
+    """Reads a market written by save_market; matrices are read-only memory maps when 'mmap'."""
+    with open(os.path.join(market_dir, MARKET_META_FILE), 'r') as f:
+        meta = json.load(f)
+    market = {name: np.load(os.path.join(market_dir, f"{name}.npy"), mmap_mode='r' if mmap else None) for name in MARKET_ARRAYS}
+    market.update({
+        'etfs': meta['etfs'],
+        'fields': meta['fields'],
+        'weeks': pd.DatetimeIndex(meta['weeks']).tz_localize(meta['tz']),
+        'day_ts': pd.DatetimeIndex(meta['day_ts']).tz_localize(meta['tz'])
+    })
+    return market
+
+
+def slice_market(market: Dict[str, Any], start: int, end: int, validity_days: int = 7) -> Dict[str, Any]:
+    """
+    Weeks [start, end) of a market, with the daily bars up to the last week's GTT expiry
+    (orders placed in the final week can still fill). Matrices are views, not copies.
+    """
+    weeks = market['weeks'][start:end]
+    days = slice(0, market['day_ts'].searchsorted(weeks[-1] + pd.Timedelta(days=validity_days), side='right'))
+    out = dict(market)
+    out.update({
+        'weeks': weeks,
+        'weekly': market['weekly'][start:end],
+        'daily_asof': market['daily_asof'][start:end],
+        'close': market['close'][start:end],
+        'day_ts': market['day_ts'][days],
+        'day_open': market['day_open'][days],
+        'day_low': market['day_low'][days]
+    })
+    return out
+
+
+def replay(market: Dict[str, Any], configs: Dict[str, Any], hit_horizon: int = 4, state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Runs the decision phases for every week of a prepared market.
+    'configs' holds 'system_params', 'etf_lineup' and 'strategy_settings' (overrides welcome).
+    'state' continues from an earlier replay's final state (positions and cash flow); None starts flat.
+    Returns {'summary': {...}, 'equity_df': DataFrame, 'trades_df': DataFrame, 'state': {...}}.
+    """
+    started = time.perf_counter()
+    weeks, etfs, fields = market['weeks'], market['etfs'], market['fields']
+    n_weeks, n_etfs = len(weeks), len(etfs)
+    etf_pos = {etf: j for j, etf in enumerate(etfs)}
+    close_pos = fields.index('close')
+
+    lineup = configs.get('etf_lineup')
+    if lineup is None or lineup.empty:
+        lineup = pd.DataFrame({'Ticker': etfs, 'Enabled': True, 'Target_%': 100.0 / max(n_etfs, 1), 'ATR_Override_%': np.nan, 'Tags': ''})
+    targets = lineup.drop_duplicates('Ticker').set_index('Ticker')['Target_%'].reindex(etfs).fillna(0.0).to_numpy(dtype=float)
+
+    strategy = configs.get('strategy_settings') or {}
+    validity = pd.Timedelta(days=int(strategy.get('execution_params', {}).get('gtt_validity_days', 7)))
+    initial_capital = _get_param(configs.get('system_params'), 'Initial_Capital', 1000000)
+
+    state = state or {}
+    units = np.array(state.get('units', np.zeros(n_etfs)), dtype=float)
+    cost = np.array(state.get('cost', np.zeros(n_etfs)), dtype=float)
+    cash_flow = float(state.get('cash_flow', 0.0))  # Sold minus bought
+    equity = np.zeros(n_weeks)
+    s2_value = np.zeros(n_weeks)
+    trades = []
+
+    keys_1w = [(etf, WEEKLY_TF) for etf in etfs]
+    keys_1d = [(etf, DAILY_TF) for etf in etfs]
+    phase_log = log.logger
+    previous_level = phase_log.level
+    phase_log.setLevel(logging.ERROR)  # The phases log every step; keep the replay quiet
+    try:
+        for w in range(n_weeks):
+            # 1. Mark to market at this week's close
+            price = market['close'][w]
+            value = units * np.nan_to_num(price)
+            s2_value[w] = value.sum()
+            equity[w] = initial_capital + cash_flow + s2_value[w]
+
+            # 2. Snapshot of this week (weekly rows + daily rows as of the weekly close)
+            has_week = ~np.isnan(market['weekly'][w, :, close_pos])
+            has_day = ~np.isnan(market['daily_asof'][w, :, close_pos])
+            rows = {keys_1w[j]: j for j in np.flatnonzero(has_week)}
+            rows.update({keys_1d[j]: n_etfs + j for j in np.flatnonzero(has_day)})
+            snapshot = IndicatorSnapshot.from_arrays(rows, fields, np.concatenate([market['weekly'][w], market['daily_asof'][w]]))
+
+            # 3. Decision phases
+            step = _step_data(configs, lineup, snapshot, _holdings(etfs, units, cost, price, value, targets))
+            for phase in (calculate_weekly_budget, run_health_checks, find_harvest_triggers, generate_weekly_actions):
+                step = phase(step)
+            actions = step['execution_plan']['weekly_actions_df']
+            if actions is None or actions.empty:
+                continue
+
+            # 4. Fills over the days after the weekly close (GTT validity window)
+            days = slice(market['day_ts'].searchsorted(weeks[w], side='right'),
+                         market['day_ts'].searchsorted(weeks[w] + validity, side='right'))
+            day_ts = market['day_ts'][days]
+            cols = np.array([etf_pos[etf] for etf in actions['ETF']])
+            order_units = actions['Units'].to_numpy(dtype=float)
+            order_price = actions['Price'].to_numpy(dtype=float)
+            is_buy = (actions['Action'] == 'BUY').to_numpy()
+            fill_day, fill_price = _simulate_fills(market['day_open'][days][:, cols], market['day_low'][days][:, cols], order_price, is_buy)
+
+            for k, j in enumerate(cols):
+                filled = fill_day[k] >= 0
+                qty = order_units[k] if is_buy[k] else min(order_units[k], units[j])
+                if filled and qty > 0:
+                    if is_buy[k]:
+                        units[j] += qty
+                        cost[j] += qty * fill_price[k]
+                        cash_flow -= qty * fill_price[k]
+                    else:
+                        cost[j] -= cost[j] * qty / units[j]
+                        units[j] -= qty
+                        cash_flow += qty * fill_price[k]
+                trades.append((w, weeks[w], day_ts[fill_day[k]] if filled else pd.NaT, etfs[j], actions['Action'].iat[k],
+                               qty, order_price[k], fill_price[k] if filled else np.nan, actions['Reason'].iat[k]))
+    finally:
+        phase_log.setLevel(previous_level)
+
+    trades_df = pd.DataFrame(trades, columns=['Week_Index', 'Week', 'Fill_Date', 'ETF', 'Action', 'Units', 'Order_Price', 'Fill_Price', 'Reason'])
+    equity_df = pd.DataFrame({'Equity': equity, 'S2_Value': s2_value}, index=pd.Index(weeks, name='Week'))
+    equity_df['Drawdown_%'] = (equity_df['Equity'] / equity_df['Equity'].cummax() - 1.0) * 100.0
+
+    summary = _summarize(equity_df, trades_df, market, etf_pos, initial_capital, hit_horizon)
+    summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    final_state = {'units': units.tolist(), 'cost': cost.tolist(), 'cash_flow': cash_flow}
+    return {'summary': summary, 'equity_df': equity_df, 'trades_df': trades_df, 'state': final_state}
+
+
+# --- Helpers ---
+
+
+def _to_matrix(rows: pd.DataFrame, index: pd.DatetimeIndex, etfs: List[str], columns: List[str]) -> np.ndarray:
+    """(time x ETF x column) float array from long-format rows; NaN where a bar is missing."""
+    out = np.full((len(index), len(etfs), len(columns)), np.nan)
+    etf_pos = pd.Index(etfs).get_indexer(rows['ETF'])
+    time_pos = index.get_indexer(rows['timestamp'])
+    ok = (etf_pos >= 0) & (time_pos >= 0)
+    values = rows.reindex(columns=columns).apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    out[time_pos[ok], etf_pos[ok]] = values[ok]
+    return out
+
+
+def _as_of(date: str, tz: Any) -> pd.Timestamp:
+    """Config date ('YYYY-MM-DD') in the history's timezone."""
+    ts = pd.Timestamp(date)
+    return ts.tz_localize(tz) if ts.tz is None and tz is not None else ts
+
+
+def _ffill(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Forward-fills along axis 0 from the last row where 'valid' (time x ETF) is True."""
+    idx = np.where(valid, np.arange(len(valid))[:, None], -1)
+    idx = np.maximum.accumulate(idx, axis=0)
+    filled = values[np.maximum(idx, 0), np.arange(valid.shape[1])[None, :]]
+    missing = (idx < 0).reshape(idx.shape + (1,) * (values.ndim - 2))
+    return np.where(missing, np.nan, filled)
+
+
+def _simulate_fills(day_open: np.ndarray, day_low: np.ndarray, price: np.ndarray, is_buy: np.ndarray) -> tuple:
+    """
+    Per order: (index of the fill day or -1, fill price).
+    Buys (GTT): first day whose low reaches the price, at min(open, price) for gap-downs.
+    Trims: the first day's open.
+    """
+    n_days = day_open.shape[0]
+    fill_day = np.full(len(price), -1)
+    fill_price = np.full(len(price), np.nan)
+    if not n_days:
+        return fill_day, fill_price
+
+    touched = day_low <= price[None, :]
+    first = np.argmax(touched, axis=0)
+    buy_filled = is_buy & touched.any(axis=0)
+    fill_day[buy_filled] = first[buy_filled]
+    fill_price[buy_filled] = np.minimum(day_open[first, np.arange(len(price))], price)[buy_filled]
+
+    has_open = ~np.isnan(day_open)
+    first = np.argmax(has_open, axis=0)
+    sell_filled = ~is_buy & has_open.any(axis=0)
+    fill_day[sell_filled] = first[sell_filled]
+    fill_price[sell_filled] = day_open[first, np.arange(len(price))][sell_filled]
+    return fill_day, fill_price
+
+
+def _holdings(etfs: List[str], units: np.ndarray, cost: np.ndarray, price: np.ndarray, value: np.ndarray, targets: np.ndarray) -> pd.DataFrame:
+    held = units > 0
+    total = value.sum()
+    return pd.DataFrame({
+        'Ticker': np.array(etfs, dtype=object)[held],
+        'Units': units[held],
+        'Avg_Buy_Price': cost[held] / units[held],
+        'Current_Price': np.nan_to_num(price[held]),
+        'Current_%': value[held] / total * 100.0 if total > 0 else 0.0,
+        'Target_%': targets[held]
+    })
+
+
+def _step_data(configs: Dict[str, Any], lineup: pd.DataFrame, snapshot: IndicatorSnapshot, holdings: pd.DataFrame) -> Dict[str, Any]:
+    """Minimal universal_data for one replay step."""
+    return {
+        'configs': {**configs, 'etf_lineup': lineup},
+        'portfolio_state': {'holdings': holdings, 'summary': {'total_s2_value': float((holdings['Units'] * holdings['Current_Price']).sum())}},
+        'market_data': {'indicator_snapshot_df': None, 'indicator_snapshot': snapshot},
+        'analysis': {},
+        'execution_plan': {}
+    }
+
+
+def _summarize(equity_df: pd.DataFrame, trades_df: pd.DataFrame, market: Dict[str, Any], etf_pos: Dict[str, int],
+               initial_capital: float, hit_horizon: int) -> Dict[str, Any]:
+    weeks = market['weeks']
+    start_equity = float(equity_df['Equity'].iloc[0])  # initial_capital unless continuing from a state
+    final = float(equity_df['Equity'].iloc[-1])
+    years = max((weeks[-1] - weeks[0]).days / 365.25, 1e-9)
+
+    buys = trades_df[trades_df['Action'] == 'BUY']
+    trims = trades_df[trades_df['Action'] == 'TRIM']
+    filled_buys = buys[buys['Fill_Price'].notna()]
+
+    return {
+        'start': str(weeks[0].date()),
+        'end': str(weeks[-1].date()),
+        'weeks': len(weeks),
+        'initial_capital': initial_capital,
+        'final_equity': round(final, 2),
+        'total_return_%': round((final / start_equity - 1.0) * 100.0, 2),
+        'cagr_%': round(((final / start_equity) ** (1.0 / years) - 1.0) * 100.0, 2) if final > 0 else None,
+        'max_drawdown_%': round(float(equity_df['Drawdown_%'].min()), 2),
+        'final_s2_value': round(float(equity_df['S2_Value'].iloc[-1]), 2),
+        'buy_orders': len(buys),
+        'buys_filled': len(filled_buys),
+        'fill_rate_%': round(len(filled_buys) / len(buys) * 100.0, 2) if len(buys) else None,
+        'trims': int(trims['Fill_Price'].notna().sum()),
+        'buy_hit_rate_%': _hit_rate(filled_buys, market, etf_pos, hit_horizon, direction=1),
+        'trim_hit_rate_%': _hit_rate(trims[trims['Fill_Price'].notna()], market, etf_pos, hit_horizon, direction=-1),
+    }
+
+
+def _hit_rate(fills: pd.DataFrame, market: Dict[str, Any], etf_pos: Dict[str, int], horizon: int, direction: int) -> Optional[float]:
+    """Share of fills that were right 'horizon' weeks later (price up for buys, down for trims)."""
+    ahead = fills['Week_Index'].to_numpy() + horizon
+    done = ahead < len(market['weeks'])
+    if not done.any():
+        return None
+    later = market['close'][ahead[done], [etf_pos[etf] for etf in fills['ETF'][done]]]
+    hits = direction * (later - fills['Fill_Price'].to_numpy()[done]) > 0
+    return round(float(hits.mean()) * 100.0, 2)
+
+
+def _save_results(universal_data: Dict[str, Any], result: Dict[str, Any]) -> None:
+    paths = universal_data['configs']['system_settings']['paths']
+    out_dir = os.path.join(universal_data['system']['project_root'], paths.get('backtest_output_dir', 'source/data/backtests'))
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    result['equity_df'].to_csv(os.path.join(out_dir, f"backtest_{stamp}_equity.csv"))
+    result['trades_df'].to_csv(os.path.join(out_dir, f"backtest_{stamp}_trades.csv"), index=False)
+    with open(os.path.join(out_dir, f"backtest_{stamp}_summary.json"), 'w') as f:
+        json.dump(result['summary'], f, indent=2, default=str)
+    log.info(f"Backtest results saved to {out_dir}", tags=["BACKTEST", "SAVE"])
+
+
+def _get_param(df: Any, param_name: str, default: Any) -> Any:
+    if df is None or df.empty: return default
+    try:
+        row = df[df['Parameter'] == param_name]
+        if not row.empty: return float(row.iloc[0]['Value'])
+    except: pass
+    return default
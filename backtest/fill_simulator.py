@@ -0,0 +1,196 @@
+# backtest/fill_simulator.py
+
+"""
+GTT FILL SIMULATOR (1-MINUTE BARS).
+Replays every planned order against the stored 1-minute history after its decision time
+to find the first-touch fill time and price, then reports fill rates and slippage.
+- BUY (GTT): first minute within 'gtt_validity_days' whose low reaches the trigger price;
+  fills at min(open, trigger) so gap-downs through the trigger count as price improvement.
+- TRIM: first minute after the decision, at its open.
+Per ETF, each order's window is located with searchsorted, the lows are gathered into an
+(orders x window) matrix and scanned with a running minimum; no per-order or per-bar loops.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from utils.logger import setup_logger
+from data_pipeline.ohlcv_store import get_store_path, read_ohlcv
+
+log = setup_logger()
+
+FILL_COLUMNS = ['Fill_Time', 'Fill_Price', 'Filled', 'Minutes_To_Fill', 'Slippage_bps']
+ORDER_CHUNK = 1024  # Orders per window matrix (bounds memory to ORDER_CHUNK x window bars)
+
+
+def run_fill_simulation(universal_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Main Entry Point: 1-minute fill simulation of the backtest's planned orders
+    (universal_data['analysis']['backtest'], see run_backtest).
+    Results go to universal_data['analysis']['fill_simulation'] and 'backtest_output_dir'.
+    """
+    log.info("=== FILL SIMULATION STARTED ===", tags=["FILLSIM", "START"])
+
+    backtest = universal_data['analysis'].get('backtest')
+    if not backtest or backtest['trades_df'].empty:
+        log.warning("No planned orders to simulate (run the backtest first).", tags=["FILLSIM", "WARNING"])
+        return universal_data
+
+    # Weekly bars are labelled on the Friday that closes the week; orders go live after that session
+    trades = backtest['trades_df']
+    orders = pd.DataFrame({
+        'Decision_Time': pd.DatetimeIndex(trades['Week']) + pd.Timedelta(days=1),
+        'ETF': trades['ETF'].to_numpy(),
+        'Action': trades['Action'].to_numpy(),
+        'Units': trades['Units'].to_numpy(),
+        'Order_Price': trades['Order_Price'].to_numpy()
+    })
+
+    system_settings = universal_data['configs']['system_settings']
+    strategy = universal_data['configs'].get('strategy_settings') or {}
+    validity = int(strategy.get('execution_params', {}).get('gtt_validity_days', 7))
+    ohlcv_dir = os.path.join(universal_data['system']['project_root'], system_settings['paths']['ohlcv_data_dir'])
+
+    bars = load_minute_bars(ohlcv_dir, orders['ETF'].unique().tolist(), start=orders['Decision_Time'].min())
+    fills_df = simulate_order_fills(orders, bars, validity)
+    stats_df = fill_statistics(fills_df)
+    summary = _summarize(fills_df)
+    universal_data['analysis']['fill_simulation'] = {'fills_df': fills_df, 'stats_df': stats_df, 'summary': summary}
+
+    log.info(f"Simulated {summary['orders']} orders: GTT fill rate {summary['buy_fill_rate_%']}% | "
+             f"median time to fill {summary['buy_median_hours_to_fill']}h | "
+             f"trim slippage {summary['trim_mean_slippage_bps']} bps", tags=["FILLSIM", "SUCCESS"])
+    _save_results(universal_data, fills_df, stats_df, summary)
+    return universal_data
+
+
+def load_minute_bars(ohlcv_dir: str, etfs: List[str], start: Optional[pd.Timestamp] = None) -> Dict[str, pd.DataFrame]:
+    """1-minute open/low columns per ETF from the OHLCV store (months before 'start' are not read)."""
+    bars = {}
+    for etf in etfs:
+        df = read_ohlcv(get_store_path(ohlcv_dir, etf), start=start, columns=['open', 'low'])
+        if df.empty:
+            log.warning(f"No 1-minute bars for {etf}; its orders stay unfilled.", tags=["FILLSIM", "WARNING"])
+            continue
+        bars[etf] = df
+    return bars
+
+
+def simulate_order_fills(orders: pd.DataFrame, bars: Dict[str, pd.DataFrame], validity_days: int = 7) -> pd.DataFrame:
+    """
+    'orders' has Decision_Time, ETF, Action, Units, Order_Price; 'bars' maps ETF -> 1-minute
+    frame (timestamp index, open, low). Returns 'orders' plus FILL_COLUMNS.
+    Slippage is in basis points against the order price, positive = adverse.
+    """
+    out = orders.copy()
+    out['Fill_Time'] = pd.Series(pd.NaT, index=out.index, dtype=out['Decision_Time'].dtype)
+    out['Fill_Price'] = np.nan
+    validity = pd.Timedelta(days=validity_days)
+
+    for etf, group in orders.groupby('ETF', sort=False):
+        if etf not in bars:
+            continue
+        ts = bars[etf].index
+        decision = pd.DatetimeIndex(group['Decision_Time'])
+        start = ts.searchsorted(decision, side='right')
+        end = ts.searchsorted(decision + validity, side='right')
+        price = group['Order_Price'].to_numpy(dtype=float)
+        is_buy = (group['Action'] == 'BUY').to_numpy()
+
+        first = _first_touch(bars[etf]['low'].to_numpy(dtype=float), start, end, price, is_buy)
+        filled = first >= 0
+        opens = bars[etf]['open'].to_numpy(dtype=float)[first[filled]]
+        rows = group.index[filled]
+        out.loc[rows, 'Fill_Time'] = ts[first[filled]]
+        out.loc[rows, 'Fill_Price'] = np.where(is_buy[filled], np.minimum(opens, price[filled]), opens)
+
+    order_price = out['Order_Price'].to_numpy(dtype=float)
+    side = np.where(out['Action'] == 'BUY', 1.0, -1.0)
+    out['Filled'] = out['Fill_Price'].notna()
+    out['Minutes_To_Fill'] = (out['Fill_Time'] - out['Decision_Time']).dt.total_seconds() / 60.0
+    out['Slippage_bps'] = side * (out['Fill_Price'].to_numpy() - order_price) / order_price * 1e4
+    return out
+
+
+def fill_statistics(fills_df: pd.DataFrame) -> pd.DataFrame:
+    """Fill rate, time to fill and slippage per Action, overall ('ALL') and per ETF."""
+    if fills_df.empty:
+        return pd.DataFrame()
+    frames = [_group_stats(fills_df, ['Action']).assign(ETF='ALL'), _group_stats(fills_df, ['Action', 'ETF'])]
+    stats_df = pd.concat(frames, ignore_index=True)
+    return stats_df[['Action', 'ETF'] + [c for c in stats_df.columns if c not in ('Action', 'ETF')]]
+
+
+# --- Helpers ---
+
+
+def _first_touch(low: np.ndarray, start: np.ndarray, end: np.ndarray, price: np.ndarray, is_buy: np.ndarray) -> np.ndarray:
+    """
+    Bar index of each order's fill, -1 if none: for buys the first bar in [start, end) whose low
+    is <= price (running minimum of the window crosses the price), for trims the window's first bar.
+    """
+    first = np.where(~is_buy & (end > start), start, -1)
+    buys = np.flatnonzero(is_buy & (end > start))
+
+    for chunk in np.array_split(buys, max(1, -(-len(buys) // ORDER_CHUNK))):
+        if not len(chunk):
+            continue
+        length = end[chunk] - start[chunk]
+        offsets = np.arange(length.max())
+        idx = start[chunk, None] + offsets[None, :]
+        window = np.where(offsets[None, :] < length[:, None], low[np.minimum(idx, len(low) - 1)], np.inf)
+        running_min = np.minimum.accumulate(np.nan_to_num(window, nan=np.inf), axis=1)
+
+        touched = running_min <= price[chunk, None]
+        hit = touched[:, -1]  # The running minimum only falls, so the last column says whether it ever touched
+        first[chunk] = np.where(hit, start[chunk] + np.argmax(touched, axis=1), -1)
+    return first
+
+
+def _group_stats(fills_df: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    filled = fills_df[fills_df['Filled']]
+    counts = fills_df.groupby(keys).size().rename('Orders')
+    grouped = filled.groupby(keys)
+    stats = pd.concat([
+        counts,
+        grouped.size().rename('Filled'),
+        (grouped['Minutes_To_Fill'].median() / 60.0).rename('Median_Hours_To_Fill'),
+        grouped['Slippage_bps'].mean().rename('Mean_Slippage_bps'),
+        grouped['Slippage_bps'].median().rename('Median_Slippage_bps'),
+        grouped['Slippage_bps'].quantile(0.95).rename('P95_Slippage_bps')
+    ], axis=1).reset_index()
+    stats['Filled'] = stats['Filled'].fillna(0).astype(int)
+    stats.insert(len(keys) + 2, 'Fill_Rate_%', stats['Filled'] / stats['Orders'] * 100.0)
+    return stats.round(2)
+
+
+def _summarize(fills_df: pd.DataFrame) -> Dict[str, Any]:
+    buys = fills_df[fills_df['Action'] == 'BUY']
+    trims = fills_df[fills_df['Action'] == 'TRIM']
+    filled_buys = buys[buys['Filled']]
+    filled_trims = trims[trims['Filled']]
+    return {
+        'orders': len(fills_df),
+        'buy_orders': len(buys),
+        'buy_fill_rate_%': round(len(filled_buys) / len(buys) * 100.0, 2) if len(buys) else None,
+        'buy_median_hours_to_fill': round(float(filled_buys['Minutes_To_Fill'].median()) / 60.0, 2) if len(filled_buys) else None,
+        'buy_mean_slippage_bps': round(float(filled_buys['Slippage_bps'].mean()), 2) if len(filled_buys) else None,
+        'trim_orders': len(trims),
+        'trim_mean_slippage_bps': round(float(filled_trims['Slippage_bps'].mean()), 2) if len(filled_trims) else None
+    }
+
+
+def _save_results(universal_data: Dict[str, Any], fills_df: pd.DataFrame, stats_df: pd.DataFrame, summary: Dict[str, Any]) -> None:
+    paths = universal_data['configs']['system_settings']['paths']
+    out_dir = os.path.join(universal_data['system']['project_root'], paths.get('backtest_output_dir', 'source/data/backtests'))
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    fills_df.to_csv(os.path.join(out_dir, f"fills_{stamp}_orders.csv"), index=False)
+    stats_df.to_csv(os.path.join(out_dir, f"fills_{stamp}_stats.csv"), index=False)
+    with open(os.path.join(out_dir, f"fills_{stamp}_summary.json"), 'w') as f:
+        json.dump(summary, f, indent=2, default=str)
+    log.info(f"Fill simulation results saved to {out_dir}", tags=["FILLSIM", "SAVE"])
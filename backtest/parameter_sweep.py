@@ -0,0 +1,204 @@
+# backtest/parameter_sweep.py
+
+"""
+PARAMETER SWEEP RUNNER.
+Evaluates many combinations of strategy knobs (CONFIG sheet parameters such as ATR_Ceiling_%,
+and strategy_config paths such as execution_params.gtt_entry_atr_multiplier) by replaying
+the weekly decision pipeline for each one, then ranks them.
+The market matrices are prepared once and written as .npy files; worker processes
+memory-map them, so every combination shares the same precomputed indicators (no Phase 2).
+Grid search walks the full product of candidate values; random search samples it.
+"""
+
+import copy
+import itertools
+import math
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from tqdm import tqdm
+from typing import Dict, Any, List, Optional, Tuple
+from utils.logger import setup_logger
+from data_pipeline.indicator_store import get_history_dir
+from backtest.backtest_engine import load_or_prepare_market, load_market, replay, slice_market
+
+log = setup_logger()
+
+# Summary metrics copied into the results table
+RESULT_METRICS = ['total_return_%', 'cagr_%', 'max_drawdown_%', 'fill_rate_%', 'buy_hit_rate_%',
+                  'trim_hit_rate_%', 'buys_filled', 'trims', 'final_equity']
+
+# Worker-process state (set by _init_worker)
+_WORKER: Dict[str, Any] = {}
+
+
+def run_parameter_sweep(universal_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Main Entry Point: Runs the 'backtest.sweep' search over the stored indicator history.
+    Results go to universal_data['analysis']['parameter_sweep_df'] and 'backtest_output_dir'.
+    """
+    log.info("=== PARAMETER SWEEP STARTED ===", tags=["SWEEP", "START"])
+
+    system_settings = universal_data['configs']['system_settings']
+    settings = system_settings.get('backtest', {})
+    sweep_cfg = settings.get('sweep', {})
+
+    combos = build_combinations(sweep_cfg.get('parameters', {}), sweep_cfg.get('method', 'grid'),
+                                sweep_cfg.get('samples', 500), sweep_cfg.get('seed', 42))
+    if not combos:
+        log.error("No sweep parameters configured (backtest.sweep.parameters).", tags=["SWEEP", "ERROR"])
+        return universal_data
+
+    etfs = universal_data['configs']['universe_settings']['etfs_to_track']
+    market_dir = os.path.join(get_cache_dir(universal_data), 'market')
+    market = load_or_prepare_market(get_history_dir(universal_data), etfs, market_dir,
+                                    start=settings.get('start_date') or None, end=settings.get('end_date') or None)
+    if not len(market['weeks']):
+        log.error("No weekly indicator history to sweep over. Run the pipeline first.", tags=["SWEEP", "ERROR"])
+        return universal_data
+
+    configs = {key: universal_data['configs'][key] for key in ('system_params', 'etf_lineup', 'strategy_settings')}
+    workers = resolve_workers(system_settings, len(combos))
+    log.info(f"Evaluating {len(combos)} combinations over {len(market['weeks'])} weeks x {len(market['etfs'])} ETFs "
+             f"on {workers} worker(s).", tags=["SWEEP"])
+
+    results_df = evaluate_combinations(market_dir, configs, combos, int(settings.get('hit_horizon_weeks', 4)),
+                                       workers, sweep_cfg.get('rank_by', 'total_return_%'))
+    universal_data['analysis']['parameter_sweep_df'] = results_df
+
+    if not results_df.empty:
+        best = results_df.iloc[0]
+        log.info(f"Best: {best[list(combos[0])].to_dict()} -> {best.get(sweep_cfg.get('rank_by', 'total_return_%'))}",
+                 tags=["SWEEP", "SUCCESS"])
+        _save_results(universal_data, results_df)
+    return universal_data
+
+
+def build_combinations(space: Dict[str, List[Any]], method: str = 'grid', samples: int = 500, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Parameter combinations from {knob: [candidate values]}.
+    'grid' returns the full product; 'random' draws 'samples' distinct points of it
+    (by flat index, so the product is never materialized).
+    """
+    names = [name for name, values in space.items() if values]
+    if not names:
+        return []
+    values = [list(space[name]) for name in names]
+
+    if method == 'grid':
+        return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+    shape = tuple(len(v) for v in values)
+    total = math.prod(shape)
+    picks = np.random.default_rng(seed).choice(total, size=min(int(samples), total), replace=False)
+    positions = np.unravel_index(picks, shape)
+    return [{name: values[k][positions[k][i]] for k, name in enumerate(names)} for i in range(len(picks))]
+
+
+def apply_overrides(configs: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy of 'configs' with knob overrides applied.
+    Dotted names are strategy_settings paths (harvest_triggers.h1_stretch.rsi_threshold);
+    plain names are system_params rows (ATR_Ceiling_%), added if missing.
+    """
+    out = dict(configs)
+    params = configs.get('system_params')
+    params = params.copy() if params is not None and not params.empty else pd.DataFrame(columns=['Parameter', 'Value'])
+    strategy = copy.deepcopy(configs.get('strategy_settings') or {})
+
+    for name, value in overrides.items():
+        if '.' in name:
+            node = strategy
+            *path, leaf = name.split('.')
+            for key in path:
+                node = node.setdefault(key, {})
+            node[leaf] = value
+        elif (params['Parameter'] == name).any():
+            params.loc[params['Parameter'] == name, 'Value'] = value
+        else:
+            params = pd.concat([params, pd.DataFrame({'Parameter': [name], 'Value': [value]})], ignore_index=True)
+
+    out['system_params'] = params
+    out['strategy_settings'] = strategy
+    return out
+
+
+def evaluate_combinations(market_dir: str, configs: Dict[str, Any], combos: List[Dict[str, Any]], hit_horizon: int,
+                          workers: int = 1, rank_by: str = 'total_return_%', window: Optional[Tuple[int, int]] = None) -> pd.DataFrame:
+    """
+    Replays every combination over the market in 'market_dir' (or only its weeks [start, end)
+    when 'window' is given); returns the ranked results table.
+    """
+    rows = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(market_dir, configs, hit_horizon)) as pool:
+            futures = {pool.submit(_evaluate, combo, window): i for i, combo in enumerate(combos)}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Sweep"):
+                try:
+                    rows.append({**combos[futures[future]], **future.result()})
+                except Exception as e:
+                    log.error(f"Combination {combos[futures[future]]} failed: {e}", tags=["SWEEP", "ERROR"])
+    else:
+        _init_worker(market_dir, configs, hit_horizon)
+        for combo in tqdm(combos, desc="Sweep"):
+            try:
+                rows.append({**combo, **_evaluate(combo, window)})
+            except Exception as e:
+                log.error(f"Combination {combo} failed: {e}", tags=["SWEEP", "ERROR"])
+
+    return rank_results(pd.DataFrame(rows), rank_by)
+
+
+def rank_results(results_df: pd.DataFrame, rank_by: str) -> pd.DataFrame:
+    """Sorts best-first on 'rank_by' (higher is better; missing values last) and numbers the rows."""
+    if results_df.empty:
+        return results_df
+    ranked = results_df.sort_values(rank_by, ascending=False, na_position='last', kind='stable').reset_index(drop=True)
+    ranked.insert(0, 'Rank', np.arange(1, len(ranked) + 1))
+    return ranked
+
+
+def get_cache_dir(universal_data: Dict[str, Any]) -> str:
+    """Absolute path of the backtest cache (memory-mapped market, fold results)."""
+    paths = universal_data['configs']['system_settings']['paths']
+    return os.path.join(universal_data['system']['project_root'], paths.get('backtest_cache_dir', 'source/data/backtest_cache'))
+
+
+def resolve_workers(system_settings: Dict[str, Any], combo_count: int) -> int:
+    """Configured worker count (0 = one per CPU), never more than there are combinations."""
+    workers = system_settings.get('compute', {}).get('backtest_workers', 0)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, combo_count))
+
+
+# --- Helpers ---
+
+
+def _init_worker(market_dir: str, configs: Dict[str, Any], hit_horizon: int) -> None:
+    """Process-pool initializer: memory-maps the shared market once per worker."""
+    _WORKER['market'] = load_market(market_dir, mmap=True)
+    _WORKER['configs'] = configs
+    _WORKER['hit_horizon'] = hit_horizon
+
+
+def _evaluate(combo: Dict[str, Any], window: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+    """Process-pool task: one replay with 'combo' applied; returns the summary metrics."""
+    configs = apply_overrides(_WORKER['configs'], combo)
+    market = _WORKER['market']
+    if window is not None:
+        validity = int(configs['strategy_settings'].get('execution_params', {}).get('gtt_validity_days', 7))
+        market = slice_market(market, window[0], window[1], validity)
+    result = replay(market, configs, _WORKER['hit_horizon'])
+    return {metric: result['summary'].get(metric) for metric in RESULT_METRICS}
+
+
+def _save_results(universal_data: Dict[str, Any], results_df: pd.DataFrame) -> None:
+    paths = universal_data['configs']['system_settings']['paths']
+    out_dir = os.path.join(universal_data['system']['project_root'], paths.get('backtest_output_dir', 'source/data/backtests'))
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    results_df.to_csv(path, index=False)
+    log.info(f"Sweep results ({len(results_df)} rows) saved to {path}", tags=["SWEEP", "SAVE"])
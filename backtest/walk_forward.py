@@ -0,0 +1,245 @@
+# backtest/walk_forward.py
+
+"""
+WALK-FORWARD OPTIMIZATION.
+Rolls an in-sample window over the history: the sweep candidates (backtest.sweep) are ranked
+on each in-sample window and the winner trades the following out-of-sample window.
+Out-of-sample windows are chained (each continues from the previous window's positions), so
+the result is one equity curve built only from parameters chosen on earlier data.
+Every fold runs the same replay() -> decision engine functions as the live pipeline.
+Caching: the market matrices are reused while the indicator history is unchanged, and each
+fold's in-sample ranking and out-of-sample result are stored under a content key (data slice,
+configs, candidates, previous fold), so adding a week re-evaluates only the newest fold.
+Each candidate/config set keeps its own fold directory, so switching between sweeps keeps both caches.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, Any, List, Tuple
+from utils.logger import setup_logger
+from data_pipeline.indicator_store import get_history_dir
+from backtest.backtest_engine import load_or_prepare_market, replay, slice_market
+from backtest.parameter_sweep import build_combinations, apply_overrides, evaluate_combinations, get_cache_dir, resolve_workers
+
+log = setup_logger()
+
+FOLD_FILE = '{kind}_{key}.json'
+
+
+def run_walk_forward(universal_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Main Entry Point: Walk-forward evaluation over the stored indicator history.
+    Results go to universal_data['analysis']['walk_forward'] and 'backtest_output_dir'.
+    """
+    log.info("=== WALK-FORWARD STARTED ===", tags=["WALKFWD", "START"])
+
+    system_settings = universal_data['configs']['system_settings']
+    settings = system_settings.get('backtest', {})
+    sweep_cfg = settings.get('sweep', {})
+    wf_cfg = settings.get('walk_forward', {})
+    rank_by = sweep_cfg.get('rank_by', 'total_return_%')
+    hit_horizon = int(settings.get('hit_horizon_weeks', 4))
+
+    combos = build_combinations(sweep_cfg.get('parameters', {}), sweep_cfg.get('method', 'grid'),
+                                sweep_cfg.get('samples', 500), sweep_cfg.get('seed', 42))
+    if not combos:
+        log.error("No candidate parameters configured (backtest.sweep.parameters).", tags=["WALKFWD", "ERROR"])
+        return universal_data
+
+    cache_dir = get_cache_dir(universal_data)
+    market_dir = os.path.join(cache_dir, 'market')
+    etfs = universal_data['configs']['universe_settings']['etfs_to_track']
+    market = load_or_prepare_market(get_history_dir(universal_data), etfs, market_dir,
+                                    start=settings.get('start_date') or None, end=settings.get('end_date') or None)
+
+    folds = build_folds(len(market['weeks']), int(wf_cfg.get('in_sample_weeks', 104)), int(wf_cfg.get('out_of_sample_weeks', 13)))
+    if not folds:
+        log.error(f"Not enough history for one fold ({len(market['weeks'])} weeks).", tags=["WALKFWD", "ERROR"])
+        return universal_data
+
+    configs = {key: universal_data['configs'][key] for key in ('system_params', 'etf_lineup', 'strategy_settings')}
+    job = {
+        'market_dir': market_dir,
+        'configs': configs,
+        'combos': combos,
+        'rank_by': rank_by,
+        'hit_horizon': hit_horizon,
+        'workers': resolve_workers(system_settings, len(combos)),
+        'base_key': _digest({'configs': _configs_payload(configs), 'combos': combos, 'rank_by': rank_by,
+                             'hit_horizon': hit_horizon, 'etfs': market['etfs']})
+    }
+    result = walk_forward(market, folds, job, os.path.join(cache_dir, 'walk_forward', job['base_key'][:24]))
+    universal_data['analysis']['walk_forward'] = result
+
+    summary = result['summary']
+    log.info(f"Walk-forward: {summary['folds']} folds ({summary['folds_evaluated']} evaluated, rest cached) | "
+             f"OOS return {summary['oos_return_%']}% | OOS max DD {summary['oos_max_drawdown_%']}%", tags=["WALKFWD", "SUCCESS"])
+    _save_results(universal_data, result)
+    return universal_data
+
+
+def build_folds(n_weeks: int, in_sample: int, out_of_sample: int) -> List[Tuple[int, int, int]]:
+    """
+    (in-sample start, in-sample end = out-of-sample start, out-of-sample end) week indexes.
+    Windows roll forward by 'out_of_sample' weeks; the newest out-of-sample window may be partial.
+    """
+    folds = []
+    start = 0
+    while start + in_sample < n_weeks:
+        folds.append((start, start + in_sample, min(start + in_sample + out_of_sample, n_weeks)))
+        start += out_of_sample
+    return folds
+
+
+def walk_forward(market: Dict[str, Any], folds: List[Tuple[int, int, int]], job: Dict[str, Any], folds_dir: str) -> Dict[str, Any]:
+    """
+    Evaluates the folds in order, reusing cached fold results whose inputs are unchanged.
+    Returns {'summary': {...}, 'folds_df': DataFrame, 'equity_df': DataFrame}.
+    """
+    os.makedirs(folds_dir, exist_ok=True)
+    validity = int(job['configs']['strategy_settings'].get('execution_params', {}).get('gtt_validity_days', 7))
+    rows, curves, used = [], [], set()
+    prev_key, state, evaluated = '', None, 0
+
+    for k, (is_start, is_end, oos_end) in enumerate(folds):
+        # 1. In-sample: rank the candidates, keep the winner
+        is_key = _digest([job['base_key'], _slice_key(market, is_start, is_end, validity)])
+        is_path = os.path.join(folds_dir, FOLD_FILE.format(kind='is', key=is_key[:24]))
+        in_sample = _read_fold(is_path, is_key)
+        if in_sample is None:
+            ranked = evaluate_combinations(job['market_dir'], job['configs'], job['combos'], job['hit_horizon'],
+                                           job['workers'], job['rank_by'], window=(is_start, is_end))
+            if ranked.empty:
+                log.error(f"Fold {k}: every candidate failed in-sample.", tags=["WALKFWD", "ERROR"])
+                break
+            best = ranked.iloc[0]
+            in_sample = {'key': is_key, 'params': {name: _plain(best[name]) for name in job['combos'][0]},
+                         'score': _plain(best[job['rank_by']])}
+            _write_fold(is_path, in_sample)
+
+        # 2. Out-of-sample: trade the winner, continuing from the previous fold's positions
+        oos_key = _digest([is_key, prev_key, _slice_key(market, is_end, oos_end, validity)])
+        oos_path = os.path.join(folds_dir, FOLD_FILE.format(kind='oos', key=oos_key[:24]))
+        out_sample = _read_fold(oos_path, oos_key)
+        cached = out_sample is not None
+        if not cached:
+            window = slice_market(market, is_end, oos_end, validity)
+            result = replay(window, apply_overrides(job['configs'], in_sample['params']), job['hit_horizon'], state=state)
+            out_sample = {'key': oos_key, 'summary': result['summary'], 'state': result['state'],
+                          'equity': result['equity_df'].reset_index().astype({'Week': str}).to_dict('list')}
+            _write_fold(oos_path, out_sample)
+            evaluated += 1
+
+        used |= {os.path.basename(is_path), os.path.basename(oos_path)}
+        prev_key, state = oos_key, out_sample['state']
+        summary = out_sample['summary']
+        rows.append({
+            'Fold': k + 1,
+            'IS_Start': str(market['weeks'][is_start].date()),
+            'OOS_Start': str(market['weeks'][is_end].date()),
+            'OOS_End': str(market['weeks'][oos_end - 1].date()),
+            **in_sample['params'],
+            f"IS_{job['rank_by']}": in_sample['score'],
+            'OOS_Return_%': summary['total_return_%'],
+            'OOS_Max_DD_%': summary['max_drawdown_%'],
+            'OOS_Fill_Rate_%': summary['fill_rate_%'],
+            'OOS_Buy_Hit_Rate_%': summary['buy_hit_rate_%'],
+            'Cached': cached
+        })
+        curves.append(pd.DataFrame(out_sample['equity']))
+
+    _prune(folds_dir, used)
+    return {'summary': _summarize(curves, len(rows), evaluated), 'folds_df': pd.DataFrame(rows), 'equity_df': _stitch(curves)}
+
+
+# --- Helpers ---
+
+
+def _slice_key(market: Dict[str, Any], start: int, end: int, validity_days: int) -> str:
+    """Content hash of the data a replay of weeks [start, end) reads."""
+    window = slice_market(market, start, end, validity_days)
+    first_day = window['day_ts'].searchsorted(window['weeks'][0], side='right')
+    digest = hashlib.sha256(json.dumps([str(window['weeks'][0]), str(window['weeks'][-1]), market['fields']]).encode())
+    for name in ('weekly', 'daily_asof', 'close'):
+        digest.update(np.ascontiguousarray(window[name]).tobytes())
+    for name in ('day_open', 'day_low'):
+        digest.update(np.ascontiguousarray(window[name][first_day:]).tobytes())
+    return digest.hexdigest()
+
+
+def _configs_payload(configs: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-able view of the replay configs (DataFrames as column lists)."""
+    return {key: value.to_dict('list') if isinstance(value, pd.DataFrame) else value for key, value in configs.items()}
+
+
+def _digest(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _plain(value: Any) -> Any:
+    """numpy scalar -> Python scalar (JSON)."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _read_fold(path: str, key: str) -> Any:
+    try:
+        with open(path, 'r') as f:
+            fold = json.load(f)
+        return fold if fold.get('key') == key else None
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_fold(path: str, fold: Dict[str, Any]) -> None:
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(fold, f, default=lambda value: _plain(value) if isinstance(value, np.generic) else str(value))
+    os.replace(f"{path}.tmp", path)
+
+
+def _prune(folds_dir: str, used: set) -> None:
+    """Drops fold files of this candidate set ('folds_dir') no longer referenced by its current fold chain."""
+    for name in os.listdir(folds_dir):
+        if name.endswith('.json') and name not in used:
+            os.remove(os.path.join(folds_dir, name))
+
+
+def _stitch(curves: List[pd.DataFrame]) -> pd.DataFrame:
+    """Chained out-of-sample equity curve with drawdown."""
+    if not curves:
+        return pd.DataFrame(columns=['Equity', 'S2_Value', 'Drawdown_%'])
+    equity_df = pd.concat(curves, ignore_index=True).set_index('Week')[['Equity', 'S2_Value']]
+    equity_df['Drawdown_%'] = (equity_df['Equity'] / equity_df['Equity'].cummax() - 1.0) * 100.0
+    return equity_df
+
+
+def _summarize(curves: List[pd.DataFrame], folds: int, evaluated: int) -> Dict[str, Any]:
+    equity_df = _stitch(curves)
+    if equity_df.empty:
+        return {'folds': folds, 'folds_evaluated': evaluated, 'oos_return_%': None, 'oos_max_drawdown_%': None}
+    start, final = float(equity_df['Equity'].iloc[0]), float(equity_df['Equity'].iloc[-1])
+    return {
+        'folds': folds,
+        'folds_evaluated': evaluated,
+        'oos_start': str(equity_df.index[0])[:10],
+        'oos_end': str(equity_df.index[-1])[:10],
+        'oos_return_%': round((final / start - 1.0) * 100.0, 2),
+        'oos_max_drawdown_%': round(float(equity_df['Drawdown_%'].min()), 2),
+        'final_equity': round(final, 2)
+    }
+
+
+def _save_results(universal_data: Dict[str, Any], result: Dict[str, Any]) -> None:
+    paths = universal_data['configs']['system_settings']['paths']
+    out_dir = os.path.join(universal_data['system']['project_root'], paths.get('backtest_output_dir', 'source/data/backtests'))
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    result['folds_df'].to_csv(os.path.join(out_dir, f"walk_forward_{stamp}_folds.csv"), index=False)
+    result['equity_df'].to_csv(os.path.join(out_dir, f"walk_forward_{stamp}_equity.csv"))
+    with open(os.path.join(out_dir, f"walk_forward_{stamp}_summary.json"), 'w') as f:
+        json.dump(result['summary'], f, indent=2, default=str)
+    log.info(f"Walk-forward results saved to {out_dir}", tags=["WALKFWD", "SAVE"])
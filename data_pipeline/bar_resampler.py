@@ -0,0 +1,200 @@
+# data_pipeline/bar_resampler.py
+
+"""
+CASCADING BAR RESAMPLER.
+Builds 1h bars from 1m, 1d from 1h and 1W-FRI from 1d in a single pass, and keeps the
+result in an on-disk bar cache per ETF ({bar_cache_dir}/{ETF}/{tf}.parquet + _meta.json).
+Later runs only rebuild from the start of the last (possibly still forming) coarsest bar,
+or from the earliest point the OHLCV store changed underneath the cache (backfills),
+always widened to the start of the coarsest bar containing it.
+"""
+
+import json
+import os
+import pandas as pd
+from typing import Dict, Any, List, Optional
+from utils.logger import setup_logger
+from data_pipeline.ohlcv_store import MARKET_TZ, get_manifest, read_ohlcv
+
+log = setup_logger()
+
+REQUIRED_COLS = ['open', 'high', 'low', 'close', 'volume']
+AGG = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+
+# (timeframe, pandas rule, bar label -> period start); each level is built from the previous one
+CASCADE = [
+    ('1h', '1h', pd.Timedelta(0)),
+    ('1d', '1D', pd.Timedelta(0)),
+    ('1W', '1W-FRI', pd.Timedelta(days=6)),  # Weekly bars are labelled on the Friday closing the week
+]
+CASCADE_TFS = [tf for tf, _, _ in CASCADE]
+DIRECT_RULES = {'1m': '1min'}
+META_FILE = '_meta.json'
+
+
+def resample_cascade(df_1m: pd.DataFrame, depth: int = len(CASCADE)) -> Dict[str, pd.DataFrame]:
+    """Resamples 1m bars through the first 'depth' cascade levels. Returns {tf: bars}."""
+    bars = {}
+    source = df_1m
+    for tf, rule, _ in CASCADE[:depth]:
+        source = source.resample(rule).agg(AGG).dropna()
+        bars[tf] = source
+    return bars
+
+
+def load_bars(store_path: str, cache_dir: str, timeframes: List[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Returns {tf: bars} for the requested timeframes.
+    Cascade timeframes come from the bar cache with only the stale tail rebuilt from 1m;
+    any other timeframe is resampled directly from the full 1m history.
+    """
+    bars = {}
+    depth = max((CASCADE_TFS.index(tf) + 1 for tf in timeframes if tf in CASCADE_TFS), default=0)
+    if depth:
+        bars.update(_load_cascade(store_path, cache_dir, depth))
+
+    others = [tf for tf in timeframes if tf not in CASCADE_TFS]
+    if others:
+        df_1m = read_ohlcv(store_path, columns=REQUIRED_COLS)
+        for tf in others:
+            bars[tf] = df_1m.resample(DIRECT_RULES.get(tf, tf)).agg(AGG).dropna()
+
+    return {tf: bars[tf] for tf in timeframes if tf in bars}
+
+
+def source_signature(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """What a consumer of the store records to detect later changes (see source_changed_from)."""
+    return {
+        'source_last_ts': manifest.get('last_ts'),
+        'months': _month_signatures(manifest),
+        'verified_gaps': manifest.get('verified_gaps', [])
+    }
+
+
+def source_changed_from(signature: Dict[str, Any], manifest: Dict[str, Any]) -> Optional[pd.Timestamp]:
+    """
+    Earliest timestamp at which the store may differ from 'signature' other than by appends
+    after its recorded tail, or None if only appends happened.
+    Months that changed before the tail invalidate from their first day, newly verified
+    backfill days from that day; a cleared or rewritten store from its first month.
+    """
+    old_months = signature.get('months', {})
+    new_months = _month_signatures(manifest)
+    if set(old_months) - set(new_months):
+        return pd.Timestamp(f"{min(set(old_months) | set(new_months))}-01", tz=MARKET_TZ)
+    if not signature.get('source_last_ts'):
+        return None
+
+    starts = []
+    tail_month = pd.Timestamp(signature['source_last_ts']).strftime('%Y-%m')
+    for month, month_signature in new_months.items():
+        if month < tail_month and old_months.get(month) != month_signature:
+            starts.append(pd.Timestamp(f"{month}-01", tz=MARKET_TZ))
+
+    new_days = set(manifest.get('verified_gaps', [])) - set(signature.get('verified_gaps', []))
+    if new_days:
+        starts.append(pd.Timestamp(min(new_days), tz=MARKET_TZ))
+
+    return min(starts) if starts else None
+
+
+def bin_start(ts: pd.Timestamp, tf: str) -> pd.Timestamp:
+    """
+    Start of the 'tf' bar containing 'ts', binned the way the cascade builds it
+    (a weekly bar spans Saturday 00:00 to the Friday it is labelled on).
+    Non-cascade timeframes return 'ts' unchanged.
+    """
+    if tf not in CASCADE_TFS:
+        return ts
+    for _, rule, period in CASCADE[:CASCADE_TFS.index(tf) + 1]:
+        ts = pd.Series(0, index=pd.DatetimeIndex([ts])).resample(rule).first().index[0]
+    return ts - period
+
+
+# --- Helpers ---
+
+
+def _load_cascade(store_path: str, cache_dir: str, depth: int) -> Dict[str, pd.DataFrame]:
+    levels = CASCADE_TFS[:depth]
+    manifest = get_manifest(store_path)
+    meta = _read_meta(cache_dir)
+    cached = _read_cached(cache_dir, levels) if meta and set(levels) <= set(meta.get('levels', [])) else None
+
+    rebuild_from = _rebuild_start(meta, manifest, cached, depth) if cached else None
+    fresh = resample_cascade(read_ohlcv(store_path, start=rebuild_from, columns=REQUIRED_COLS), depth)
+
+    if rebuild_from is None:
+        bars = fresh
+    else:
+        bars = {}
+        for tf in levels:
+            kept = cached[tf][cached[tf].index < rebuild_from]
+            bars[tf] = pd.concat([kept, fresh[tf]]) if not fresh[tf].empty else kept
+
+    _write_cache(cache_dir, bars, manifest)
+    return bars
+
+
+def _rebuild_start(meta: Dict[str, Any], manifest: Dict[str, Any], cached: Dict[str, pd.DataFrame], depth: int) -> Optional[pd.Timestamp]:
+    """
+    Earliest timestamp whose bars must be rebuilt, or None for a full rebuild.
+    Appends after the cached source tail only invalidate the last coarsest bar; earlier
+    changes (source_changed_from) invalidate from the start of the coarsest bar holding them,
+    so no cached bar is ever rebuilt from part of its minutes.
+    """
+    coarsest = cached[CASCADE_TFS[depth - 1]]
+    if coarsest.empty or not meta.get('source_last_ts'):
+        return None
+    starts = [coarsest.index[-1]]
+
+    changed = source_changed_from(meta, manifest)
+    if changed is not None:
+        starts.append(changed.tz_convert(coarsest.index.tz))
+
+    return bin_start(min(starts), CASCADE_TFS[depth - 1])
+
+
+def _month_signatures(manifest: Dict[str, Any]) -> Dict[str, str]:
+    """Per-month rows and time span; unchanged by compaction, changed by any new data."""
+    months = {}
+    for rel, seg in manifest.get('segments', {}).items():
+        month = rel.replace(os.sep, '/').split('/')[0]
+        rows, first, last = months.get(month, (0, None, None))
+        firsts = [t for t in (first, seg['first_ts']) if t]
+        lasts = [t for t in (last, seg['last_ts']) if t]
+        months[month] = (
+            rows + seg['rows'],
+            min(firsts, key=pd.Timestamp) if firsts else None,
+            max(lasts, key=pd.Timestamp) if lasts else None
+        )
+    return {m: f"{rows}:{first}:{last}" for m, (rows, first, last) in months.items()}
+
+
+def _read_meta(cache_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(cache_dir, META_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _read_cached(cache_dir: str, levels: List[str]) -> Optional[Dict[str, pd.DataFrame]]:
+    try:
+        return {tf: pd.read_parquet(os.path.join(cache_dir, f"{tf}.parquet")) for tf in levels}
+    except Exception as e:
+        log.warning(f"Bar cache unreadable in {cache_dir} ({e}), rebuilding.", tags=["CALC", "CACHE"])
+        return None
+
+
+def _write_cache(cache_dir: str, bars: Dict[str, pd.DataFrame], manifest: Dict[str, Any]) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    for tf, df in bars.items():
+        path = os.path.join(cache_dir, f"{tf}.parquet")
+        df.to_parquet(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    meta = {'levels': list(bars), **source_signature(manifest)}
+    path = os.path.join(cache_dir, META_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,82 @@
+# data_pipeline/gap_scanner.py
+
+"""
+OHLCV GAP SCANNER.
+Compares stored 1-minute bars against the NSE trading calendar and returns the
+exact trading-day ranges that are missing or under-filled, so the downloader
+can backfill only those instead of a full resync.
+Bar counts come from the per-day counts in the store manifest, so a scan reads no candle data.
+"""
+
+import pandas as pd
+from datetime import date, datetime
+from typing import List, Tuple
+from utils.logger import setup_logger
+from data_pipeline.ohlcv_store import get_manifest, get_session_bar_counts, read_ohlcv
+from data_pipeline.trading_calendar import DEFAULT_SESSION, TradingCalendar
+
+log = setup_logger()
+
+
+def find_missing_ranges(store_path: str, calendar: TradingCalendar, min_coverage: float, until: date) -> List[Tuple[date, date]]:
+    """
+    Returns [(start_date, end_date), ...] of trading days between the first stored
+    day and min(last stored day, until) whose in-session bar count is below
+    min_coverage * bars_per_session. Days already verified by a backfill are skipped.
+    """
+    manifest = get_manifest(store_path)
+    if not manifest['first_ts']:
+        return []
+
+    first_day = pd.Timestamp(manifest['first_ts']).date()
+    last_day = min(pd.Timestamp(manifest['last_ts']).date(), until)
+    expected = calendar.trading_days(first_day, last_day)
+    if expected.empty:
+        return []
+
+    counts = _bars_per_day(store_path, calendar, first_day).reindex(expected, fill_value=0)
+    threshold = max(1, min_coverage * calendar.bars_per_session)
+    missing = counts.index[counts.to_numpy() < threshold]
+
+    verified = pd.to_datetime(manifest.get('verified_gaps', []))
+    missing = missing[~missing.isin(verified)]
+
+    return _coalesce(expected, missing)
+
+
+# --- Helpers ---
+
+
+def _bars_per_day(store_path: str, calendar: TradingCalendar, first_day: date) -> pd.Series:
+    """
+    In-session bar count per day. Taken from the manifest's per-segment counts; only a
+    calendar with non-default session hours falls back to reading the timestamp column.
+    """
+    if (calendar.session_open, calendar.session_close) == DEFAULT_SESSION:
+        counts = get_session_bar_counts(store_path)
+        return pd.Series(list(counts.values()), index=pd.to_datetime(list(counts.keys())), dtype='int64')
+
+    idx = read_ohlcv(store_path, start=pd.Timestamp(first_day), columns=[]).index.tz_localize(None)
+    open_t = datetime.strptime(calendar.session_open, '%H:%M').time()
+    close_t = datetime.strptime(calendar.session_close, '%H:%M').time()
+    in_session = idx[(idx.time >= open_t) & (idx.time < close_t)]
+    return pd.Series(1, index=in_session.normalize()).groupby(level=0).size()
+
+
+def _coalesce(expected: pd.DatetimeIndex, missing: pd.DatetimeIndex) -> List[Tuple[date, date]]:
+    """Groups missing days that are consecutive trading days into ranges."""
+    if missing.empty:
+        return []
+
+    positions = expected.get_indexer(missing)
+    ranges = []
+    run_start = prev = positions[0]
+
+    for pos in positions[1:]:
+        if pos != prev + 1:
+            ranges.append((expected[run_start].date(), expected[prev].date()))
+            run_start = pos
+        prev = pos
+
+    ranges.append((expected[run_start].date(), expected[prev].date()))
+    return ranges
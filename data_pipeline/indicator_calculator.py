@@ -2,187 +2,355 @@
 
 """
 INDICATOR CALCULATION ENGINE.
-Computes technical indicators (RSI, TSI, etc.) using pandas-ta.
-Generates 'snapshot' for Decision Engine and saves history to Parquet.
+Computes technical indicators (RSI, TSI, etc.) with the native indicator engine,
+batching all ETFs of a timeframe into one calculation, or one ETF per worker
+process when 'compute.indicator_workers' > 1.
+Resumes each ETF/timeframe from persisted state so runs only process new bars (state is
+dropped when the 1m store changed before its resume point, e.g. a gap backfill), and skips series whose input bars and indicator config are unchanged (content-addressed cache).
+Generates 'snapshot' for Decision Engine and appends history to the partitioned
+indicator dataset (indicator_store.py).
 """
 
-import pandas as pd
-import pandas_ta as ta
+import hashlib
 import json
+import pandas as pd
 import os
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
 from tqdm import tqdm
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from utils.logger import setup_logger
+from data_pipeline.bar_resampler import bin_start, load_bars, source_changed_from, source_signature
+from data_pipeline.ohlcv_store import get_manifest
+from data_pipeline.indicator_store import get_history_dir, read_history, read_manifest, read_snapshot, write_series, write_snapshot
+from data_pipeline.indicator_snapshot import IndicatorSnapshot
+from data_pipeline.indicator_engine import compute_batch, SUPPORTED_INDICATORS, STATE_VERSION
 
 log = setup_logger()
-REQUIRED_COLS = ['open', 'high', 'low', 'close', 'volume']
 
 
 def process_indicator_calculation(universal_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Main Entry Point: Computes indicators for all ETFs and timeframes.
-    Skips if data hasn't changed since last calculation.
+    Series whose input (1m store last timestamp + row count) and indicator config are
+    unchanged since they were stored are cache hits and are not recalculated.
     """
     log.info("=== INDICATOR CALCULATION STARTED ===", tags=["CALC", "START"])
-    
-    # Check if we should skip
+   
     force_recalc = universal_data['system']['debug_flags'].get('force_indicator_recalc', False)
-    
-    if not force_recalc:
-        # Check if parquet history exists and is recent
-        history_path = os.path.join(universal_data['system']['project_root'], 'source', 'data', 'indicator_history.parquet')
-        if os.path.exists(history_path):
-            file_mtime = datetime.fromtimestamp(os.path.getmtime(history_path))
-            # If calculated within last hour, skip
-            if (datetime.now() - file_mtime).total_seconds() < 3600:
-                log.info(f"Indicator cache fresh ({file_mtime.strftime('%H:%M')}), loading from parquet", tags=["CALC", "SKIP"])
-                try:
-                    full_df = pd.read_parquet(history_path)
-                    # Extract latest snapshot
-                    snapshot_rows = []
-                    for (etf, tf), group in full_df.groupby(['ETF', 'Timeframe']):
-                        snapshot_rows.append(group.iloc[-1])
-                    if snapshot_rows:
-                        universal_data['market_data']['indicator_snapshot_df'] = pd.DataFrame(snapshot_rows)
-                        log.info(f"Loaded snapshot: {len(snapshot_rows)} rows from cache", tags=["CALC", "CACHE"])
-                        return universal_data
-                except Exception as e:
-                    log.warning(f"Cache load failed: {e}, recalculating", tags=["CALC", "WARNING"])
+   
+    # Let the sync's background compaction finish before any store is read (or a worker started)
+    compaction = universal_data['market_data'].get('ohlcv_compaction')
+    if compaction is not None:
+        compaction.join()
+        universal_data['market_data']['ohlcv_compaction'] = None
    
     # Configs
     universe = universal_data['configs']['universe_settings']
     indicators_config = universal_data['configs']['indicator_settings']
     ohlcv_paths = universal_data['market_data']['ohlcv_file_paths']
+    system_settings = universal_data['configs']['system_settings']
    
     etfs = universe['etfs_to_track']
     timeframes = universe['timeframes_to_calculate']
    
-    all_snapshots = []
-    full_history_dfs = []
+    history_dir = get_history_dir(universal_data)
+    universal_data['market_data']['indicator_history_path'] = history_dir
+   
+    # Incremental mode: resume each ETF/timeframe from its persisted indicator state
+    incremental = not force_recalc and system_settings['cache_policies'].get('indicator_incremental', True)
+    state_dir = os.path.join(universal_data['system']['project_root'],
+                             system_settings['paths'].get('indicator_state_dir', 'source/data/indicator_state'))
+    bar_cache_dir = os.path.join(universal_data['system']['project_root'],
+                                 system_settings['paths'].get('bar_cache_dir', 'source/data/bar_cache'))
+    config_key = _config_key(indicators_config)
+    stored_series = read_manifest(history_dir)['series']
    
-    for etf in tqdm(etfs, desc="Calc Indicators"):
+    unsupported = sorted({ind.get('name') for ind in indicators_config if ind.get('name') not in SUPPORTED_INDICATORS})
+    if unsupported:
+        log.warning(f"No native implementation for {unsupported}, skipping.", tags=["CALC", "WARNING"])
+   
+    # 1. Cache check: compare each series' input key with the one stored alongside its history
+    job = {
+        'bar_cache_dir': bar_cache_dir,
+        'state_dir': state_dir,
+        'config_key': config_key,
+        'config': indicators_config
+    }
+    sources = {}
+    input_keys = {}
+    cached = []
+    for etf in etfs:
         path = ohlcv_paths.get(etf)
         if not path or not os.path.exists(path):
             continue
+        store_manifest = get_manifest(path)
+        stale = []
+        for tf in timeframes:
+            input_keys[(etf, tf)] = _input_key(store_manifest, tf, config_key)
+            stored = stored_series.get(f"{etf}/{tf}")
+            if not force_recalc and stored and stored.get('input_key') == input_keys[(etf, tf)]:
+                cached.append((etf, tf))
+            else:
+                stale.append(tf)
+        if stale:
+            resumable = [tf for tf in stale if incremental and f"{etf}/{tf}" in stored_series]
+            sources[etf] = (path, stale, resumable)
            
-        try:
-            # 1. Load & Prep Data
-            df_1m = _load_and_prep_ohlcv(path)
-            if df_1m.empty:
+    log.info(f"Indicator cache: {len(cached)} series unchanged, {sum(len(v[1]) for v in sources.values())} to calculate.", tags=["CALC", "CACHE"])
+   
+    # 2. Load, Resample & Calculate Indicators (process pool or one batch per timeframe)
+    workers = _resolve_workers(system_settings, len(sources))
+    if workers > 1:
+        log.info(f"Calculating {len(sources)} ETFs on {workers} worker processes.", tags=["CALC", "PARALLEL"])
+        results = _calculate_parallel(sources, job, workers)
+    elif sources:
+        results = _calculate_serial(sources, job)
+    else:
+        results = {}
+   
+    snapshot_rows = {}
+    written = 0
+    resumed = 0
+   
+    for etf in etfs:
+        for tf, (df_new, new_state, state) in results.get(etf, {}).items():
+            if state:
+                resumed += 1
+            if df_new.empty:
                 continue
+           
+            # 3. Store History (resumed series only replace rows from their first new bar)
+            try:
+                write_series(history_dir, etf, tf, df_new, replace_from=df_new.index[0] if state else None,
+                             input_key=input_keys[(etf, tf)])
+                written += len(df_new)
+            except Exception as e:
+                log.error(f"History write failed for {etf} {tf}: {e}", tags=["CALC", "ERROR"])
+                continue
+            if new_state:
+                _save_state(state_dir, etf, tf, new_state)
+           
+            # 4. Tag & store latest row for Snapshot
+            latest = df_new.iloc[[-1]].reset_index()
+            latest['ETF'] = etf
+            latest['Timeframe'] = tf
+            snapshot_rows[(etf, tf)] = latest
+           
+    # Cache hits contribute their latest row from the snapshot artifact (history read as fallback)
+    artifact_stale = bool(snapshot_rows)
+    if cached:
+        artifact = _index_snapshot(read_snapshot(history_dir))
+        for etf, tf in cached:
+            latest = artifact.get((etf, tf))
+            if latest is None or latest['input_key'].iloc[0] != input_keys[(etf, tf)]:
+                latest = _read_latest_row(history_dir, etf, tf, stored_series[f"{etf}/{tf}"])
+                artifact_stale = True
+            if latest is not None:
+                snapshot_rows[(etf, tf)] = latest.drop(columns=['input_key'], errors='ignore')
                
-            for tf in timeframes:
-                # 2. Resample
-                df_resampled = _resample_data(df_1m, tf)
-                if df_resampled.empty:
-                    continue
-               
-                # 3. Calculate Indicators
-                df_calc = _apply_indicators(df_resampled, indicators_config)
-               
-                # 4. Tag Data
-                df_calc['ETF'] = etf
-                df_calc['Timeframe'] = tf
-               
-                # 5. Store latest row for Snapshot
-                latest = df_calc.iloc[[-1]].copy()
-                all_snapshots.append(latest)
-               
-                # 6. Store for History (optional, can be large)
-                # Reset index to keep timestamp column
-                full_history_dfs.append(df_calc.reset_index())
-               
-        except Exception as e:
-            log.error(f"Calc failed for {etf}: {e}", tags=["CALC", "ERROR"])
-    # Combine Snapshots
-    if all_snapshots:
-        snapshot_df = pd.concat(all_snapshots, ignore_index=True)
+    if incremental:
+        log.info(f"Incremental: {resumed} ETF/timeframe series resumed from saved state.", tags=["CALC", "INCREMENTAL"])
+    # Combine Snapshots (ETF-major, configured timeframe order)
+    ordered = [snapshot_rows[(etf, tf)] for etf in etfs for tf in timeframes if (etf, tf) in snapshot_rows]
+    if ordered:
+        snapshot_df = pd.concat(ordered, ignore_index=True)
         universal_data['market_data']['indicator_snapshot_df'] = snapshot_df
+        universal_data['market_data']['indicator_snapshot'] = IndicatorSnapshot(snapshot_df)
         log.info(f"Snapshot created: {len(snapshot_df)} rows.", tags=["CALC", "SNAPSHOT"])
+        if artifact_stale:
+            keys = [input_keys[(etf, tf)] for etf, tf in zip(snapshot_df['ETF'], snapshot_df['Timeframe'])]
+            write_snapshot(history_dir, snapshot_df.assign(input_key=keys))
     else:
         universal_data['market_data']['indicator_snapshot_df'] = pd.DataFrame()
+        universal_data['market_data']['indicator_snapshot'] = IndicatorSnapshot(universal_data['market_data']['indicator_snapshot_df'])
         log.warning("No snapshot data generated.", tags=["CALC", "WARNING"])
-    # Save Full History (Parquet)
-    if full_history_dfs:
-        _save_history_parquet(universal_data, full_history_dfs)
+    log.info(f"History: {written} rows written to {os.path.basename(history_dir)}/", tags=["CALC", "HISTORY"])
     return universal_data
 
 
-def _load_and_prep_ohlcv(path: str) -> pd.DataFrame:
-    """Loads JSON, converts to DataFrame with DatetimeIndex."""
-    try:
-        with open(path, 'r') as f:
-            data = json.load(f)
-       
-        # Upstox format: [timestamp, open, high, low, close, volume, oi]
-        df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'oi'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df.set_index('timestamp', inplace=True)
-       
-        # Ensure numeric
-        cols = ['open', 'high', 'low', 'close', 'volume']
-        df[cols] = df[cols].apply(pd.to_numeric)
-       
-        return df[cols]
-    except:
-        return pd.DataFrame()
+def _calculate_serial(sources: Dict[str, Tuple[str, List[str], List[str]]], job: Dict[str, Any]) -> Dict[str, Dict[str, tuple]]:
+    """Loads every ETF, then calculates each timeframe for all ETFs in one engine batch."""
+    batches = {}
+    for etf, (path, timeframes, resumable) in tqdm(sources.items(), desc="Load & Resample"):
+        try:
+            for tf, series in _prepare_etf(etf, path, timeframes, resumable, job).items():
+                batches.setdefault(tf, []).append(series)
+        except Exception as e:
+            log.error(f"Load failed for {etf}: {e}", tags=["CALC", "ERROR"])
+           
+    results = {}
+    for tf, batch in batches.items():
+        if not batch:
+            continue
+        try:
+            calculated = _calculate_batch(batch, job['config'], job['config_key'])
+        except Exception as e:
+            log.error(f"Calc failed for {tf}: {e}", tags=["CALC", "ERROR"])
+            continue
+        for series, (df_new, new_state) in zip(batch, calculated):
+            results.setdefault(series['etf'], {})[tf] = (df_new, new_state, series['state'])
+    return results
 
 
-def _resample_data(df: pd.DataFrame, timeframe: str) -> pd.DataFrame:
-    """Resamples 1m data to target timeframe (e.g., '1W')."""
-    # Map config timeframe to pandas offset aliases
-    # 1d -> 1D, 1W -> 1W, 1h -> 1h
-    tf_map = {'1m': '1min', '1h': '1h', '1d': '1D', '1W': '1W-FRI'}
-    # Note: 1W-FRI aligns weekly candles to Friday close
-   
-    rule = tf_map.get(timeframe, timeframe)
-   
-    agg_dict = {
-        'open': 'first',
-        'high': 'max',
-        'low': 'min',
-        'close': 'last',
-        'volume': 'sum'
-    }
-   
-    try:
-        resampled = df.resample(rule).agg(agg_dict).dropna()
-        return resampled
-    except:
-        return pd.DataFrame()
+def _calculate_parallel(sources: Dict[str, Tuple[str, List[str], List[str]]], job: Dict[str, Any], workers: int) -> Dict[str, Dict[str, tuple]]:
+    """
+    Runs one ETF per process-pool task; the main process only collects results.
+    Workers are spawned, not forked, so they never inherit a store lock held by another thread.
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        futures = {
+            pool.submit(_calculate_etf, etf, path, timeframes, resumable, job): etf
+            for etf, (path, timeframes, resumable) in sources.items()
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Calc Indicators"):
+            etf = futures[future]
+            try:
+                results[etf] = future.result()
+            except Exception as e:
+                log.error(f"Calc failed for {etf}: {e}", tags=["CALC", "ERROR"])
+    return results
 
 
-def _apply_indicators(df: pd.DataFrame, config: List[Dict]) -> pd.DataFrame:
-    """Applies pandas-ta indicators based on config."""
-    # Pandas-TA requires lowercase columns
-   
-    for ind in config:
-        name = ind.get('name')
-        params = ind.get('params', {})
+def _calculate_etf(etf: str, path: str, timeframes: List[str], resumable: List[str], job: Dict[str, Any]) -> Dict[str, tuple]:
+    """Process-pool task: load, resample and calculate the given timeframes of one ETF."""
+    results = {}
+    for tf, series in _prepare_etf(etf, path, timeframes, resumable, job).items():
+        (df_new, new_state), = _calculate_batch([series], job['config'], job['config_key'])
+        results[tf] = (df_new, new_state, series['state'])
+    return results
+
+
+def _resolve_workers(system_settings: Dict[str, Any], etf_count: int) -> int:
+    """Configured worker count (0 = one per CPU), never more than there are ETFs."""
+    workers = system_settings.get('compute', {}).get('indicator_workers', 1)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, etf_count))
+
+
+def _prepare_etf(etf: str, path: str, timeframes: List[str], resumable: List[str], job: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Loads one ETF's resampled bars per timeframe.
+    Returns {tf: series}, where a series carries the bars still to calculate and the
+    saved state they continue from (None = full history). Only timeframes listed in
+    'resumable' (those with previous history rows) may continue from state, and only if
+    the store has not changed at or before the state's last closed bar since it was saved.
+    """
+    # Resume points (timeframes without usable state are fully recomputed)
+    manifest = get_manifest(path)
+    states = {}
+    for tf in resumable:
+        state = _load_state(job['state_dir'], etf, tf, job['config_key'])
+        if state and _state_is_current(state, manifest, tf):
+            states[tf] = state
+        elif state:
+            log.info(f"{etf} {tf}: source bars changed before the saved state, recalculating fully.", tags=["CALC", "INCREMENTAL"])
        
-        # Skip if not enabled (if 'enabled' key exists)
-        if not ind.get('enabled', True):
+    # Cascading resample; only bars newer than the cached ones are rebuilt from 1m
+    try:
+        resampled = load_bars(path, os.path.join(job['bar_cache_dir'], etf), timeframes)
+    except Exception as e:
+        log.warning(f"Resample failed for {etf}: {e}", tags=["CALC", "WARNING"])
+        return {}
+   
+    prepared = {}
+    for tf, bars in resampled.items():
+        if bars.empty:
             continue
-           
-        try:
-            # Dynamic call to df.ta.indicator()
-            if hasattr(df.ta, name):
-                getattr(df.ta, name)(append=True, **params)
-        except Exception as e:
-            # Log warning but don't crash
-            # log.warning(f"Indicator {name} failed: {e}")
-            pass
-           
-    return df
+        state = states.get(tf)
+        if state:
+            bars = bars[bars.index > pd.Timestamp(state['last_closed_ts'])]
+        prepared[tf] = {'etf': etf, 'bars': bars, 'state': state, 'source': source_signature(manifest)}
+    return prepared
+
+
+def _state_is_current(state: Dict[str, Any], manifest: Dict[str, Any], tf: str) -> bool:
+    """False if the 1m store changed (backfill, rewrite) inside or before the state's last closed bar."""
+    if 'source' not in state:
+        return False  # Saved before source tracking; cannot tell what it was built from
+    changed = source_changed_from(state['source'], manifest)
+    if changed is None:
+        return True
+    return bin_start(changed, tf) > pd.Timestamp(state['last_closed_ts'])
 
 
-def _save_history_parquet(universal_data: Dict[str, Any], dfs: List[pd.DataFrame]):
-    """Saves full history to parquet for analysis."""
+def _calculate_batch(batch: List[Dict[str, Any]], config: List[Dict], config_key: str) -> List[Tuple[pd.DataFrame, Optional[Dict[str, Any]]]]:
+    """
+    Runs the native engine over every series of one timeframe, continuing from saved state.
+    The final bar of a series may still be forming (current week/day/hour), so the state
+    kept is the one after the second-to-last bar; the next run recomputes from there.
+    Returns [(rows, new state or None if nothing closed), ...] in batch order.
+    """
+    engine_states = [s['state']['indicators'] if s['state'] else None for s in batch]
+    closed_rows, closed_states = compute_batch([s['bars'].iloc[:-1] for s in batch], config, engine_states)
+    last_rows, _ = compute_batch([s['bars'].iloc[-1:] for s in batch], config, closed_states)
+   
+    results = []
+    for series, closed, last, closed_state in zip(batch, closed_rows, last_rows, closed_states):
+        bars = series['bars']
+        rows = pd.concat([closed, last]) if not closed.empty else last
+        new_state = None
+        if len(bars) >= 2:
+            new_state = {
+                'last_closed_ts': bars.index[-2].isoformat(),
+                'config_key': config_key,
+                'source': series['source'],
+                'indicators': closed_state
+            }
+        results.append((rows, new_state))
+    return results
+
+
+def _input_key(store_manifest: Dict[str, Any], tf: str, config_key: str) -> str:
+    """Cache key of one series: source bars' last timestamp and row count, timeframe and indicator config."""
+    payload = f"{store_manifest.get('last_ts')}|{store_manifest.get('rows')}|{tf}|{config_key}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _read_latest_row(history_dir: str, etf: str, tf: str, entry: Dict[str, Any]) -> Optional[pd.DataFrame]:
+    """Last stored row of a series; only the partition holding 'last_ts' is read."""
+    if not entry.get('last_ts'):
+        return None
     try:
-        full_df = pd.concat(dfs, ignore_index=True)
-        path = os.path.join(universal_data['system']['project_root'], 'source', 'data', 'indicator_history.parquet')
-        full_df.to_parquet(path, compression='snappy')
-        log.info(f"Saved full history to {os.path.basename(path)}", tags=["CALC", "HISTORY"])
+        df = read_history(history_dir, etfs=[etf], timeframes=[tf], start=pd.Timestamp(entry['last_ts']))
+        return df.iloc[[-1]].reset_index(drop=True) if not df.empty else None
     except Exception as e:
-        log.error(f"Failed to save parquet: {e}", tags=["CALC", "ERROR"])
\ No newline at end of file
+        log.warning(f"Cached row unreadable for {etf} {tf}: {e}", tags=["CALC", "WARNING"])
+        return None
+
+
+def _index_snapshot(artifact: pd.DataFrame) -> Dict[Tuple[str, str], pd.DataFrame]:
+    """Snapshot artifact rows keyed by (ETF, Timeframe); rows without an input key are ignored."""
+    if artifact.empty or 'input_key' not in artifact.columns:
+        return {}
+    return {(etf, tf): artifact.iloc[[i]].reset_index(drop=True)
+            for i, (etf, tf) in enumerate(zip(artifact['ETF'], artifact['Timeframe']))}
+
+
+def _config_key(config: List[Dict]) -> str:
+    payload = {'engine': STATE_VERSION, 'indicators': config}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _state_path(state_dir: str, etf: str, tf: str) -> str:
+    return os.path.join(state_dir, f"{etf}_{tf}.json")
+
+
+def _load_state(state_dir: str, etf: str, tf: str, config_key: str) -> Optional[Dict[str, Any]]:
+    """Returns saved state if it exists and was built with the current indicator config."""
+    try:
+        with open(_state_path(state_dir, etf, tf), 'r') as f:
+            state = json.load(f)
+        return state if state.get('config_key') == config_key else None
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _save_state(state_dir: str, etf: str, tf: str, state: Dict[str, Any]) -> None:
+    os.makedirs(state_dir, exist_ok=True)
+    path = _state_path(state_dir, etf, tf)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
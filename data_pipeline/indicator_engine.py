@@ -0,0 +1,484 @@
+# data_pipeline/indicator_engine.py
+
+"""
+NATIVE INDICATOR ENGINE.
+Batched implementations of the strategy indicators (EMA, VWMA, RSI, TSI, ATR/ATRp, ATR% rank, BBands)
+and of the derived features the decision engine reads from the snapshot (VWMA slope, TSI cross
+events, distance from the N-bar high, SMA break).
+All series of a batch are packed left-aligned into 2-D (series x time) float arrays and each
+kernel steps along the time axis for every series at once, so cost follows bar count, not ETF count.
+Smoothing kernels are numba-compiled when numba is installed (optional, imported on first use).
+Every indicator carries explicit state so a run can resume from the last closed bar.
+Column names are fixed: EMA_50, VWMA_20, RSI_14, TSI_25_13_7/TSIs_25_13_7,
+ATRr_14/ATRp_14, ATRrank_14_26, BBL/BBM/BBU/BBB/BBP_20_2.0, VWMAslope_20,
+TSIxu/TSIxd/TSIxbars_25_13_7, HIGHdist_13, SMA_50/SMAbrk_50.
+"""
+
+import numpy as np
+import pandas as pd
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Dict, Any, List, Optional, Tuple
+from utils.lazy_import import load
+
+PRICE_COLS = ['high', 'low', 'close', 'volume']
+STATE_VERSION = 2  # Bump when the persisted state layout changes
+
+
+def compute_batch(frames: List[pd.DataFrame], config: List[Dict], states: Optional[List[Optional[Dict[str, Any]]]] = None) -> Tuple[List[pd.DataFrame], List[Dict[str, Any]]]:
+    """
+    Appends indicator columns to every frame in one batched pass.
+    'states' holds one engine state per frame (None = start of history).
+    Returns (frames with indicator columns, state after each frame's last bar).
+    """
+    states = states or [None] * len(frames)
+    lengths = np.array([len(f) for f in frames], dtype=np.int64)
+    data = {col: _pack(frames, col, lengths) for col in PRICE_COLS}
+
+    columns = {}
+    new_states = [{} for _ in frames]
+
+    for ind in config:
+        name = ind.get('name')
+        params = ind.get('params', {})
+        if not ind.get('enabled', True) or name not in INDICATORS:
+            continue
+
+        func, init = INDICATORS[name]
+        key = _state_key(name, params)
+        st = _stack([s.get(key) if s else None for s in states], init(len(frames), params))
+        ind_columns, st = func(data, lengths, params, st)
+
+        columns.update(ind_columns)
+        for i, row_state in enumerate(new_states):
+            row_state[key] = _unstack(st, i)
+
+    outputs = [_unpack(frame, columns, i) for i, frame in enumerate(frames)]
+    return outputs, new_states
+
+
+def compute_indicators(bars: pd.DataFrame, config: List[Dict], state: Optional[Dict[str, Any]] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Single-series convenience wrapper around compute_batch."""
+    outputs, states = compute_batch([bars], config, [state])
+    return outputs[0], states[0]
+
+
+# --- Indicators ---
+# Each takes (data, lengths, params, stacked state) and returns ({column: 2-D array}, stacked state).
+
+
+def _ema(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    length = int(params.get('length', 10))
+    values, st['smooth'] = _ema_kernel(data['close'], length, st['smooth'])
+    return {f"EMA_{length}": values}, st
+
+
+def _rsi(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    length = int(params.get('length', 14))
+    close = data['close']
+
+    change = close - _shift(close, st['prev_close'])
+    gain, st['gain'] = _rma_kernel(np.clip(change, 0, None), length, st['gain'])
+    loss, st['loss'] = _rma_kernel(np.clip(-change, 0, None), length, st['loss'])
+    st['prev_close'] = _last(close, lengths, st['prev_close'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100.0 * gain / (gain + loss)
+
+    return {f"RSI_{length}": rsi}, st
+
+
+def _atr(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Wilder ATR; always emits both the raw (ATRr) and percent-of-close (ATRp) columns."""
+    length = int(params.get('length', 14))
+    high, low, close = data['high'], data['low'], data['close']
+
+    prev_close = _shift(close, st['prev_close'])
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    tr[np.isnan(prev_close)] = np.nan
+    atr, st['tr'] = _rma_kernel(tr, length, st['tr'])
+    st['prev_close'] = _last(close, lengths, st['prev_close'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        atr_pct = 100.0 * atr / close
+
+    return {f"ATRr_{length}": atr, f"ATRp_{length}": atr_pct}, st
+
+
+def _atr_rank(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Percentile rank (0-100) of the current ATR% within its last 'lookback' values."""
+    length = int(params.get('length', 14))
+    lookback = int(params.get('lookback', 26))
+
+    atr_columns, st['atr'] = _atr(data, lengths, {'length': length}, st['atr'])
+    rank, st['window'] = _rolling_rank(atr_columns[f"ATRp_{length}"], lengths, lookback, st['window'])
+
+    return {f"ATRrank_{length}_{lookback}": rank}, st
+
+
+def _tsi(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    fast = int(params.get('fast', 13))
+    slow = int(params.get('slow', 25))
+    signal = int(params.get('signal', 13))
+    close = data['close']
+
+    # Same smoothing order as pandas-ta: EMA(slow) then EMA(fast) of momentum
+    momentum = close - _shift(close, st['prev_close'])
+    m_slow, st['m_slow'] = _ema_kernel(momentum, slow, st['m_slow'])
+    m_fast, st['m_fast'] = _ema_kernel(m_slow, fast, st['m_fast'])
+    a_slow, st['a_slow'] = _ema_kernel(np.abs(momentum), slow, st['a_slow'])
+    a_fast, st['a_fast'] = _ema_kernel(a_slow, fast, st['a_fast'])
+    st['prev_close'] = _last(close, lengths, st['prev_close'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tsi = 100.0 * m_fast / a_fast
+    sig, st['sig'] = _ema_kernel(tsi, signal, st['sig'])
+
+    suffix = f"{fast}_{slow}_{signal}"
+    return {f"TSI_{suffix}": tsi, f"TSIs_{suffix}": sig}, st
+
+
+def _vwma(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    length = int(params.get('length', 10))
+    close, volume = data['close'], data['volume']
+
+    (pv_sum, v_sum), st['tails'] = _rolling_sums([close * volume, volume], lengths, length, st['tails'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vwma = pv_sum / v_sum
+
+    return {f"VWMA_{length}": vwma}, st
+
+
+def _bbands(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    length = int(params.get('length', 5))
+    std = float(params.get('std', 2.0))
+    close = data['close']
+
+    (c_sum, c_sq_sum), st['tails'] = _rolling_sums([close, close * close], lengths, length, st['tails'])
+    mid = c_sum / length
+    dev = np.sqrt(np.clip(c_sq_sum / length - mid * mid, 0, None))  # population stdev (ddof=0)
+    lower, upper = mid - std * dev, mid + std * dev
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bandwidth = 100.0 * (upper - lower) / mid
+        percent = (close - lower) / (upper - lower)
+
+    suffix = f"{length}_{std}"
+    return {
+        f"BBL_{suffix}": lower, f"BBM_{suffix}": mid, f"BBU_{suffix}": upper,
+        f"BBB_{suffix}": bandwidth, f"BBP_{suffix}": percent
+    }, st
+
+
+def _vwma_slope(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Bar-over-bar change of the VWMA, in percent."""
+    length = int(params.get('length', 10))
+
+    vwma_columns, st['vwma'] = _vwma(data, lengths, {'length': length}, st['vwma'])
+    vwma = vwma_columns[f"VWMA_{length}"]
+    prev = _shift(vwma, st['prev'])
+    st['prev'] = _last(vwma, lengths, st['prev'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = 100.0 * (vwma - prev) / prev
+
+    return {f"VWMAslope_{length}": slope}, st
+
+
+def _tsi_cross(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """TSI/signal cross events: cross-up and cross-down flags (1/0) and bars since the last cross."""
+    tsi_columns, st['tsi'] = _tsi(data, lengths, params, st['tsi'])
+    tsi, sig = tsi_columns.values()
+    up, down, since, st['cross'] = _cross_kernel(tsi - sig, st['cross'])
+
+    suffix = next(iter(tsi_columns))[len('TSI_'):]
+    return {f"TSIxu_{suffix}": up, f"TSIxd_{suffix}": down, f"TSIxbars_{suffix}": since}, st
+
+
+def _high_dist(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Distance of the close from the highest high of the last 'length' bars, in percent (<= 0)."""
+    length = int(params.get('length', 13))
+    close = data['close']
+
+    (highest,), st['tails'] = _rolling_window([data['high']], lengths, length, st['tails'], np.max)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = 100.0 * (close / highest - 1.0)
+
+    return {f"HIGHdist_{length}": dist}, st
+
+
+def _sma_break(data: Dict[str, np.ndarray], lengths: np.ndarray, params: Dict, st: Dict) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Simple moving average and a break flag (1 = close below it)."""
+    length = int(params.get('length', 50))
+    close = data['close']
+
+    (c_sum,), st['tails'] = _rolling_sums([close], lengths, length, st['tails'])
+    sma = c_sum / length
+    below = np.where(np.isnan(sma), np.nan, (close < sma).astype(float))
+
+    return {f"SMA_{length}": sma, f"SMAbrk_{length}": below}, st
+
+
+# --- Initial States ---
+
+
+def _smooth_init(n: int) -> Dict[str, np.ndarray]:
+    return {'count': np.zeros(n), 'seed_sum': np.zeros(n), 'value': np.full(n, np.nan)}
+
+
+def _tails_init(n: int, length: int, count: int) -> List[np.ndarray]:
+    return [np.full((n, max(length - 1, 0)), np.nan) for _ in range(count)]
+
+
+def _tsi_init(n: int) -> Dict[str, Any]:
+    return {'prev_close': np.full(n, np.nan), **{k: _smooth_init(n) for k in ('m_slow', 'm_fast', 'a_slow', 'a_fast', 'sig')}}
+
+
+INDICATORS = {
+    'ema': (_ema, lambda n, p: {'smooth': _smooth_init(n)}),
+    'rsi': (_rsi, lambda n, p: {'prev_close': np.full(n, np.nan), 'gain': _smooth_init(n), 'loss': _smooth_init(n)}),
+    'atr': (_atr, lambda n, p: {'prev_close': np.full(n, np.nan), 'tr': _smooth_init(n)}),
+    'atr_rank': (_atr_rank, lambda n, p: {
+        'atr': {'prev_close': np.full(n, np.nan), 'tr': _smooth_init(n)},
+        'window': [np.full((n, int(p.get('lookback', 26))), np.nan)]
+    }),
+    'tsi': (_tsi, lambda n, p: _tsi_init(n)),
+    'vwma': (_vwma, lambda n, p: {'tails': _tails_init(n, int(p.get('length', 10)), 2)}),
+    'bbands': (_bbands, lambda n, p: {'tails': _tails_init(n, int(p.get('length', 5)), 2)}),
+    # Derived features (slopes, cross events, distances); each carries its own source state
+    'vwma_slope': (_vwma_slope, lambda n, p: {
+        'vwma': {'tails': _tails_init(n, int(p.get('length', 10)), 2)}, 'prev': np.full(n, np.nan)
+    }),
+    'tsi_cross': (_tsi_cross, lambda n, p: {
+        'tsi': _tsi_init(n), 'cross': {'prev_diff': np.full(n, np.nan), 'since': np.full(n, np.nan)}
+    }),
+    'high_dist': (_high_dist, lambda n, p: {'tails': _tails_init(n, int(p.get('length', 13)), 1)}),
+    'sma_break': (_sma_break, lambda n, p: {'tails': _tails_init(n, int(p.get('length', 50)), 1)}),
+}
+SUPPORTED_INDICATORS = set(INDICATORS)
+
+
+# --- Kernels ---
+
+
+def _ema_kernel(x: np.ndarray, length: int, st: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """EMA (alpha = 2/(n+1)) seeded with the SMA of the first n valid values."""
+    return _smooth_kernel(x, length, 2.0 / (length + 1), st)
+
+
+def _rma_kernel(x: np.ndarray, length: int, st: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Wilder smoothing (alpha = 1/n) seeded with the SMA of the first n valid values."""
+    return _smooth_kernel(x, length, 1.0 / length, st)
+
+
+def _smooth_kernel(x: np.ndarray, length: int, alpha: float, st: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Exponential smoothing with an SMA seed for every row of 'x'. NaN inputs hold the state.
+    State per row: count of valid values seen, running seed sum, current value.
+    """
+    out, count, seed_sum, value = _smooth_rows(
+        np.ascontiguousarray(x, dtype=np.float64), float(length), alpha,
+        st['count'].copy(), st['seed_sum'].copy(), st['value'].copy()
+    )
+    return out, {'count': count, 'seed_sum': seed_sum, 'value': value}
+
+
+def _smooth_rows_numpy(x, length, alpha, count, seed_sum, value):
+    """Steps along time, vectorized across rows."""
+    out = np.full(x.shape, np.nan)
+    for t in range(x.shape[1]):
+        v = x[:, t]
+        valid = ~np.isnan(v)
+        value = np.where(valid & (count >= length), value + alpha * (v - value), value)
+        seeding = valid & (count < length)
+        seed_sum = np.where(seeding, seed_sum + v, seed_sum)
+        count = count + seeding
+        value = np.where(seeding & (count == length), seed_sum / length, value)
+        out[:, t] = np.where(valid & (count >= length), value, np.nan)
+    return out, count, seed_sum, value
+
+
+def _smooth_rows_loop(x, length, alpha, count, seed_sum, value):
+    """Scalar loop form of _smooth_rows_numpy for numba."""
+    out = np.full(x.shape, np.nan)
+    for r in range(x.shape[0]):
+        for t in range(x.shape[1]):
+            v = x[r, t]
+            if np.isnan(v):
+                continue
+            if count[r] < length:
+                seed_sum[r] += v
+                count[r] += 1
+                if count[r] == length:
+                    value[r] = seed_sum[r] / length
+            else:
+                value[r] += alpha * (v - value[r])
+            if count[r] >= length:
+                out[r, t] = value[r]
+    return out, count, seed_sum, value
+
+
+_KERNELS: Dict[str, Any] = {}
+
+
+def _smooth_rows(x, length, alpha, count, seed_sum, value):
+    """Dispatches to the numba-compiled loop if numba is installed, else the numpy form (resolved on first call)."""
+    kernel = _KERNELS.get('smooth_rows')
+    if kernel is None:
+        try:
+            kernel = load('numba').njit(cache=True)(_smooth_rows_loop)
+        except ImportError:
+            kernel = _smooth_rows_numpy
+        _KERNELS['smooth_rows'] = kernel
+    return kernel(x, length, alpha, count, seed_sum, value)
+
+
+def _cross_kernel(diff: np.ndarray, st: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Sign changes of 'diff' (fast - slow), stepping along time for every row at once.
+    State per row: last valid diff and bars since the last cross (NaN before the first one).
+    NaN inputs hold the state.
+    """
+    prev_diff, since = st['prev_diff'].copy(), st['since'].copy()
+    up, down, bars = (np.full(diff.shape, np.nan) for _ in range(3))
+
+    for t in range(diff.shape[1]):
+        d = diff[:, t]
+        valid = ~np.isnan(d)
+        known = valid & ~np.isnan(prev_diff)
+        crossed_up = known & (prev_diff <= 0) & (d > 0)
+        crossed_down = known & (prev_diff >= 0) & (d < 0)
+
+        since = np.where(crossed_up | crossed_down, 0.0, np.where(valid, since + 1, since))
+        prev_diff = np.where(valid, d, prev_diff)
+
+        up[:, t] = np.where(known, crossed_up, np.nan)
+        down[:, t] = np.where(known, crossed_down, np.nan)
+        bars[:, t] = np.where(valid, since, np.nan)
+
+    return up, down, bars, {'prev_diff': prev_diff, 'since': since}
+
+
+def _rolling_sums(series: List[np.ndarray], lengths: np.ndarray, length: int, tails: List[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Rolling sums over 'length' bars for several aligned 2-D inputs (see _rolling_window)."""
+    return _rolling_window(series, lengths, length, tails, np.sum)
+
+
+def _rolling_window(series: List[np.ndarray], lengths: np.ndarray, length: int, tails: List[np.ndarray], reduce) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Rolling 'reduce' (np.sum, np.max, ...) over 'length' bars for several aligned 2-D inputs.
+    Tails hold each row's last (length - 1) inputs as warm-up for the next call.
+    """
+    if not series[0].shape[1]:
+        return [values.copy() for values in series], tails
+
+    results, new_tails = [], []
+    take = lengths[:, None] + np.arange(length - 1)  # Positions of each row's new tail in 'full'
+
+    for values, tail in zip(series, tails):
+        full = np.concatenate([tail, values], axis=1)
+        results.append(reduce(sliding_window_view(full, length, axis=1), axis=2))
+        new_tails.append(np.take_along_axis(full, take, axis=1))
+
+    return results, new_tails
+
+
+def _rolling_rank(x: np.ndarray, lengths: np.ndarray, lookback: int, window: List[np.ndarray]) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Rolling percentile rank over 'lookback' valid values, maintained incrementally per row:
+    a deque of the window in arrival order plus the same values kept sorted, so each bar
+    costs one insert/evict and a bisect instead of re-sorting the window.
+    The window (oldest first, NaN-padded in front) is the state; NaN inputs hold it.
+    """
+    out = np.full(x.shape, np.nan)
+    new_window = window[0].copy()
+
+    for r in range(x.shape[0]):
+        arrival = deque(v for v in window[0][r] if not np.isnan(v))
+        ordered = sorted(arrival)
+        for t in range(int(lengths[r])):
+            v = x[r, t]
+            if np.isnan(v):
+                continue
+            arrival.append(v)
+            insort(ordered, v)
+            if len(arrival) > lookback:
+                del ordered[bisect_left(ordered, arrival.popleft())]
+            if len(arrival) == lookback:
+                out[r, t] = 100.0 * bisect_right(ordered, v) / lookback
+        new_window[r] = np.nan
+        if arrival:
+            new_window[r, lookback - len(arrival):] = list(arrival)
+
+    return out, [new_window]
+
+
+# --- Helpers ---
+
+
+def _pack(frames: List[pd.DataFrame], col: str, lengths: np.ndarray) -> np.ndarray:
+    """Left-aligns one column of every frame into a NaN-padded (series x time) array."""
+    out = np.full((len(frames), int(lengths.max(initial=0))), np.nan)
+    for i, frame in enumerate(frames):
+        out[i, :lengths[i]] = frame[col].to_numpy(np.float64)
+    return out
+
+
+def _unpack(frame: pd.DataFrame, columns: Dict[str, np.ndarray], row: int) -> pd.DataFrame:
+    n = len(frame)
+    values = pd.DataFrame({col: arr[row, :n] for col, arr in columns.items()}, index=frame.index)
+    return pd.concat([frame, values], axis=1)
+
+
+def _stack(rows: List[Optional[Dict]], init: Dict) -> Dict:
+    """Stacks per-series (JSON) states into arrays, keeping 'init' for series without state."""
+    out = {}
+    for key, default in init.items():
+        subs = [r[key] if r else None for r in rows]
+        if isinstance(default, dict):
+            out[key] = _stack(subs, default)
+        elif isinstance(default, list):
+            out[key] = [_fill_rows(d, [s[j] if s else None for s in subs]) for j, d in enumerate(default)]
+        else:
+            out[key] = _fill_rows(default, subs)
+    return out
+
+
+def _fill_rows(default: np.ndarray, rows: List[Any]) -> np.ndarray:
+    arr = default.copy()
+    for i, value in enumerate(rows):
+        if value is not None:
+            arr[i] = value
+    return arr
+
+
+def _unstack(st: Dict, row: int) -> Dict:
+    """Extracts one series' state as JSON-serializable values."""
+    out = {}
+    for key, value in st.items():
+        if isinstance(value, dict):
+            out[key] = _unstack(value, row)
+        elif isinstance(value, list):
+            out[key] = [arr[row].tolist() for arr in value]
+        else:
+            out[key] = value[row].item()
+    return out
+
+
+def _state_key(name: str, params: Dict) -> str:
+    return name + ''.join(f"_{k}={params[k]}" for k in sorted(params))
+
+
+def _shift(x: np.ndarray, prev: np.ndarray) -> np.ndarray:
+    """x shifted one bar along time, with each row's previous last value in front."""
+    if not x.shape[1]:
+        return x.copy()
+    return np.concatenate([prev[:, None], x[:, :-1]], axis=1)
+
+
+def _last(x: np.ndarray, lengths: np.ndarray, prev: np.ndarray) -> np.ndarray:
+    """Each row's last real value (padding excluded), or 'prev' for empty rows."""
+    idx = np.maximum(lengths - 1, 0)
+    last = x[np.arange(len(lengths)), idx] if x.shape[1] else prev
+    return np.where(lengths > 0, last, prev)
@@ -0,0 +1,125 @@
+# data_pipeline/indicator_snapshot.py
+
+"""
+INDICATOR SNAPSHOT ACCESSOR.
+Wraps 'indicator_snapshot_df' (latest row per ETF/timeframe) in an object indexed by
+(ETF, timeframe). Logical fields (rsi, tsi, tsi_signal, atr, atr_pct, vwma, close, ...)
+are resolved to concrete columns (RSI_14, TSIs_25_13_7, ...) once, when it is built,
+so decision phases get O(1) lookups instead of filtering and prefix-scanning per ETF.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional, Tuple
+
+DECISION_TIMEFRAME = '1W'
+
+# Logical field -> column prefix (first matching column wins); exact names for raw bar columns
+FIELD_PREFIXES = {
+    'rsi': 'RSI_',
+    'tsi': 'TSI_',
+    'tsi_signal': 'TSIs_',
+    'atr': 'ATRr_',
+    'atr_pct': 'ATRp_',
+    'atr_rank': 'ATRrank_',
+    'vwma': 'VWMA_',
+    'vwma_slope': 'VWMAslope_',
+    'tsi_cross_up': 'TSIxu_',
+    'tsi_cross_down': 'TSIxd_',
+    'tsi_bars_since_cross': 'TSIxbars_',
+    'high_dist': 'HIGHdist_',
+    'sma': 'SMA_',
+    'sma_break': 'SMAbrk_',
+}
+BAR_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+class IndicatorSnapshot:
+    """Latest indicator values per (ETF, timeframe) with a resolved column map."""
+
+    def __init__(self, snapshot_df: pd.DataFrame):
+        self.df = snapshot_df
+        self.columns = resolve_columns(snapshot_df)
+
+        fields = list(self.columns)
+        self._field_pos = {field: j for j, field in enumerate(fields)}
+        if snapshot_df.empty:
+            self._values = np.empty((0, len(fields)))
+            self._rows = {}
+        else:
+            self._values = snapshot_df[[self.columns[f] for f in fields]].to_numpy(dtype=float, na_value=np.nan)
+            self._rows = {key: i for i, key in enumerate(zip(snapshot_df['ETF'], snapshot_df['Timeframe']))}
+
+    @classmethod
+    def from_arrays(cls, rows: Dict[Tuple[str, str], int], fields: List[str], values: np.ndarray) -> 'IndicatorSnapshot':
+        """
+        Builds an accessor straight from a (rows x fields) value block, without a DataFrame.
+        'rows' maps (ETF, timeframe) to a row of 'values'. Used by replays that slice
+        precomputed indicator matrices per step; '.df' is None.
+        """
+        snapshot = cls.__new__(cls)
+        snapshot.df = None
+        snapshot.columns = {field: field for field in fields}
+        snapshot._field_pos = {field: j for j, field in enumerate(fields)}
+        snapshot._values = values
+        snapshot._rows = rows
+        return snapshot
+
+    @property
+    def empty(self) -> bool:
+        return not self._rows
+
+    def has(self, etf: str, tf: str = DECISION_TIMEFRAME) -> bool:
+        return (etf, tf) in self._rows
+
+    def get(self, etf: str, field: str, tf: str = DECISION_TIMEFRAME, default: float = 0.0) -> float:
+        """Value of a logical field; 'default' if the row, column or value is missing."""
+        i = self._rows.get((etf, tf))
+        j = self._field_pos.get(field)
+        if i is None or j is None:
+            return default
+        value = self._values[i, j]
+        return default if np.isnan(value) else float(value)
+
+    def frame(self, tf: str = DECISION_TIMEFRAME, etfs: Optional[List[str]] = None) -> pd.DataFrame:
+        """All logical fields for one timeframe, indexed by ETF (NaN where missing)."""
+        keys = [etf for (etf, t) in self._rows if t == tf] if etfs is None else list(etfs)
+        rows = [self._rows.get((etf, tf), -1) for etf in keys]
+        values = np.full((len(keys), len(self._field_pos)), np.nan)
+        found = np.array([r >= 0 for r in rows], dtype=bool)
+        if found.any():
+            values[found] = self._values[[r for r in rows if r >= 0]]
+        return pd.DataFrame(values, index=pd.Index(keys, name='ETF'), columns=list(self._field_pos))
+
+
+def resolve_columns(snapshot_df: pd.DataFrame) -> Dict[str, str]:
+    """Maps logical field names to the snapshot's concrete column names."""
+    columns = snapshot_df.columns
+    resolved = {field: field for field in BAR_FIELDS if field in columns}
+    for field, prefix in FIELD_PREFIXES.items():
+        match = next((c for c in columns if str(c).startswith(prefix)), None)
+        if match is not None:
+            resolved[field] = match
+    # Any other numeric column (EMA_50, BBU_20_2.0, ...) is addressable by its own name
+    taken = set(resolved.values())
+    for column in columns:
+        if column not in taken and pd.api.types.is_numeric_dtype(snapshot_df[column]):
+            resolved[column] = column
+    return resolved
+
+
+def get_snapshot(universal_data: Dict[str, Any]) -> IndicatorSnapshot:
+    """
+    Returns the accessor for the current 'indicator_snapshot_df'.
+    Built by the indicator calculator; rebuilt here only if the DataFrame was replaced.
+    An accessor set without a DataFrame (snapshot df None, e.g. backtests) is used as is.
+    """
+    market_data = universal_data['market_data']
+    snapshot_df = market_data.get('indicator_snapshot_df')
+    snapshot = market_data.get('indicator_snapshot')
+    if snapshot is not None and snapshot.df is snapshot_df:
+        return snapshot
+
+    snapshot = IndicatorSnapshot(snapshot_df if snapshot_df is not None else pd.DataFrame())
+    market_data['indicator_snapshot'] = snapshot
+    return snapshot
@@ -0,0 +1,173 @@
+# data_pipeline/indicator_store.py
+
+"""
+PARTITIONED INDICATOR HISTORY.
+Persists indicator rows per ETF, timeframe and year.
+Layout: {indicator_history_dir}/{ETF}/{tf}/{YYYY}.parquet
+Writes only touch the year partitions that contain new (or recomputed) rows; older
+years are never rewritten. '_manifest.json' records each series' row count, time
+bounds and per-year rows, so readers can prune to an ETF, timeframe or date range.
+'_snapshot.parquet' holds the latest row of every series for warm starts.
+"""
+
+import json
+import os
+import shutil
+import pandas as pd
+from typing import Any, Dict, List, Optional
+from utils.logger import setup_logger
+
+log = setup_logger()
+
+MANIFEST_FILE = '_manifest.json'
+SNAPSHOT_FILE = '_snapshot.parquet'
+YEAR_FILE = '{year}.parquet'
+
+
+def get_history_dir(universal_data: Dict[str, Any]) -> str:
+    """Absolute path of the indicator history dataset."""
+    paths = universal_data['configs']['system_settings']['paths']
+    rel_path = paths.get('indicator_history_dir', 'source/data/indicator_history')
+    return os.path.join(universal_data['system']['project_root'], rel_path)
+
+
+def write_series(history_dir: str, etf: str, tf: str, rows: pd.DataFrame, replace_from: Optional[pd.Timestamp] = None,
+                 input_key: Optional[str] = None) -> None:
+    """
+    Stores one ETF/timeframe series ('rows' indexed by timestamp).
+    replace_from=None replaces the whole series; otherwise stored rows at or after
+    'replace_from' are replaced by 'rows' and earlier rows are kept.
+    'input_key' identifies the inputs the rows were computed from (cache validation).
+    Not thread-safe: the calculator is the only writer.
+    """
+    series_dir = os.path.join(history_dir, etf, tf)
+    if replace_from is None and os.path.exists(series_dir):
+        shutil.rmtree(series_dir)
+    os.makedirs(series_dir, exist_ok=True)
+
+    new_df = rows.reset_index()
+    years = new_df['timestamp'].dt.year
+    touched = set(years.unique().tolist())
+    if replace_from is not None:
+        # Later partitions that only held replaced rows are rewritten too (possibly emptied)
+        touched |= {y for y in _list_years(series_dir) if y >= pd.Timestamp(replace_from).year}
+
+    key = f"{etf}/{tf}"
+    manifest = read_manifest(history_dir)
+    previous = manifest['series'].get(key) if replace_from is not None else None
+    year_rows = dict(previous['years']) if previous else {}
+    bounds = []
+
+    for year in sorted(touched):
+        path = os.path.join(series_dir, YEAR_FILE.format(year=year))
+        year_df = new_df[years == year]
+        if replace_from is not None and os.path.exists(path):
+            stored = pd.read_parquet(path)
+            stored = stored[stored['timestamp'] < replace_from]
+            year_df = pd.concat([stored, year_df], ignore_index=True) if not year_df.empty else stored
+        year_rows.pop(str(year), None)
+        if year_df.empty:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        _write_parquet_atomic(year_df, path)
+        year_rows[str(year)] = int(len(year_df))
+        bounds += [year_df['timestamp'].min(), year_df['timestamp'].max()]
+
+    first_ts = previous['first_ts'] if previous and previous['first_ts'] else (min(bounds).isoformat() if bounds else None)
+    manifest['series'][key] = {
+        'rows': sum(year_rows.values()),
+        'first_ts': first_ts,
+        'last_ts': max(bounds).isoformat() if bounds else (previous or {}).get('last_ts'),
+        'years': dict(sorted(year_rows.items())),
+        'input_key': input_key
+    }
+    _write_manifest(history_dir, manifest)
+
+
+def read_history(history_dir: str, etfs: Optional[List[str]] = None, timeframes: Optional[List[str]] = None,
+                 start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None,
+                 columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads indicator rows as one frame with 'timestamp', 'ETF' and 'Timeframe' columns.
+    ETF/timeframe/year pruning happens on directories; start/end are pushed down to Parquet.
+    """
+    manifest = read_manifest(history_dir)
+    filters = []
+    if start is not None:
+        filters.append(('timestamp', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('timestamp', '<=', pd.Timestamp(end)))
+    read_cols = None if columns is None else ['timestamp'] + [c for c in columns if c != 'timestamp']
+
+    frames = []
+    for key in sorted(manifest['series']):
+        etf, tf = key.split('/')
+        if (etfs is not None and etf not in etfs) or (timeframes is not None and tf not in timeframes):
+            continue
+        series_dir = os.path.join(history_dir, etf, tf)
+        for year in _list_years(series_dir):
+            if (start is not None and year < pd.Timestamp(start).year) or (end is not None and year > pd.Timestamp(end).year):
+                continue
+            df = pd.read_parquet(os.path.join(series_dir, YEAR_FILE.format(year=year)),
+                                 columns=read_cols, filters=filters or None)
+            if not df.empty:
+                df['ETF'] = etf
+                df['Timeframe'] = tf
+                frames.append(df)
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def read_manifest(history_dir: str) -> Dict[str, Any]:
+    """Returns {'series': {'ETF/tf': {...}}}; empty if the dataset does not exist yet."""
+    try:
+        with open(os.path.join(history_dir, MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get('series'), dict):
+            return manifest
+    except (OSError, json.JSONDecodeError):
+        pass
+    return {'series': {}}
+
+
+def write_snapshot(history_dir: str, snapshot_df: pd.DataFrame) -> None:
+    """Persists the latest-row table (one row per ETF/timeframe, with its 'input_key')."""
+    os.makedirs(history_dir, exist_ok=True)
+    _write_parquet_atomic(snapshot_df, os.path.join(history_dir, SNAPSHOT_FILE))
+
+
+def read_snapshot(history_dir: str) -> pd.DataFrame:
+    """Returns the persisted latest-row table, or an empty frame if missing/unreadable."""
+    path = os.path.join(history_dir, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    try:
+        return pd.read_parquet(path)
+    except Exception as e:
+        log.warning(f"Snapshot artifact unreadable ({e}), ignoring.", tags=["CALC", "CACHE"])
+        return pd.DataFrame()
+
+
+# --- Helpers ---
+
+
+def _list_years(series_dir: str) -> List[int]:
+    if not os.path.isdir(series_dir):
+        return []
+    return sorted(int(f[:-8]) for f in os.listdir(series_dir) if f.endswith('.parquet') and f[:-8].isdigit())
+
+
+def _write_manifest(history_dir: str, manifest: Dict[str, Any]) -> None:
+    os.makedirs(history_dir, exist_ok=True)
+    path = os.path.join(history_dir, MANIFEST_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def _write_parquet_atomic(df: pd.DataFrame, path: str) -> None:
+    """Writes to a temp file then renames, so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False, compression='snappy')
+    os.replace(tmp_path, path)
@@ -7,7 +7,6 @@ Handles 'force_nse_refresh' flag and fail-over to Upstox-only mode.
 """
 
 import pandas as pd
-import requests
 import gzip
 import json
 import os
@@ -15,6 +14,7 @@ import time
 from io import BytesIO
 from typing import Dict, Any
 from utils.logger import setup_logger
+from utils.http_client import http_get
 
 log = setup_logger()
 
@@ -81,13 +81,12 @@ def _fetch_nse_etfs(universal_data: Dict[str, Any]) -> pd.DataFrame:
     }
    
     try:
-        session = requests.Session()
-        # Warmup
-        session.get(home_url, headers=headers, timeout=10)
+        # Warmup (sets NSE cookies on the shared session)
+        http_get(universal_data, home_url, headers=headers)
         time.sleep(1)
        
         # API Call
-        response = session.get(url, headers=headers, timeout=15)
+        response = http_get(universal_data, url, headers=headers)
         response.raise_for_status()
        
         data = response.json().get('data', [])
@@ -112,7 +111,9 @@ def _fetch_upstox_instruments(universal_data: Dict[str, Any]) -> pd.DataFrame:
     url = universal_data['configs']['system_settings']['data_urls']['upstox_instruments_url']
    
     try:
-        response = requests.get(url, timeout=60)
+        # Large gzip dump: allow at least 60s regardless of the default timeout
+        timeout = max(60, universal_data['configs']['system_settings']['data_acquisition'].get('request_timeout_seconds', 30))
+        response = http_get(universal_data, url, timeout=timeout)
         response.raise_for_status()
        
         with gzip.GzipFile(fileobj=BytesIO(response.content)) as gz:
@@ -4,18 +4,27 @@
 OHLCV SYNCHRONIZATION ENGINE.
 Downloads 1-minute historical data with intelligent incremental sync.
 Handles 'force_ohlcv_resync' flag.
+Backfills holes found by the gap scanner instead of requiring a full resync.
 Ensures data integrity (sorting, deduplication).
+Candles are persisted in the columnar Parquet store (see ohlcv_store).
 """
 
 import pandas as pd
-import requests
-import json
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, date, timedelta
 from tqdm import tqdm
 from typing import Dict, Any, List, Tuple, Optional
 from utils.logger import setup_logger
+from utils.rate_limiter import TokenBucket
+from utils.http_client import http_get
+from data_pipeline.ohlcv_store import (
+    get_store_path, get_legacy_json_path, migrate_legacy_json,
+    get_last_timestamp, candles_to_frame, write_candles, clear_store,
+    start_background_compaction, mark_days_verified
+)
+from data_pipeline.trading_calendar import TradingCalendar, load_trading_calendar
+from data_pipeline.gap_scanner import find_missing_ranges
 
 log = setup_logger()
 
@@ -48,12 +57,17 @@ def process_ohlcv_sync(universal_data: Dict[str, Any]) -> Dict[str, Any]:
     force_resync = debug_flags.get('force_ohlcv_resync', False)
     if force_resync:
         log.info("Debug flag 'force_ohlcv_resync' is ON. Will redownload all data.", tags=["DATA", "DEBUG"])
-    # Iterate ETFs
+    # 1. Plan: date range and chunk list per ETF (tail top-up + gap backfill)
     log.info(f"Syncing {len(etfs_to_track)} ETFs...", tags=["DATA", "LOOP"])
+    acquisition = universal_data['configs']['system_settings']['data_acquisition']
+    chunk_size_days = acquisition['api_fetch_chunk_days']
+    calendar = load_trading_calendar(universal_data)
+    scan_gaps = acquisition.get('gap_backfill_enabled', True) and not force_resync
+    fetch_plan = {}
    
-    for etf in tqdm(etfs_to_track, desc="Syncing OHLCV"):
-        file_path = os.path.join(ohlcv_dir, f"{etf}_1m_history.json")
-        ohlcv_files[etf] = file_path
+    for etf in etfs_to_track:
+        store_path = get_store_path(ohlcv_dir, etf)
+        ohlcv_files[etf] = store_path
        
         instrument_key = symbol_map.get(etf)
         if not instrument_key:
@@ -62,34 +76,48 @@ def process_ohlcv_sync(universal_data: Dict[str, Any]) -> Dict[str, Any]:
             continue
            
         try:
+            # One-time conversion of legacy JSON history
+            if not force_resync:
+                migrate_legacy_json(get_legacy_json_path(ohlcv_dir, etf), store_path)
+
             # Determine Date Range
-            start_date, end_date = _get_fetch_range(file_path, universal_data, force_resync)
+            start_date, end_date = _get_fetch_range(store_path, universal_data, force_resync)
+            chunks = []
+            if start_date is not None and start_date <= end_date:
+                chunks += [(s, e, False) for s, e in _plan_chunks(start_date, end_date, chunk_size_days)]
+               
+            # Holes inside the stored history
+            if scan_gaps:
+                gaps = find_missing_ranges(store_path, calendar, acquisition.get('gap_min_session_coverage', 0.5), date.today() - timedelta(days=1))
+                if gaps:
+                    log.info(f"{etf}: {len(gaps)} gap range(s) to backfill: {gaps[:5]}{' ...' if len(gaps) > 5 else ''}", tags=["DATA", "GAPS"])
+                chunks += [(s, e, True) for gs, ge in gaps for s, e in _plan_chunks(gs, ge, chunk_size_days)]
            
-            if start_date is None:
+            if not chunks:
                 # Cache is current, skip
                 stats['skipped'] += 1
-            elif start_date <= end_date:
-                # Fetch Data
-                new_data = _fetch_data_chunks(universal_data, instrument_key, start_date, end_date)
-                if new_data:
-                    _update_cache_file(file_path, new_data, force_resync)
-                    stats['synced'] += 1
-                else:
-                    stats['skipped'] += 1
             else:
-                stats['skipped'] += 1
+                fetch_plan[etf] = (instrument_key, chunks)
                
         except Exception as e:
             log.error(f"Failed to sync {etf}: {e}", tags=["DATA", "ERROR"])
             stats['failed'] += 1
            
+    # 2. Fetch all chunks of all ETFs concurrently, then write each ETF once complete
+    if fetch_plan:
+        _fetch_and_store(universal_data, fetch_plan, ohlcv_files, force_resync, stats, calendar)
+       
     universal_data['market_data']['ohlcv_file_paths'] = ohlcv_files
     log.info(f"Sync Complete. Stats: {stats}", tags=["DATA", "SUMMARY"])
    
+    # Merge appended segments off the critical path
+    max_segments = universal_data['configs']['system_settings']['cache_policies'].get('ohlcv_compaction_segments', 8)
+    universal_data['market_data']['ohlcv_compaction'] = start_background_compaction(list(ohlcv_files.values()), max_segments)
+   
     return universal_data
 
 
-def _get_fetch_range(file_path: str, universal_data: Dict[str, Any], force_resync: bool) -> Tuple[Optional[date], date]:
+def _get_fetch_range(store_path: str, universal_data: Dict[str, Any], force_resync: bool) -> Tuple[Optional[date], date]:
     """
     Calculates [start_date, end_date] for fetching.
     Returns (None, end_date) if cache is already current.
@@ -100,58 +128,138 @@ def _get_fetch_range(file_path: str, universal_data: Dict[str, Any], force_resyn
     default_start_str = universal_data['configs']['system_settings']['data_acquisition']['full_history_start_date']
     default_start = datetime.strptime(default_start_str, '%Y-%m-%d').date()
    
-    if force_resync or not os.path.exists(file_path):
+    if force_resync:
         return default_start, end_date
        
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            if not data:
-                return default_start, end_date
-               
-            # Get last cached timestamp
-            last_ts_str = data[-1][0]
-            # Handle timezone-aware timestamps
-            if 'T' in last_ts_str:
-                last_ts_str = last_ts_str.split('+')[0].split('T')[0] if '+' in last_ts_str else last_ts_str.split('T')[0]
-            last_date = datetime.strptime(last_ts_str[:10], '%Y-%m-%d').date()
+        # Get last cached timestamp from the store manifest (no candle data read)
+        last_ts = get_last_timestamp(store_path)
+        if last_ts is None:
+            return default_start, end_date
            
-            # If last cached data is from today, skip
-            if last_date >= today:
-                log.info(f"Cache current ({last_date}), skipping fetch", tags=["DATA", "SKIP"])
-                return None, end_date
-            
-            # If last cached is yesterday or before, fetch from next day
-            return last_date + timedelta(days=1), end_date
+        last_date = last_ts.date()
+       
+        # If last cached data is from today, skip
+        if last_date >= today:
+            log.info(f"Cache current ({last_date}), skipping fetch", tags=["DATA", "SKIP"])
+            return None, end_date
+        
+        # If last cached is yesterday or before, fetch from next day
+        return last_date + timedelta(days=1), end_date
            
-    except (json.JSONDecodeError, IndexError, ValueError) as e:
-        log.warning(f"Cache parse error: {e}, forcing full sync.", tags=["DATA", "CORRUPT"])
+    except Exception as e:
+        log.warning(f"Cache read error: {e}, forcing full sync.", tags=["DATA", "CORRUPT"])
         return default_start, end_date
 
 
-def _fetch_data_chunks(universal_data: Dict[str, Any], instrument_key: str, start_date: date, end_date: date) -> List[List]:
-    """Fetches data in chunks to respect API limits."""
-   
-    chunk_size_days = universal_data['configs']['system_settings']['data_acquisition']['api_fetch_chunk_days']
-    all_candles = []
-   
+def _plan_chunks(start_date: date, end_date: date, chunk_size_days: int) -> List[Tuple[date, date]]:
+    """Splits [start_date, end_date] into API-sized chunks."""
+    chunks = []
     curr_start = start_date
    
     while curr_start <= end_date:
         curr_end = min(curr_start + timedelta(days=chunk_size_days), end_date)
-       
-        candles = _fetch_single_chunk(universal_data, instrument_key, curr_start, curr_end)
-        if candles:
-            all_candles.extend(candles)
-           
+        chunks.append((curr_start, curr_end))
         curr_start = curr_end + timedelta(days=1)
-        time.sleep(0.2) # Rate limit nicety
        
-    return all_candles
+    return chunks
+
+
+def _fetch_and_store(universal_data: Dict[str, Any], fetch_plan: Dict[str, Tuple[str, List[Tuple[date, date, bool]]]],
+                     ohlcv_files: Dict[str, str], force_resync: bool, stats: Dict[str, int], calendar: TradingCalendar) -> None:
+    """
+    Runs every planned chunk request across all ETFs on a thread pool.
+    One shared token bucket (api_rate_limit_delay_seconds) bounds the combined request rate.
+    Each ETF is written to its store as soon as all of its chunks have returned.
+    """
+    acquisition = universal_data['configs']['system_settings']['data_acquisition']
+    limiter = TokenBucket.from_delay(acquisition.get('api_rate_limit_delay_seconds', 0.5))
+    max_workers = acquisition.get('max_concurrent_requests', 4)
+   
+    results = {etf: [None] * len(chunks) for etf, (_, chunks) in fetch_plan.items()}
+    pending = {etf: len(chunks) for etf, (_, chunks) in fetch_plan.items()}
+    total_chunks = sum(pending.values())
+   
+    def _rate_limited_fetch(instrument_key: str, start: date, end: date) -> List[List]:
+        return _fetch_single_chunk(universal_data, instrument_key, start, end, limiter)
+   
+    log.info(f"Fetching {total_chunks} chunks for {len(fetch_plan)} ETFs ({max_workers} workers)...", tags=["DATA", "FETCH"])
+   
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for etf, (instrument_key, chunks) in fetch_plan.items():
+            for idx, (start, end, _) in enumerate(chunks):
+                futures[pool.submit(_rate_limited_fetch, instrument_key, start, end)] = (etf, idx)
+               
+        for future in tqdm(as_completed(futures), total=total_chunks, desc="Syncing OHLCV"):
+            etf, idx = futures[future]
+            try:
+                results[etf][idx] = future.result()
+            except Exception as e:
+                log.warning(f"Chunk fetch failed for {etf} {fetch_plan[etf][1][idx]}: {e}", tags=["DATA", "API_WARN"])
+                results[etf][idx] = e
+               
+            pending[etf] -= 1
+            if pending[etf] > 0:
+                continue
+               
+            # All chunks for this ETF are in
+            try:
+                _store_completed_chunks(etf, fetch_plan[etf][1], results.pop(etf), ohlcv_files[etf], force_resync, stats, calendar)
+            except Exception as e:
+                log.error(f"Failed to sync {etf}: {e}", tags=["DATA", "ERROR"])
+                stats['failed'] += 1
 
 
-def _fetch_single_chunk(universal_data: Dict[str, Any], instrument_key: str, start: date, end: date) -> List[List]:
-    """Calls Upstox Historical API."""
+def _store_completed_chunks(etf: str, chunks: List[Tuple[date, date, bool]], chunk_results: List[Any],
+                            store_path: str, force_resync: bool, stats: Dict[str, int], calendar: TradingCalendar) -> None:
+    """
+    Tail chunks: writes the contiguous run of successful chunks up to the first failure.
+    Stopping there keeps the store hole-free: the next sync resumes from the
+    last stored candle and refetches the failed range.
+    Backfill chunks: each successful chunk is merged into the history and its
+    trading days are marked verified; failed ones are picked up by the next gap scan.
+    """
+    tail = [(chunk, result) for chunk, result in zip(chunks, chunk_results) if not chunk[2]]
+    backfill = [(chunk, result) for chunk, result in zip(chunks, chunk_results) if chunk[2]]
+    failed = False
+   
+    failed_idx = next((i for i, (_, r) in enumerate(tail) if isinstance(r, Exception)), None)
+    usable = tail if failed_idx is None else tail[:failed_idx]
+   
+    new_data = [candle for _, chunk in usable for candle in chunk]
+    if new_data:
+        _update_store(store_path, new_data, force_resync)
+       
+    if failed_idx is not None:
+        log.warning(f"{etf}: stored {failed_idx}/{len(tail)} chunks, rest deferred to next sync.", tags=["DATA", "PARTIAL"])
+        failed = True
+       
+    backfilled = 0
+    for (start, end, _), result in backfill:
+        if isinstance(result, Exception):
+            failed = True
+            continue
+        backfilled += write_candles(store_path, candles_to_frame(result), backfill=True)
+        mark_days_verified(store_path, [d.date() for d in calendar.trading_days(start, end)])
+       
+    if backfill:
+        log.info(f"{etf}: backfilled {backfilled} candles across {len(backfill)} chunk(s).", tags=["DATA", "GAPS"])
+       
+    if failed:
+        stats['failed'] += 1
+    elif new_data or backfilled:
+        stats['synced'] += 1
+    else:
+        stats['skipped'] += 1
+
+
+def _fetch_single_chunk(universal_data: Dict[str, Any], instrument_key: str, start: date, end: date,
+                        limiter: Optional[TokenBucket] = None) -> List[List]:
+    """
+    Calls Upstox Historical API. 'limiter' is taken before every attempt, retries included.
+    Raises on failure (after retries) so a transient error is never stored as an empty chunk.
+    """
     base_url = universal_data['configs']['system_settings']['data_urls']['upstox_historical_api']
     token = universal_data['access_token']
    
@@ -160,43 +268,26 @@ def _fetch_single_chunk(universal_data: Dict[str, Any], instrument_key: str, sta
    
     headers = {'Accept': 'application/json', 'Authorization': f'Bearer {token}'}
    
-    try:
-        resp = requests.get(url, headers=headers, timeout=10)
-       
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get('status') == 'success':
-                return data.get('data', {}).get('candles', [])
-    except Exception as e:
-        log.warning(f"Chunk fetch failed for {instrument_key}: {e}", tags=["DATA", "API_WARN"])
+    resp = http_get(universal_data, url, headers=headers, limiter=limiter)
+    resp.raise_for_status()
+   
+    data = resp.json()
+    if data.get('status') != 'success':
+        raise RuntimeError(f"Upstox returned status '{data.get('status')}' for {start}..{end}")
        
-    return []
+    return data.get('data', {}).get('candles', [])
 
 
-def _update_cache_file(file_path: str, new_data: List[List], force_resync: bool) -> None:
+def _update_store(store_path: str, new_data: List[List], force_resync: bool) -> None:
     """
-    Updates JSON file. Handles Sorting and Deduplication.
+    Appends candles to the Parquet store. Sorting and Deduplication only touch the new tail.
     Upstox returns data in Reverse Chronological (newest first).
     We store Chronological (oldest first).
     """
     if not new_data and not force_resync:
         return
-    existing_data = []
    
-    if not force_resync and os.path.exists(file_path):
-        try:
-            with open(file_path, 'r') as f:
-                existing_data = json.load(f)
-        except:
-            existing_data = []
-    # Merge
-    combined = existing_data + new_data
-   
-    # Deduplicate based on Timestamp (index 0)
-    unique_map = {row[0]: row for row in combined}
-   
-    # Sort Chronologically
-    sorted_data = sorted(unique_map.values(), key=lambda x: x[0])
-   
-    with open(file_path, 'w') as f:
-        json.dump(sorted_data, f)
\ No newline at end of file
+    if force_resync:
+        clear_store(store_path)
+       
+    write_candles(store_path, candles_to_frame(new_data))
@@ -0,0 +1,420 @@
+# data_pipeline/ohlcv_store.py
+
+"""
+COLUMNAR OHLCV STORE.
+Persists 1-minute candles as Parquet, partitioned by ETF and month.
+Layout: {ohlcv_data_dir}/{ETF}/{YYYY-MM}/part-NNNNN.parquet
+Columns are typed (timestamp, OHLC floats, volume/oi ints) so readers never parse JSON.
+Writes are append-only segments; compaction merges a month's segments back into one file.
+A sidecar '_manifest.json' per ETF records first/last timestamp, row count and checksum,
+so sync planning never has to open candle data. It also lists backfilled ('verified') days,
+and each segment entry carries its in-session bar count per day for gap scans.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import pandas as pd
+from datetime import date
+from typing import Any, Dict, List, Optional
+from utils.logger import setup_logger
+from data_pipeline.trading_calendar import DEFAULT_SESSION
+
+log = setup_logger()
+
+# Upstox candle format: [timestamp, open, high, low, close, volume, oi]
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'oi']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+COUNT_COLUMNS = ['volume', 'oi']
+MARKET_TZ = 'Asia/Kolkata'
+SEGMENT_PATTERN = re.compile(r'^part-(\d{5})\.parquet$')
+MANIFEST_FILE = '_manifest.json'
+READ_ATTEMPTS = 3  # Segment listings tried when a segment disappears mid-read (compaction)
+
+# One lock per store so background compaction never races readers/writers in this process.
+# Other processes are covered by atomic replaces and read_ohlcv's re-list on a vanished segment.
+_store_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def get_store_path(ohlcv_dir: str, etf: str) -> str:
+    """Returns the store directory for one ETF."""
+    return os.path.join(ohlcv_dir, etf)
+
+
+def get_legacy_json_path(ohlcv_dir: str, etf: str) -> str:
+    """Returns the pre-Parquet '{ETF}_1m_history.json' path."""
+    return os.path.join(ohlcv_dir, f"{etf}_1m_history.json")
+
+
+def candles_to_frame(candles: List[List]) -> pd.DataFrame:
+    """
+    Converts raw Upstox candle rows to a typed DataFrame.
+    Output is sorted chronologically and deduplicated on timestamp.
+    """
+    if not candles:
+        return _empty_frame()
+
+    df = pd.DataFrame([row[:len(OHLCV_COLUMNS)] for row in candles], columns=OHLCV_COLUMNS)
+    return _normalize_frame(df)
+
+
+def read_ohlcv(store_path: str, start: Optional[pd.Timestamp] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Loads candles for one ETF as a DataFrame indexed by timestamp.
+    'start' prunes whole month partitions before it is applied row-wise.
+    A segment removed by a concurrent compaction between listing and reading
+    triggers a fresh listing (the merged segment replaces it before removal).
+    """
+    read_cols = None if columns is None else ['timestamp'] + [c for c in columns if c != 'timestamp']
+    for attempt in range(READ_ATTEMPTS):
+        with _get_lock(store_path):
+            files = _list_segment_files(store_path, start)
+            if not files:
+                return _empty_frame().set_index('timestamp')
+            try:
+                df = pd.concat([pd.read_parquet(f, columns=read_cols) for f in files], ignore_index=True)
+                break
+            except FileNotFoundError:
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+
+    if start is not None:
+        df = df[df['timestamp'] >= _to_market_ts(start)]
+
+    # Later segments win on overlap (e.g. an interrupted compaction)
+    df = df.drop_duplicates(subset='timestamp', keep='last')
+    return df.set_index('timestamp').sort_index()
+
+
+def get_last_timestamp(store_path: str) -> Optional[pd.Timestamp]:
+    """Returns the newest stored timestamp from the manifest (no candle data is read)."""
+    last_ts = get_manifest(store_path).get('last_ts')
+    return pd.Timestamp(last_ts) if last_ts else None
+
+
+def get_manifest(store_path: str) -> Dict[str, Any]:
+    """
+    Returns the store manifest:
+    {first_ts, last_ts, rows, checksum, segments: {rel_path: {rows, first_ts, last_ts, sha256, day_bars}}}
+    Rebuilt from the segments if missing, unreadable or out of step with the files on disk;
+    entries written before 'day_bars' existed are re-described once.
+    """
+    with _get_lock(store_path):
+        manifest = _read_manifest(store_path)
+        on_disk = set(_relative_segments(store_path))
+
+        if manifest is None or set(manifest['segments']) != on_disk:
+            if not on_disk:
+                return _summarize({})
+            log.info(f"Rebuilding manifest for {os.path.basename(store_path)}", tags=["DATA", "MANIFEST"])
+            verified = manifest.get('verified_gaps', []) if manifest else []
+            manifest = _summarize({rel: _describe_segment(store_path, rel) for rel in on_disk}, verified)
+            _write_manifest(store_path, manifest)
+        elif any('day_bars' not in meta for meta in manifest['segments'].values()):
+            segments = {rel: meta if 'day_bars' in meta else _describe_segment(store_path, rel)
+                        for rel, meta in manifest['segments'].items()}
+            manifest = _summarize(segments, manifest.get('verified_gaps', []))
+            _write_manifest(store_path, manifest)
+
+        return manifest
+
+
+def get_session_bar_counts(store_path: str) -> Dict[str, int]:
+    """
+    {'YYYY-MM-DD': bars inside DEFAULT_SESSION} summed over the manifest's segments.
+    No candle data is read. Writes and compaction deduplicate, so segments only overlap after
+    an interrupted compaction, which can overstate a day until the next compaction.
+    """
+    counts: Dict[str, int] = {}
+    for meta in get_manifest(store_path)['segments'].values():
+        for day, bars in meta['day_bars'].items():
+            counts[day] = counts.get(day, 0) + bars
+    return counts
+
+
+def write_candles(store_path: str, new_df: pd.DataFrame, backfill: bool = False) -> int:
+    """
+    Appends new candles to the store as one new segment per touched month.
+    Only rows newer than the last stored timestamp are kept, so the cost is
+    O(new candles) regardless of history length. Returns number of rows written.
+    With 'backfill', rows inside the history are accepted instead and deduplicated
+    against the timestamps of the touched months only.
+    """
+    if new_df.empty:
+        return 0
+
+    manifest = get_manifest(store_path)
+    if backfill:
+        new_df = _drop_stored_timestamps(store_path, new_df)
+    elif manifest['last_ts']:
+        new_df = new_df[new_df['timestamp'] > pd.Timestamp(manifest['last_ts'])]
+    if new_df.empty:
+        return 0
+
+    with _get_lock(store_path):
+        segments = dict(manifest['segments'])
+        for month, month_df in new_df.groupby(new_df['timestamp'].dt.strftime('%Y-%m')):
+            month_dir = os.path.join(store_path, month)
+            os.makedirs(month_dir, exist_ok=True)
+            rel = os.path.join(month, _next_segment_name(month_dir))
+            _write_parquet_atomic(month_df, os.path.join(store_path, rel))
+            segments[rel] = _describe_segment(store_path, rel, month_df)
+
+        _write_manifest(store_path, _summarize(segments, manifest.get('verified_gaps', [])))
+
+    return len(new_df)
+
+
+def mark_days_verified(store_path: str, days: List[date]) -> None:
+    """
+    Records trading days that were refetched during backfill.
+    Gap scans skip them, so days the broker has no bars for are requested only once.
+    """
+    if not days:
+        return
+    manifest = get_manifest(store_path)
+
+    with _get_lock(store_path):
+        verified = set(manifest.get('verified_gaps', [])) | {d.isoformat() for d in days}
+        _write_manifest(store_path, _summarize(manifest['segments'], sorted(verified)))
+
+
+def compact_store(store_path: str, max_segments: int) -> int:
+    """
+    Merges segments of a month into a single file.
+    Closed months are compacted as soon as they hold more than one segment;
+    the current (still growing) month only once it exceeds 'max_segments'.
+    Returns number of months compacted.
+    """
+    compacted = 0
+    months = _list_months(store_path)
+    verified = get_manifest(store_path).get('verified_gaps', [])
+
+    for i, month in enumerate(months):
+        is_open_month = (i == len(months) - 1)
+        threshold = max_segments if is_open_month else 1
+
+        with _get_lock(store_path):
+            segments = _list_month_segments(store_path, month)
+            if len(segments) <= threshold:
+                continue
+
+            merged = _normalize_frame(pd.concat([pd.read_parquet(f) for f in segments], ignore_index=True))
+            # Replace first segment with the merged superset, then drop the rest.
+            # A crash in between only leaves duplicates, which readers drop.
+            _write_parquet_atomic(merged, segments[0])
+            for f in segments[1:]:
+                os.remove(f)
+
+            manifest_segments = {
+                rel: meta for rel, meta in _read_manifest(store_path)['segments'].items()
+                if not rel.startswith(month + os.sep)
+            }
+            first_rel = os.path.relpath(segments[0], store_path)
+            manifest_segments[first_rel] = _describe_segment(store_path, first_rel, merged)
+            _write_manifest(store_path, _summarize(manifest_segments, verified))
+            compacted += 1
+
+    return compacted
+
+
+def start_background_compaction(store_paths: List[str], max_segments: int) -> threading.Thread:
+    """Runs compact_store over all stores in a worker thread."""
+    def _run():
+        total = 0
+        for path in store_paths:
+            try:
+                total += compact_store(path, max_segments)
+            except Exception as e:
+                log.warning(f"Compaction failed for {os.path.basename(path)}: {e}", tags=["DATA", "COMPACT"])
+        if total:
+            log.info(f"Compacted {total} month partition(s).", tags=["DATA", "COMPACT"])
+
+    worker = threading.Thread(target=_run, name="ohlcv-compaction")
+    worker.start()
+    return worker
+
+
+def clear_store(store_path: str) -> None:
+    """Removes all stored candles for one ETF (used by forced resync)."""
+    with _get_lock(store_path):
+        if os.path.isdir(store_path):
+            shutil.rmtree(store_path)
+
+
+def migrate_legacy_json(json_path: str, store_path: str) -> bool:
+    """
+    One-time conversion of a legacy '*_1m_history.json' file into the store.
+    Skipped if the store already holds data. The JSON file is left in place.
+    """
+    if not os.path.exists(json_path) or _list_months(store_path):
+        return False
+
+    try:
+        with open(json_path, 'r') as f:
+            candles = json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        log.warning(f"Legacy cache unreadable ({os.path.basename(json_path)}): {e}", tags=["DATA", "MIGRATE"])
+        return False
+
+    rows = write_candles(store_path, candles_to_frame(candles))
+    log.info(f"Migrated {os.path.basename(json_path)} to Parquet store ({rows} rows). JSON can be deleted.", tags=["DATA", "MIGRATE"])
+    return True
+
+
+# --- Helpers ---
+
+
+def _get_lock(store_path: str) -> threading.Lock:
+    key = os.path.abspath(store_path)
+    with _registry_lock:
+        if key not in _store_locks:
+            _store_locks[key] = threading.Lock()
+        return _store_locks[key]
+
+
+def _read_manifest(store_path: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(store_path, MANIFEST_FILE)
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest.get('segments'), dict) else None
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_manifest(store_path: str, manifest: Dict[str, Any]) -> None:
+    os.makedirs(store_path, exist_ok=True)
+    path = os.path.join(store_path, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _describe_segment(store_path: str, rel: str, df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+    """Row count, time bounds, file hash and per-day in-session bar counts of one segment."""
+    path = os.path.join(store_path, rel)
+    ts = (df if df is not None else pd.read_parquet(path, columns=['timestamp']))['timestamp']
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+
+    return {
+        'rows': int(len(ts)),
+        'first_ts': ts.min().isoformat() if len(ts) else None,
+        'last_ts': ts.max().isoformat() if len(ts) else None,
+        'sha256': sha.hexdigest(),
+        'day_bars': _session_bar_counts(ts)
+    }
+
+
+def _session_bar_counts(ts: pd.Series) -> Dict[str, int]:
+    """Bars per day whose minute lies in [session open, session close)."""
+    if not len(ts):
+        return {}
+    minute = _to_market_ts(ts).dt.strftime('%H:%M')
+    in_session = ts[(minute >= DEFAULT_SESSION[0]) & (minute < DEFAULT_SESSION[1])]
+    counts = _to_market_ts(in_session).dt.strftime('%Y-%m-%d').value_counts()
+    return {day: int(n) for day, n in sorted(counts.items())}
+
+
+def _summarize(segments: Dict[str, Dict[str, Any]], verified_gaps: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Builds store-level totals and a combined checksum from segment entries."""
+    firsts = [m['first_ts'] for m in segments.values() if m['first_ts']]
+    lasts = [m['last_ts'] for m in segments.values() if m['last_ts']]
+
+    checksum = hashlib.sha256()
+    for rel in sorted(segments):
+        checksum.update(f"{rel}:{segments[rel]['sha256']};".encode())
+
+    return {
+        'first_ts': min(firsts, key=pd.Timestamp) if firsts else None,
+        'last_ts': max(lasts, key=pd.Timestamp) if lasts else None,
+        'rows': sum(m['rows'] for m in segments.values()),
+        'checksum': checksum.hexdigest(),
+        'segments': {rel: segments[rel] for rel in sorted(segments)},
+        'verified_gaps': verified_gaps or []
+    }
+
+
+def _drop_stored_timestamps(store_path: str, new_df: pd.DataFrame) -> pd.DataFrame:
+    """Removes rows already present in the months 'new_df' touches."""
+    months = set(new_df['timestamp'].dt.strftime('%Y-%m'))
+    with _get_lock(store_path):
+        files = [f for m in sorted(months) for f in _list_month_segments(store_path, m)]
+        if not files:
+            return new_df
+        stored = pd.concat([pd.read_parquet(f, columns=['timestamp'])['timestamp'] for f in files])
+    return new_df[~new_df['timestamp'].isin(stored)]
+
+
+def _relative_segments(store_path: str) -> List[str]:
+    return [os.path.relpath(f, store_path) for f in _list_segment_files(store_path, None)]
+
+
+def _empty_frame() -> pd.DataFrame:
+    df = pd.DataFrame({c: pd.Series(dtype='float64') for c in OHLCV_COLUMNS})
+    df['timestamp'] = pd.Series(dtype=f'datetime64[ns, {MARKET_TZ}]')
+    df[COUNT_COLUMNS] = df[COUNT_COLUMNS].astype('int64')
+    return df
+
+
+def _normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Applies the store schema, sorts and deduplicates (last write wins)."""
+    df = df.copy()
+    df['timestamp'] = _to_market_ts(pd.to_datetime(df['timestamp'], utc=True))
+    df[PRICE_COLUMNS] = df[PRICE_COLUMNS].apply(pd.to_numeric, errors='coerce').astype('float64')
+    df[COUNT_COLUMNS] = df[COUNT_COLUMNS].apply(pd.to_numeric, errors='coerce').fillna(0).astype('int64')
+
+    df = df.drop_duplicates(subset='timestamp', keep='last')
+    return df.sort_values('timestamp').reset_index(drop=True)[OHLCV_COLUMNS]
+
+
+def _to_market_ts(ts):
+    """Converts a Timestamp/Series to tz-aware market time."""
+    if isinstance(ts, pd.Series):
+        return ts.dt.tz_convert(MARKET_TZ)
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize(MARKET_TZ) if ts.tzinfo is None else ts.tz_convert(MARKET_TZ)
+
+
+def _list_months(store_path: str) -> List[str]:
+    """Returns sorted 'YYYY-MM' partitions that contain at least one segment."""
+    if not os.path.isdir(store_path):
+        return []
+    return sorted(m for m in os.listdir(store_path) if _list_month_segments(store_path, m))
+
+
+def _list_month_segments(store_path: str, month: str) -> List[str]:
+    """Returns a month's segment files in write order."""
+    month_dir = os.path.join(store_path, month)
+    if not os.path.isdir(month_dir):
+        return []
+    return [os.path.join(month_dir, f) for f in sorted(os.listdir(month_dir)) if SEGMENT_PATTERN.match(f)]
+
+
+def _list_segment_files(store_path: str, start: Optional[pd.Timestamp]) -> List[str]:
+    months = _list_months(store_path)
+    if start is not None:
+        start_month = _to_market_ts(start).strftime('%Y-%m')
+        months = [m for m in months if m >= start_month]
+    return [f for m in months for f in _list_month_segments(store_path, m)]
+
+
+def _next_segment_name(month_dir: str) -> str:
+    seqs = [int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(month_dir)) if m]
+    return f"part-{(max(seqs) + 1) if seqs else 0:05d}.parquet"
+
+
+def _write_parquet_atomic(df: pd.DataFrame, path: str) -> None:
+    """Writes to a temp file then renames, so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False, compression='snappy')
+    os.replace(tmp_path, path)
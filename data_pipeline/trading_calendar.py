@@ -0,0 +1,64 @@
+# data_pipeline/trading_calendar.py
+
+"""
+NSE TRADING CALENDAR.
+Weekday sessions (09:15-15:30 IST) minus exchange holidays from 'holiday_calendar_file'.
+Used to decide which days should have 1-minute bars.
+"""
+
+import json
+import os
+import pandas as pd
+from datetime import date, datetime
+from typing import Dict, Any, Set
+from utils.logger import setup_logger
+
+log = setup_logger()
+
+DEFAULT_SESSION = ('09:15', '15:30')
+
+
+class TradingCalendar:
+    """Trading days and session length for the NSE cash segment."""
+
+    def __init__(self, holidays: Set[date], session_open: str = DEFAULT_SESSION[0], session_close: str = DEFAULT_SESSION[1]):
+        self.holidays = holidays
+        self.session_open = session_open
+        self.session_close = session_close
+
+    @property
+    def bars_per_session(self) -> int:
+        """Number of 1-minute bars in a full session (375 for 09:15-15:30)."""
+        open_t = datetime.strptime(self.session_open, '%H:%M')
+        close_t = datetime.strptime(self.session_close, '%H:%M')
+        return int((close_t - open_t).total_seconds() // 60)
+
+    def trading_days(self, start: date, end: date) -> pd.DatetimeIndex:
+        """Weekdays in [start, end] that are not exchange holidays."""
+        if start > end:
+            return pd.DatetimeIndex([])
+        days = pd.bdate_range(start, end)
+        return days[~days.isin(pd.to_datetime(sorted(self.holidays)))] if self.holidays else days
+
+
+def load_trading_calendar(universal_data: Dict[str, Any]) -> TradingCalendar:
+    """Builds the calendar from the configured holiday file (weekdays-only fallback if missing)."""
+    paths = universal_data['configs']['system_settings']['paths']
+    rel_path = paths.get('holiday_calendar_file', 'source/nse_holidays.json')
+    path = os.path.join(universal_data['system']['project_root'], rel_path)
+
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        holidays = {datetime.strptime(d, '%Y-%m-%d').date() for d in data.get('holidays', [])}
+        if holidays and date.today().year > max(holidays).year:
+            log.warning(f"Holiday calendar ends in {max(holidays).year}; this year's exchange holidays will be "
+                        f"scanned as gaps. Add them to {rel_path}.", tags=["DATA", "CALENDAR"])
+        return TradingCalendar(
+            holidays,
+            data.get('session_open', DEFAULT_SESSION[0]),
+            data.get('session_close', DEFAULT_SESSION[1])
+        )
+    except (OSError, json.JSONDecodeError, ValueError) as e:
+        log.warning(f"Holiday calendar unavailable ({e}). Treating all weekdays as sessions.", tags=["DATA", "CALENDAR"])
+        return TradingCalendar(set())
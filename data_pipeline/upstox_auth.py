@@ -3,7 +3,8 @@
 """
 AUTHENTICATION ENGINE - Upstox API Access Token Management.
 Handles daily token lifecycle (expires 3:30 AM IST).
-Integrates Playwright for automated login if token is expired.
+Integrates Playwright for automated login if token is expired
+(Playwright and pyotp are only imported when a fresh login actually runs).
 Respects 'force_fresh_login' debug flag.
 """
 
@@ -12,12 +13,11 @@ import os
 import time
 from datetime import datetime, timedelta
 from urllib.parse import urlparse, parse_qs, quote
-import requests
 import pytz
-import pyotp
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 from typing import Dict, Any, Optional
 from utils.logger import setup_logger
+from utils.http_client import http_post
+from utils.lazy_import import load
 
 log = setup_logger()
 
@@ -149,6 +149,8 @@ def _execute_full_authentication(universal_data: Dict[str, Any], creds: Dict[str
 
 def _obtain_auth_code_via_browser(universal_data: Dict[str, Any], creds: Dict[str, str]) -> Optional[str]:
     """Uses Playwright to handle Upstox login UI."""
+    sync_playwright = load('playwright.sync_api').sync_playwright
+    pyotp = load('pyotp')
    
     api_key = creds['API_KEY']
     redirect_uri = creds['RURL']
@@ -214,7 +216,7 @@ def _exchange_code_for_token(universal_data: Dict[str, Any], creds: Dict[str, st
     headers = {'accept': 'application/json', 'Api-Version': '2.0', 'Content-Type': 'application/x-www-form-urlencoded'}
    
     try:
-        resp = requests.post(token_api, data=payload, headers=headers, timeout=15)
+        resp = http_post(universal_data, token_api, data=payload, headers=headers)
         resp.raise_for_status()
         return resp.json().get('access_token')
     except Exception as e:
@@ -0,0 +1,152 @@
+# decision_engine/allocation_solver.py
+"""
+CONSTRAINED ALLOCATION SOLVER.
+Splits the weekly buy budget across eligible ETFs in proportion to their gap to target,
+subject to per-ETF value caps and per-tag value caps, then converts to whole units.
+1. Water-filling: every uncapped ETF rises at the same 'level' (x_i = level * weight_i) until
+   the budget runs out; ETFs (or whole tags) that hit a cap are frozen and the remainder
+   keeps flowing to the others.
+2. Unit rounding: allocations are floored to whole units and the rounding leftover is
+   re-deployed one unit at a time (largest shortfall first) while caps allow. Nearest-unit
+   rounding instead trims units back (largest overshoot first) until budget and caps hold.
+Cost is O(iterations x (ETFs + tags)); iterations are bounded by ETFs + tags.
+"""
+
+import numpy as np
+from typing import Dict, List, Tuple
+
+EPS = 1e-9
+
+
+def solve_allocation(weights: np.ndarray, prices: np.ndarray, etf_caps: np.ndarray, budget: float,
+                     tag_matrix: np.ndarray = None, tag_caps: np.ndarray = None, round_down: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (units, values) per ETF.
+    weights:    allocation weights (e.g. gap to target; 0 = never buy)
+    prices:     entry price per unit (<= 0 = not buyable)
+    etf_caps:   max value to buy per ETF
+    tag_matrix: (tags x ETFs) boolean membership; tag_caps: max value to buy per tag
+    round_down: floor to whole units and redeploy the leftover (True), or round to the nearest
+                unit and trim back any unit that breaks the budget or a cap (False)
+    """
+    n = len(weights)
+    if tag_matrix is None or tag_caps is None:
+        tag_matrix, tag_caps = np.zeros((0, n), dtype=bool), np.zeros(0)
+
+    buyable = (weights > 0) & (prices > 0)
+    caps = np.where(buyable, np.maximum(etf_caps, 0.0), 0.0)
+    tag_caps = np.maximum(tag_caps, 0.0)
+
+    values = water_fill(np.where(buyable, weights, 0.0), caps, budget, tag_matrix, tag_caps)
+    if not round_down:
+        units = np.where(buyable, np.round(values / np.where(buyable, prices, 1.0)), 0.0)
+        units = _trim_units(units, values, prices, caps, budget, tag_matrix, tag_caps)
+        return units, units * prices
+
+    units = _round_units(values, prices, caps, budget, tag_matrix, tag_caps, buyable)
+    return units, units * prices
+
+
+def water_fill(weights: np.ndarray, caps: np.ndarray, budget: float, tag_matrix: np.ndarray, tag_caps: np.ndarray) -> np.ndarray:
+    """Continuous allocation x_i = min(level * w_i, caps), with tag sums <= tag_caps and sum(x) <= budget."""
+    x = np.zeros(len(weights))
+    free = (weights > 0) & (caps > EPS)
+    remaining = float(budget)
+    tag_load = np.zeros(len(tag_caps))
+
+    # Tags already at their cap freeze their members up front
+    free &= ~tag_matrix[tag_caps <= EPS].any(axis=0)
+
+    while remaining > EPS * max(budget, 1.0) and free.any():
+        w = np.where(free, weights, 0.0)
+
+        # Level increase each constraint allows before binding
+        etf_room = np.where(free, (caps - x) / np.where(free, weights, 1.0), np.inf)
+        tag_rate = tag_matrix @ w
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tag_room = np.where(tag_rate > 0, (tag_caps - tag_load) / tag_rate, np.inf)
+        step = min(remaining / w.sum(), etf_room.min(), tag_room.min(initial=np.inf))
+
+        x += step * w
+        remaining -= step * w.sum()
+        tag_load = tag_matrix @ x
+
+        # Freeze ETFs at their cap and every member of a tag at its cap
+        free &= (caps - x) > EPS * np.maximum(caps, 1.0)
+        full_tags = (tag_caps - tag_load) <= EPS * np.maximum(tag_caps, 1.0)
+        if full_tags.any():
+            free &= ~tag_matrix[full_tags].any(axis=0)
+
+    return x
+
+
+def tag_membership(tags: List[str], tag_caps: Dict[str, float]) -> Tuple[np.ndarray, List[str]]:
+    """(capped tags x ETFs) membership matrix from comma-separated tag strings, matched case-insensitively."""
+    names = list(tag_caps)
+    lookup = {name.strip().lower(): k for k, name in enumerate(names)}
+    matrix = np.zeros((len(names), len(tags)), dtype=bool)
+    for j, label in enumerate(tags):
+        for tag in str(label or '').split(','):
+            k = lookup.get(tag.strip().lower())
+            if k is not None:
+                matrix[k, j] = True
+    return matrix, names
+
+
+# --- Helpers ---
+
+
+def _round_units(values: np.ndarray, prices: np.ndarray, caps: np.ndarray, budget: float,
+                 tag_matrix: np.ndarray, tag_caps: np.ndarray, buyable: np.ndarray) -> np.ndarray:
+    """Floors to whole units, then spends the leftover one unit at a time while budget and caps allow."""
+    safe_prices = np.where(buyable, prices, np.inf)
+    units = np.floor(values / safe_prices + EPS)
+
+    spent = units * np.where(buyable, prices, 0.0)
+    leftover = budget - spent.sum()
+    tag_room = tag_caps - tag_matrix @ spent
+    etf_room = caps - spent
+
+    while True:
+        # Candidates: one more unit fits the leftover, the ETF cap and every tag cap it belongs to
+        fits = buyable & (safe_prices <= leftover + EPS) & (safe_prices <= etf_room + EPS)
+        if tag_matrix.size:
+            fits &= ~(tag_matrix & (safe_prices[None, :] > tag_room[:, None] + EPS)).any(axis=0)
+        if not fits.any():
+            return units
+
+        # Largest shortfall against the continuous solution first
+        shortfall = np.where(fits, values - units * prices, -np.inf)
+        added = False
+        for j in np.argsort(-shortfall, kind='stable'):
+            if not fits[j]:
+                break
+            price = prices[j]
+            if price > leftover + EPS or price > etf_room[j] + EPS or (tag_room[tag_matrix[:, j]] < price - EPS).any():
+                continue
+            units[j] += 1
+            leftover -= price
+            etf_room[j] -= price
+            tag_room[tag_matrix[:, j]] -= price
+            added = True
+        if not added:
+            return units
+
+
+def _trim_units(units: np.ndarray, values: np.ndarray, prices: np.ndarray, caps: np.ndarray, budget: float,
+                tag_matrix: np.ndarray, tag_caps: np.ndarray) -> np.ndarray:
+    """Removes rounded-up units (largest overshoot first) until the budget, ETF caps and tag caps hold."""
+    units = np.minimum(units, np.floor(caps / np.where(units > 0, prices, np.inf) + EPS))
+    units = np.where(units > 0, units, 0.0)
+
+    while True:
+        spent = units * prices
+        over_tags = (tag_matrix @ spent) > tag_caps + EPS * np.maximum(tag_caps, 1.0)
+        candidates = tag_matrix[over_tags].any(axis=0)
+        if spent.sum() > budget + EPS * max(budget, 1.0):
+            candidates = np.ones(len(units), dtype=bool)
+        candidates &= units > 0
+        if not candidates.any():
+            return units
+        overshoot = np.where(candidates, spent - values, -np.inf)
+        units[int(np.argmax(overshoot))] -= 1
@@ -3,32 +3,41 @@
 HARVEST TRIGGER ENGINE.
 Checks for profit-taking opportunities (H1, H2, H3 triggers).
 Applies Safety Floors (DriftBand, CoreFloor) and Sleeve Caps.
+All holdings are evaluated at once as aligned columns (holdings joined with the 1W snapshot).
 """
+import numpy as np
 import pandas as pd
 from typing import Dict, Any, Tuple
 from utils.logger import setup_logger
+from data_pipeline.indicator_snapshot import get_snapshot
 
 log = setup_logger()
 
+TRIGGER_COLUMNS = ['ETF', 'Trigger', 'Trim_Units', 'Trim_Pct', 'Est_Value']
+
 
 def find_harvest_triggers(universal_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Logic:
     1. Filter holdings in profit (Avg Price < Current Price).
-    2. Check Triggers:
+    2. Check Triggers (first match wins):
        - H1 Stretch: RSI > 70
-       - H2 Vol Spike: ATR% > 80th Percentile (Using fixed threshold 3.5% as proxy if history missing)
-       - H3 Breakdown: TSI Cross Down
-    3. Calculate Trim Size (10-15%)
+       - H2 Vol Spike: ATR% rank over 'lookback_weeks' (26) > 'atr_percentile' (80)
+         (Using fixed threshold 3.5% as proxy if the rank is not available yet)
+       - H3 Breakdown: TSI Cross Down on the latest weekly bar (15%; 25% if the close is also below the 50-DMA)
+    3. Calculate Trim Size (10-15%), capped by MaxTrimPerETF.
     4. Apply Floors: Ensure trim doesn't push weight below (Target - Drift) or (CoreFloor * Target).
+    5. Apply Sleeve Cap: If total trim value exceeds WeeklyHarvestCap_% of the S2 sleeve value,
+       scale all trims down proportionally.
     """
     log.info("=== HARVEST CHECK STARTED ===", tags=["DECISION", "HARVEST"])
-   
+
     # Inputs
     holdings = universal_data['portfolio_state']['holdings']
-    snapshot = universal_data['market_data'].get('indicator_snapshot_df')
+    snapshot = get_snapshot(universal_data)
     system_params = universal_data['configs']['system_params']
-   
+    strategy = universal_data['configs'].get('strategy_settings') or {}
+
     if holdings.empty:
         log.info("Portfolio is empty. No harvest needed.", tags=["DECISION", "HARVEST"])
         universal_data['analysis']['harvest_triggers_df'] = pd.DataFrame()
@@ -37,125 +46,120 @@ def find_harvest_triggers(universal_data: Dict[str, Any]) -> Dict[str, Any]:
     drift_band = _get_param(system_params, 'DriftBand_%', 10.0)
     core_floor_pct = _get_param(system_params, 'CoreFloor_%', 70.0)
     max_trim_pct = _get_param(system_params, 'MaxTrimPerETF_%', 25.0)
-   
-    harvest_actions = []
-   
-    for _, pos in holdings.iterrows():
-        etf = pos['Ticker']
-        units = float(pos['Units'])
-        avg_price = float(pos['Avg_Buy_Price'])
-        curr_price = float(pos['Current_Price'])
-       
-        # 1. Check Profitability (Only harvest Green)
-        if curr_price <= avg_price:
-            continue
-           
-        if snapshot is None or snapshot.empty:
-            continue
-           
-        # Get Technical Data
-        data = snapshot[ (snapshot['ETF'] == etf) & (snapshot['Timeframe'] == '1W') ]
-        if data.empty: continue
-       
-        latest = data.iloc[0]
-       
-        # 2. Check Triggers
-        trigger_type, base_trim = _check_trigger_conditions(latest)
-       
-        if not trigger_type:
-            continue
-           
-        # 3. Calculate Proposed Trim
-        # Limit base trim by MaxTrimPerETF
-        actual_trim_pct = min(base_trim, max_trim_pct)
-       
-        # 4. Apply Floors
-        # Current Weight vs Target Weight Logic
-        # We need safe metrics. If 'Current_%' is missing, calculate it?
-        # Assuming 'Current_%' exists from State Reader.
-        curr_weight = float(pos.get('Current_%', 0))
-        target_weight = float(pos.get('Target_%', 0))
-       
-        # Floor 1: Drift Floor (Target - Drift)
-        drift_floor = target_weight - drift_band
-       
-        # Floor 2: Core Floor (Target * CoreFloor%)
-        core_floor = target_weight * (core_floor_pct / 100.0)
-       
-        # The absolute floor is the max of these two (highest safety level)
-        hard_floor_weight = max(drift_floor, core_floor)
-       
-        # Calculate Post-Trim Weight
-        # Weight to shed = curr_weight * (actual_trim_pct / 100)
-        post_trim_weight = curr_weight * (1 - (actual_trim_pct/100.0))
-       
-        if post_trim_weight < hard_floor_weight:
-            # Trim is too aggressive, hitting floor.
-            # Adjust trim to land exactly on floor
-            allowed_shed = max(0, curr_weight - hard_floor_weight)
-            if allowed_shed == 0:
-                log.info(f"Skipping harvest for {etf}: Hit Floor (Weight {curr_weight}% vs Floor {hard_floor_weight}%)", tags=["DECISION", "HARVEST", "FLOOR"])
-                continue
-           
-            # Recalculate trim %
-            actual_trim_pct = (allowed_shed / curr_weight) * 100.0
-       
-        # 5. Final Units
-        trim_units = int(units * (actual_trim_pct / 100.0))
-       
-        if trim_units > 0:
-            harvest_actions.append({
-                'ETF': etf,
-                'Trigger': trigger_type,
-                'Trim_Units': trim_units,
-                'Trim_Pct': round(actual_trim_pct, 2),
-                'Est_Value': round(trim_units * curr_price, 2)
-            })
-            log.info(f"Harvest Triggered: {etf} ({trigger_type}) -> Trim {trim_units} units", tags=["DECISION", "HARVEST"])
-    # 6. Save
-    df = pd.DataFrame(harvest_actions)
-    universal_data['analysis']['harvest_triggers_df'] = df
-   
+    harvest_cap_pct = _get_param(system_params, 'WeeklyHarvestCap_%',
+                                 strategy.get('risk_controls', {}).get('weekly_harvest_cap_percent', 12.0))
+
+    # Aligned position columns
+    etfs = holdings['Ticker'].to_numpy()
+    units = _column(holdings, 'Units')
+    avg_price = _column(holdings, 'Avg_Buy_Price')
+    curr_price = _column(holdings, 'Current_Price')
+    curr_weight = _column(holdings, 'Current_%')
+    target_weight = _column(holdings, 'Target_%')
+
+    # 1. Profitability (Only harvest Green) and Technical Data
+    has_data = np.array([snapshot.has(etf, '1W') for etf in etfs], dtype=bool)
+    eligible = (curr_price > avg_price) & has_data
+
+    # 2. Triggers
+    weekly = snapshot.frame('1W', etfs)
+    daily = snapshot.frame('1d', etfs)
+    weekly['dma_break'] = daily['sma_break'].to_numpy() if 'sma_break' in daily else np.nan
+    trigger, base_trim = _evaluate_triggers(weekly, strategy.get('harvest_triggers', {}))
+    triggered = eligible & (trigger != '')
+
+    # 3. Proposed Trim (limited by MaxTrimPerETF)
+    trim_pct = np.minimum(base_trim, max_trim_pct)
+
+    # 4. Floors: the absolute floor is the higher of Drift Floor (Target - Drift) and Core Floor (Target * CoreFloor%)
+    hard_floor = np.maximum(target_weight - drift_band, target_weight * (core_floor_pct / 100.0))
+    post_trim_weight = curr_weight * (1 - trim_pct / 100.0)
+    allowed_shed = np.maximum(0.0, curr_weight - hard_floor)
+    floored = triggered & (post_trim_weight < hard_floor)
+    at_floor = floored & (allowed_shed == 0)
+
+    # Trim too aggressive: adjust it to land exactly on the floor
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trim_pct = np.where(floored & ~at_floor, allowed_shed / curr_weight * 100.0, trim_pct)
+
+    for i in np.flatnonzero(at_floor):
+        log.info(f"Skipping harvest for {etfs[i]}: Hit Floor (Weight {curr_weight[i]}% vs Floor {hard_floor[i]}%)",
+                 tags=["DECISION", "HARVEST", "FLOOR"])
+    active = triggered & ~at_floor
+
+    # 5. Sleeve Cap
+    trim_units = np.trunc(units * trim_pct / 100.0)
+    trim_pct, trim_units = _apply_sleeve_cap(trim_pct, trim_units, units, curr_price, active, harvest_cap_pct)
+
+    # 6. Final Units
+    keep = active & (trim_units > 0)
+    df = pd.DataFrame({
+        'ETF': etfs[keep],
+        'Trigger': trigger[keep],
+        'Trim_Units': trim_units[keep].astype(int),
+        'Trim_Pct': np.round(trim_pct[keep], 2),
+        'Est_Value': np.round(trim_units[keep] * curr_price[keep], 2)
+    }, columns=TRIGGER_COLUMNS)
+    for row in df.itertuples(index=False):
+        log.info(f"Harvest Triggered: {row.ETF} ({row.Trigger}) -> Trim {row.Trim_Units} units", tags=["DECISION", "HARVEST"])
+
+    # 7. Save
+    universal_data['analysis']['harvest_triggers_df'] = df if not df.empty else pd.DataFrame()
+
     return universal_data
 
 
-def _check_trigger_conditions(row: pd.Series) -> Tuple[str, float]:
+def _evaluate_triggers(weekly: pd.DataFrame, trigger_cfg: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Returns (TriggerName, TrimPercent).
-    Returns (None, 0.0) if no trigger.
+    Returns aligned arrays (TriggerName, TrimPercent); '' and 0.0 where nothing fired.
+    Trigger priority is H1 > H2 > H3.
     """
-    # Parse Indicators
-    try:
-        rsi = _get_val(row, 'RSI')
-        atr_pct = _get_val(row, 'ATRp')
-        tsi_val = _get_val(row, 'TSI_')
-        tsi_sig = _get_val(row, 'TSIs_')
-    except:
-        return None, 0.0
-   
-    # H1: Stretch
-    if rsi > 70:
-        return "H1_Stretch", 10.0
-       
-    # H2: Volatility Spike
-    # Ideally check percentile. Proxy: ATR > 3.5% (High vol for ETF)
-    if atr_pct > 3.5:
-        return "H2_VolSpike", 15.0
-       
-    # H3: Breakdown
-    # TSI Crossed Down (Val < Sig) AND was previously up?
-    # Snapshot limitation: We only see current state.
-    # If TSI < Sig, it's in a downtrend. We use this as a "stay clean" trigger if also Profit protected.
-    if tsi_val < tsi_sig:
-        return "H3_Breakdown", 15.0
-       
-    return None, 0.0
-
-
-def _get_val(row: pd.Series, prefix: str) -> float:
-    col = [c for c in row.index if c.startswith(prefix)]
-    if col: return float(row[col[0]])
-    return 0.0
+    h1 = trigger_cfg.get('h1_stretch', {})
+    h2 = trigger_cfg.get('h2_volspike', {})
+    h3 = trigger_cfg.get('h3_breakdown', {})
+
+    rsi, atr_pct, tsi_val, tsi_sig = weekly.reindex(columns=['rsi', 'atr_pct', 'tsi', 'tsi_signal']).fillna(0.0).to_numpy().T
+    atr_rank = weekly['atr_rank'].to_numpy() if 'atr_rank' in weekly else np.full(len(weekly), np.nan)
+    cross_down = weekly['tsi_cross_down'].to_numpy() if 'tsi_cross_down' in weekly else np.full(len(weekly), np.nan)
+    dma_break = weekly['dma_break'].to_numpy() == 1
+
+    conditions = [
+        # H1: Stretch
+        h1.get('enabled', True) & (rsi > h1.get('rsi_threshold', 70)),
+        # H2: Volatility Spike
+        # Rolling ATR% rank from the indicator pipeline. Proxy while it warms up: ATR > 3.5% (High vol for ETF)
+        h2.get('enabled', True) & np.where(np.isnan(atr_rank), atr_pct > 3.5, atr_rank > h2.get('atr_percentile', 80)),
+        # H3: Breakdown
+        # TSI cross-down event from the indicator pipeline. If it is not computed, TSI < Sig is used as a proxy.
+        h3.get('enabled', True) & np.where(np.isnan(cross_down), tsi_val < tsi_sig, cross_down == 1),
+    ]
+    # H3 trims harder when the weekly close is also below the 50-DMA (daily SMA break)
+    h3_trim = np.where(dma_break, h3.get('dma_break_trim_percent', 25.0), h3.get('trim_percent', 15.0))
+    names = np.select(conditions, ["H1_Stretch", "H2_VolSpike", "H3_Breakdown"], default='')
+    trims = np.select(conditions, [h1.get('trim_percent', 10.0), h2.get('trim_percent', 15.0), h3_trim], default=0.0)
+    return names, trims
+
+
+def _apply_sleeve_cap(trim_pct: np.ndarray, trim_units: np.ndarray, units: np.ndarray, price: np.ndarray,
+                      active: np.ndarray, cap_percent: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Scale down trim amounts if total exceeds weekly harvest cap (% of S2 sleeve value)."""
+    sleeve_value = float(np.sum(units * price))
+    cap_value = sleeve_value * cap_percent / 100.0
+    proposed_value = float(np.sum(np.where(active, trim_units * price, 0.0)))
+    if proposed_value <= cap_value or proposed_value == 0:
+        return trim_pct, trim_units
+
+    scale = cap_value / proposed_value
+    log.info(f"Harvest Cap: proposed trims {proposed_value:,.0f} exceed {cap_percent}% of sleeve "
+             f"({cap_value:,.0f}). Scaling trims by {scale:.2f}", tags=["DECISION", "HARVEST", "CAP"])
+    return trim_pct * scale, np.trunc(trim_units * scale)
+
+
+def _column(df: pd.DataFrame, name: str) -> np.ndarray:
+    """Numeric column as floats (0 where missing or unparseable)."""
+    if name not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[name], errors='coerce').fillna(0.0).to_numpy(dtype=float)
 
 
 def _get_param(df: Any, param_name: str, default: Any) -> Any:
@@ -164,4 +168,4 @@ def _get_param(df: Any, param_name: str, default: Any) -> Any:
         row = df[df['Parameter'] == param_name]
         if not row.empty: return float(row.iloc[0]['Value'])
     except: pass
-    return default
\ No newline at end of file
+    return default
@@ -2,14 +2,30 @@
 """
 HEALTH CHECK ENGINE.
 Evaluates technical 'Health Gates' for each ETF.
-Only ETFs passing ALL gates (Score 4/4) are eligible for buying.
+Only ETFs reaching the required score (health_gates.required_score, default 4/4) are eligible for buying.
+Gates are evaluated column-wise over the lineup joined with the 1W snapshot, so screening
+scales to the whole instrument master rather than a handful of tickers.
 """
+import numpy as np
 import pandas as pd
 from typing import Dict, Any
 from utils.logger import setup_logger
+from data_pipeline.indicator_snapshot import get_snapshot
 
 log = setup_logger()
 
+GATES = [
+    ('Gate_1_Trend', 'gate_1_tsi_above_signal'),
+    ('Gate_2_Mom', 'gate_2_rsi_above_50'),
+    ('Gate_3_Vol', 'gate_3_vwma_slope_positive'),
+    ('Gate_4_Risk', 'gate_4_atr_below_ceiling'),
+]
+MATRIX_COLUMNS = [
+    'ETF', 'TSI_Val', 'TSI_Sig', 'RSI', 'ATR_Pct', 'ATR_Ceiling',
+    'Gate_1_Trend', 'Gate_2_Mom', 'Gate_3_Vol', 'Gate_4_Risk',
+    'Health_Score', 'Pass', 'Reason'
+]
+
 
 def run_health_checks(universal_data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -17,128 +33,94 @@ def run_health_checks(universal_data: Dict[str, Any]) -> Dict[str, Any]:
     1. TSI > Signal (Trend)
     2. RSI > 50 (Momentum)
     3. VWMA Slope >= 0 (Volume Trend)
-    4. ATR% <= Ceiling (Volatility Safety)
+    4. ATR% <= Ceiling (Volatility Safety; per-ETF 'ATR_Override_%' wins over the global ceiling)
+    Gates switched off in 'health_gates' count as passed.
     """
     log.info("=== HEALTH CHECK STARTED ===", tags=["DECISION", "HEALTH"])
-   
+
     # Inputs
-    snapshot_df = universal_data['market_data'].get('indicator_snapshot_df')
+    snapshot = get_snapshot(universal_data)
     etf_lineup = universal_data['configs']['etf_lineup']
     system_params = universal_data['configs']['system_params']
-   
-    if snapshot_df is None or snapshot_df.empty:
+    strategy = universal_data['configs'].get('strategy_settings') or {}
+    health_cfg = strategy.get('health_gates', {})
+
+    if snapshot.empty:
         log.warning("No indicator snapshot available. All health checks will FAIL.", tags=["DECISION", "HEALTH"])
         universal_data['analysis']['health_matrix_df'] = pd.DataFrame()
         return universal_data
-       
+
     # Global Configs
-    global_atr_ceiling = _get_param(system_params, 'ATR_Ceiling_%', 2.0)
-   
-    health_results = []
-   
-    # Iterate over configured Lineup (not just what we fetched, to track missing data)
-    for _, row in etf_lineup.iterrows():
-        etf = row['Ticker']
-        if not row.get('Enabled', True):
-            continue
-           
-        # 1. Get ETF Specifics
-        atr_override = row.get('ATR_Override_%')
-        atr_ceiling = float(atr_override) if pd.notna(atr_override) and atr_override != '' else global_atr_ceiling
-       
-        # 2. Get Market Data (Weekly)
-        # We look for Timeframe='1W' in snapshot
-        data = snapshot_df[ (snapshot_df['ETF'] == etf) & (snapshot_df['Timeframe'] == '1W') ]
-       
-        if data.empty:
-            log.warning(f"No weekly data found for {etf}", tags=["DECISION", "HEALTH"])
-            health_results.append(_create_fail_record(etf, "NO_DATA"))
-            continue
-           
-        latest = data.iloc[0]
-       
-        # 3. Extract Indicators (Dynamic Column Handling)
-        # pandas-ta names columns like 'RSI_14', 'TSI_25_13_7', 'ATRp_14'
-        # We search for columns starting with the indicator name to be robust
-       
-        try:
-            rsi = _get_val(latest, 'RSI')
-            tsi = _get_val(latest, 'TSI') # The main TSI line
-            tsi_sig = _get_val(latest, 'TSIe') # The signal line (EMA of TSI) -> pandas-ta often labels signal as TSIs or similar.
-                                               # Note: In the calc config, we likely used 'tsi' which produces TSI_... and TSIs_...
-                                               # We need to be careful here.
-           
-            # Specific fix for TSI Signal: pandas-ta output for TSI is usually TSI_fast_slow_sig and TSIh_... (signal is implicit or separate?)
-            # Actually pandas-ta 'tsi' returns [TSI, TSIs]. We need to find them.
-            tsi_val = latest.get([c for c in latest.index if c.startswith('TSI_')][0], 0)
-            tsi_sig_val = latest.get([c for c in latest.index if c.startswith('TSIs_')][0], 0)
-           
-            vwma = _get_val(latest, 'VWMA')
-            # Note: To calc VWMA slope, we need previous value. Snapshot only has latest.
-            # LIMITATION: Snapshot is 1 row.
-            # FIX: We cannot calc slope from 1 row.
-            # Assumption: The 'indicator_calculator' should have calc'd slope or we assume flat if missing?
-            # Better approach: Use Price > VWMA as a proxy if slope unavailable, OR
-            # The indicator_calculator should be updated to include slope.
-            # For now, we will use Close > VWMA as the "Positive Trend" proxy if Slope is missing.
-           
-            atr_pct = _get_val(latest, 'ATRp') # ATR Percent
-           
-            # 4. Evaluate Gates
-            gate_1 = tsi_val > tsi_sig_val # Trend
-            gate_2 = rsi > 50 # Momentum
-            gate_3 = latest['close'] > vwma # Volume Trend Proxy (since slope hard on snapshot)
-            gate_4 = atr_pct <= atr_ceiling # Volatility
-           
-            score = sum([gate_1, gate_2, gate_3, gate_4])
-            passed = (score == 4)
-           
-            health_results.append({
-                'ETF': etf,
-                'TSI_Val': round(tsi_val, 2),
-                'TSI_Sig': round(tsi_sig_val, 2),
-                'RSI': round(rsi, 1),
-                'ATR_Pct': round(atr_pct, 2),
-                'ATR_Ceiling': atr_ceiling,
-                'Gate_1_Trend': gate_1,
-                'Gate_2_Mom': gate_2,
-                'Gate_3_Vol': gate_3,
-                'Gate_4_Risk': gate_4,
-                'Health_Score': score,
-                'Pass': passed,
-                'Reason': 'OK' if passed else 'Gates Failed'
-            })
-           
-        except Exception as e:
-            log.error(f"Health check logic error for {etf}: {e}", tags=["DECISION", "HEALTH", "ERROR"])
-            health_results.append(_create_fail_record(etf, "CALC_ERROR"))
-    # 5. Create Matrix
-    health_df = pd.DataFrame(health_results)
+    default_ceiling = strategy.get('risk_controls', {}).get('default_atr_ceiling_percent', 2.0)
+    global_atr_ceiling = _get_param(system_params, 'ATR_Ceiling_%', default_ceiling)
+    required_score = int(health_cfg.get('required_score', len(GATES)))
+
+    # 1. Lineup (configured, not just what we fetched, to track missing data)
+    lineup = _enabled_lineup(etf_lineup)
+    etfs = lineup['Ticker'].tolist()
+
+    # 2. Join with the weekly snapshot (NaN rows where an ETF has no data)
+    weekly = snapshot.frame('1W', etfs)
+    has_data = np.array([snapshot.has(etf, '1W') for etf in etfs], dtype=bool)
+    for etf in lineup.loc[~has_data, 'Ticker']:
+        log.warning(f"No weekly data found for {etf}", tags=["DECISION", "HEALTH"])
+
+    values = weekly.reindex(columns=['rsi', 'tsi', 'tsi_signal', 'close', 'vwma', 'atr_pct']).fillna(0.0).to_numpy()
+    rsi, tsi_val, tsi_sig_val, close, vwma, atr_pct = values.T
+    vwma_slope = weekly['vwma_slope'].to_numpy() if 'vwma_slope' in weekly else np.full(len(weekly), np.nan)
+
+    # 3. Per-ETF ATR ceiling, aligned with the lineup
+    atr_ceiling = lineup['ATR_Ceiling'].fillna(global_atr_ceiling).to_numpy(dtype=float)
+
+    # 4. Evaluate Gates
+    gates = np.column_stack([
+        tsi_val > tsi_sig_val, # Trend
+        rsi > 50, # Momentum
+        np.where(np.isnan(vwma_slope), close > vwma, vwma_slope >= 0), # Volume Trend (Close > VWMA if slope not computed)
+        atr_pct <= atr_ceiling, # Volatility
+    ])
+    enabled = np.array([bool(health_cfg.get(key, True)) for _, key in GATES])
+    gates = (gates | ~enabled) & has_data[:, None]
+
+    score = gates.sum(axis=1)
+    passed = score >= required_score
+
+    # 5. Create Matrix (NO_DATA rows are zeroed)
+    health_df = pd.DataFrame({
+        'ETF': etfs,
+        'TSI_Val': np.round(tsi_val, 2),
+        'TSI_Sig': np.round(tsi_sig_val, 2),
+        'RSI': np.round(rsi, 1),
+        'ATR_Pct': np.round(atr_pct, 2),
+        'ATR_Ceiling': np.where(has_data, atr_ceiling, 0.0),
+        **{name: gates[:, j] for j, (name, _) in enumerate(GATES)},
+        'Health_Score': score,
+        'Pass': passed,
+        'Reason': np.where(~has_data, 'NO_DATA', np.where(passed, 'OK', 'Gates Failed'))
+    }, columns=MATRIX_COLUMNS)
     universal_data['analysis']['health_matrix_df'] = health_df
-   
-    passed_count = len(health_df[health_df['Pass'] == True]) if not health_df.empty and 'Pass' in health_df.columns else 0
-    log.info(f"Health Checks Complete. {passed_count}/{len(etf_lineup)} ETFs Passed.", tags=["DECISION", "HEALTH", "SUCCESS"])
-   
-    return universal_data
 
+    passed_count = int(passed.sum())
+    log.info(f"Health Checks Complete. {passed_count}/{len(etf_lineup)} ETFs Passed (required score {required_score}/{len(GATES)}).",
+             tags=["DECISION", "HEALTH", "SUCCESS"])
+
+    return universal_data
 
-def _get_val(row: pd.Series, prefix: str) -> float:
-    """Finds column starting with prefix and returns value."""
-    try:
-        col = [c for c in row.index if c.startswith(prefix)]
-        if col:
-            return float(row[col[0]])
-        return 0.0
-    except:
-        return 0.0
 
+def _enabled_lineup(etf_lineup: pd.DataFrame) -> pd.DataFrame:
+    """Enabled lineup rows with a numeric 'ATR_Ceiling' override column (NaN = use global)."""
+    if etf_lineup is None or etf_lineup.empty or 'Ticker' not in etf_lineup.columns:
+        return pd.DataFrame({'Ticker': pd.Series(dtype=str), 'ATR_Ceiling': pd.Series(dtype=float)})
 
-def _create_fail_record(etf: str, reason: str) -> Dict:
-    return {
-        'ETF': etf, 'TSI_Val': 0, 'TSI_Sig': 0, 'RSI': 0, 'ATR_Pct': 0, 'ATR_Ceiling': 0,
-        'Gate_1_Trend': False, 'Gate_2_Mom': False, 'Gate_3_Vol': False, 'Gate_4_Risk': False,
-        'Health_Score': 0, 'Pass': False, 'Reason': reason
-    }
+    lineup = etf_lineup
+    if 'Enabled' in lineup.columns:
+        lineup = lineup[lineup['Enabled'].fillna(True).astype(bool)]
+    lineup = lineup.reset_index(drop=True)
+    override = lineup['ATR_Override_%'] if 'ATR_Override_%' in lineup.columns else pd.Series(np.nan, index=lineup.index)
+    return pd.DataFrame({
+        'Ticker': lineup['Ticker'],
+        'ATR_Ceiling': pd.to_numeric(override.replace('', np.nan), errors='coerce')
+    })
 
 
 def _get_param(df: Any, param_name: str, default: Any) -> Any:
@@ -147,4 +129,4 @@ def _get_param(df: Any, param_name: str, default: Any) -> Any:
         row = df[df['Parameter'] == param_name]
         if not row.empty: return float(row.iloc[0]['Value'])
     except: pass
-    return default
\ No newline at end of file
+    return default
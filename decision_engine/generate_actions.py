@@ -3,160 +3,167 @@
 ACTION GENERATION ENGINE.
 Combines Budget, Health, and Harvest data to produce final Weekly Actions.
 Calculates GTT Entry prices.
+Works on one merged frame per ETF (lineup + holdings + health + snapshot), so allocation,
+pricing, rounding and caps are array operations rather than per-ETF lookups.
+Buys are sized by the constrained allocation solver (Single-ETF and Tag caps, whole units).
 """
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from typing import Dict, Any
 from utils.logger import setup_logger
+from data_pipeline.indicator_snapshot import IndicatorSnapshot, get_snapshot
+from decision_engine.allocation_solver import solve_allocation, tag_membership
 
 log = setup_logger()
 
+ACTION_COLUMNS = ['Date', 'ETF', 'Action', 'Units', 'Price', 'Value', 'Reason']
+MIN_BUY_BUDGET = 1000
+
 
 def generate_weekly_actions(universal_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Generates 'weekly_actions_df':
     1. Priority: Process Trims (from Harvest)
-    2. Priority: Process Buys (from Budget + Health)
-    3. Apply Single-ETF Caps
-    4. Calculate GTT Price (Friday Close - 0.5 * ATR)
+    2. Priority: Process Buys (from Budget + Health), budget split proportionally to the gap to target
+    3. Apply Caps: post-buy weight <= Single_ETF_Max_% and each tag's cap
+       (risk_controls.tag_caps_percent); budget clipped by caps or unit rounding is redistributed
+    4. Calculate GTT Price (Friday Close - gtt_entry_atr_multiplier * ATR)
     """
     log.info("=== GENERATING ACTIONS ===", tags=["DECISION", "ACTIONS"])
-   
+
     # Inputs
     budget = universal_data['analysis'].get('weekly_budget', 0.0)
     health_df = universal_data['analysis'].get('health_matrix_df')
     harvest_df = universal_data['analysis'].get('harvest_triggers_df')
     holdings = universal_data['portfolio_state']['holdings']
     lineup = universal_data['configs']['etf_lineup']
-    snapshot = universal_data['market_data']['indicator_snapshot_df']
+    snapshot = get_snapshot(universal_data)
     system_params = universal_data['configs']['system_params']
-   
-    actions = []
-   
+    strategy = universal_data['configs'].get('strategy_settings') or {}
+    exec_cfg = strategy.get('execution_params', {})
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    book = _build_book(lineup, holdings, health_df, snapshot)
+    frames = []
+
     # 1. PROCESS TRIMS
     if harvest_df is not None and not harvest_df.empty:
-        for _, row in harvest_df.iterrows():
-            etf = row['ETF']
-            # Get current price from holdings or snapshot
-            price = _get_price(etf, holdings, snapshot)
-           
-            actions.append({
-                'Date': datetime.now().strftime('%Y-%m-%d'),
-                'ETF': etf,
-                'Action': 'TRIM',
-                'Units': int(row['Trim_Units']),
-                'Price': price,
-                'Value': float(row['Est_Value']),
-                'Reason': row['Trigger']
-            })
-            
+        # Current price from holdings, else snapshot close
+        price = book['Current_Price'].where(book['Current_Price'] > 0, book['Close'])
+        frames.append(pd.DataFrame({
+            'Date': today,
+            'ETF': harvest_df['ETF'].to_numpy(),
+            'Action': 'TRIM',
+            'Units': harvest_df['Trim_Units'].astype(int).to_numpy(),
+            'Price': price.reindex(harvest_df['ETF']).fillna(0.0).to_numpy(),
+            'Value': harvest_df['Est_Value'].astype(float).to_numpy(),
+            'Reason': harvest_df['Trigger'].to_numpy()
+        }))
+
     # 2. PROCESS BUYS
-    # Filter Eligibility: Health Score = 4 AND Underweight
-    # Underweight Logic: Gap > 0? We generally buy things that have a Gap to Target.
-   
-    eligible_buys = []
-   
-    if health_df is not None and not health_df.empty:
-        passing_etfs = health_df[health_df['Pass'] == True]['ETF'].tolist()
-       
-        for etf in passing_etfs:
-            # Check Weight
-            target = _get_target_weight(etf, lineup)
-            current = _get_current_weight(etf, holdings)
-           
-            if current < target:
-                # It is underweight and healthy
-                eligible_buys.append(etf)
-               
+    # Eligibility: Health Pass AND Underweight (Gap to Target > 0)
+    eligible = book['Pass'] & (book['Current_%'] < book['Target_%'])
+
     # 3. ALLOCATE BUDGET
-    # Strategy: Equal weight allocation to eligible ETFs (Simple & Robust)
-    # Or Proportional to Gap? Let's do Proportional to Gap for better gliding.
-   
-    if eligible_buys and budget > 1000: # Min threshold
-        # Calculate total gap points
-        total_gap_points = 0
-        gaps = {}
-       
-        for etf in eligible_buys:
-            t = _get_target_weight(etf, lineup)
-            c = _get_current_weight(etf, holdings)
-            gap = max(0, t - c)
-            gaps[etf] = gap
-            total_gap_points += gap
-           
-        # Allocate
-        for etf in eligible_buys:
-            if total_gap_points == 0: break
-           
-            allocation_share = gaps[etf] / total_gap_points
-            allocated_amount = budget * allocation_share
-           
-            # Get ATR for GTT
-            atr_val, close_price = _get_atr_and_close(etf, snapshot)
-            if close_price == 0: continue
-           
-            # GTT Entry: Close - 0.5 * ATR
-            gtt_price = close_price - (0.5 * atr_val)
-           
-            # Units
-            units = int(allocated_amount / gtt_price)
-           
-            if units > 0:
-                actions.append({
-                    'Date': datetime.now().strftime('%Y-%m-%d'),
-                    'ETF': etf,
-                    'Action': 'BUY',
-                    'Units': units,
-                    'Price': round(gtt_price, 2),
-                    'Value': round(units * gtt_price, 2),
-                    'Reason': 'Health_Pass_Underweight'
-                })
+    # Proportional to Gap for better gliding
+    if eligible.any() and budget > MIN_BUY_BUDGET:
+        risk = strategy.get('risk_controls', {})
+        max_weight = _get_param(system_params, 'Single_ETF_Max_%', risk.get('single_etf_max_percent', 35.0))
+        multiplier = float(exec_cfg.get('gtt_entry_atr_multiplier', 0.5))
+        buys = _allocate_buys(book, eligible.to_numpy(), budget, max_weight, risk.get('tag_caps_percent', {}),
+                              multiplier, exec_cfg.get('round_down_units', True))
+        frames.append(buys.assign(Date=today))
     else:
         log.info("No eligible buys found or insufficient budget.", tags=["DECISION", "ACTIONS"])
+
     # 4. Save
-    df = pd.DataFrame(actions)
+    frames = [f for f in frames if not f.empty]
+    df = pd.concat(frames, ignore_index=True)[ACTION_COLUMNS] if frames else pd.DataFrame()
     universal_data['execution_plan']['weekly_actions_df'] = df
-   
+
     log.info(f"Actions Generated: {len(df)} orders.", tags=["DECISION", "ACTIONS", "SUCCESS"])
     return universal_data
 # --- Helpers ---
 
 
-def _get_price(etf: str, holdings: pd.DataFrame, snapshot: pd.DataFrame) -> float:
-    # Try holdings first
-    if not holdings.empty:
-        row = holdings[holdings['Ticker'] == etf]
-        if not row.empty:
-            return float(row.iloc[0]['Current_Price'])
-    # Try snapshot
-    if not snapshot.empty:
-        row = snapshot[ (snapshot['ETF'] == etf) & (snapshot['Timeframe'] == '1W') ]
-        if not row.empty:
-            return float(row.iloc[0]['close'])
-    return 0.0
-
-
-def _get_target_weight(etf: str, lineup: pd.DataFrame) -> float:
-    if lineup.empty: return 0.0
-    row = lineup[lineup['Ticker'] == etf]
-    if not row.empty: return float(row.iloc[0]['Target_%'])
-    return 0.0
-
-
-def _get_current_weight(etf: str, holdings: pd.DataFrame) -> float:
-    if holdings.empty: return 0.0
-    row = holdings[holdings['Ticker'] == etf]
-    if not row.empty: return float(row.iloc[0].get('Current_%', 0))
-    return 0.0
-
-
-def _get_atr_and_close(etf: str, snapshot: pd.DataFrame) -> tuple:
-    if snapshot.empty: return 0.0, 0.0
-    row = snapshot[ (snapshot['ETF'] == etf) & (snapshot['Timeframe'] == '1W') ]
-    if row.empty: return 0.0, 0.0
-   
-    # Find ATR col
-    atr_col = [c for c in row.columns if c.startswith('ATRr') or c.startswith('ATR_')] # pandas-ta raw ATR
-    atr = float(row.iloc[0][atr_col[0]]) if atr_col else 0.0
-    close = float(row.iloc[0]['close'])
-    return atr, close
\ No newline at end of file
+def _build_book(lineup: pd.DataFrame, holdings: pd.DataFrame, health_df: pd.DataFrame, snapshot: IndicatorSnapshot) -> pd.DataFrame:
+    """
+    One row per ETF (lineup, then held-only tickers) with aligned columns:
+    Target_%, Current_%, Units, Current_Price, Tags, Pass, Close, ATR.
+    """
+    targets = _by_ticker(lineup, 'Ticker', ['Target_%'])
+    held = _by_ticker(holdings, 'Ticker', ['Current_%', 'Units', 'Current_Price'])
+    index = targets.index.append(held.index.difference(targets.index, sort=False))
+
+    book = pd.concat([targets.reindex(index), held.reindex(index)], axis=1).fillna(0.0)
+    book.index.name = 'ETF'
+
+    if lineup is not None and 'Tags' in lineup.columns:
+        book['Tags'] = lineup.drop_duplicates('Ticker').set_index('Ticker')['Tags'].reindex(index).fillna('').astype(str).to_numpy()
+    else:
+        book['Tags'] = ''
+
+    if health_df is not None and not health_df.empty:
+        passed = health_df.drop_duplicates('ETF').set_index('ETF')['Pass'] == True
+        book['Pass'] = passed.reindex(index, fill_value=False).to_numpy(dtype=bool)
+    else:
+        book['Pass'] = False
+
+    weekly = snapshot.frame('1W', index.tolist()).reindex(columns=['close', 'atr']).fillna(0.0)
+    book['Close'] = weekly['close'].to_numpy()
+    book['ATR'] = weekly['atr'].to_numpy()
+    return book
+
+
+def _allocate_buys(book: pd.DataFrame, eligible: np.ndarray, budget: float, max_weight: float,
+                   tag_caps: Dict[str, float], multiplier: float, round_down: bool) -> pd.DataFrame:
+    """Capped, gap-proportional buys in whole units at the GTT entry price for the eligible rows of 'book'."""
+    target = book['Target_%'].to_numpy()
+    current = book['Current_%'].to_numpy()
+    gaps = np.where(eligible, np.maximum(0.0, target - current), 0.0)
+    if gaps.sum() == 0:
+        return pd.DataFrame(columns=ACTION_COLUMNS)
+
+    # Caps are weights of the post-buy sleeve (current value + this week's budget)
+    sleeve_value = float((book['Units'] * book['Current_Price']).sum())
+    post_value = sleeve_value + budget
+    current_value = current / 100.0 * sleeve_value
+    etf_caps = max_weight / 100.0 * post_value - current_value
+
+    tag_matrix, tag_names = tag_membership(book['Tags'].tolist(), tag_caps)
+    tag_room = np.array([tag_caps[name] for name in tag_names], dtype=float) / 100.0 * post_value - tag_matrix @ current_value
+
+    # GTT Entry: Close - multiplier * ATR
+    close = book['Close'].to_numpy()
+    gtt_price = np.where(close > 0, close - multiplier * book['ATR'].to_numpy(), 0.0)
+
+    units, values = solve_allocation(gaps, gtt_price, etf_caps, budget, tag_matrix, tag_room, round_down)
+    keep = units > 0
+    log.info(f"Allocated {values.sum():,.0f} of {budget:,.0f} budget across {int(keep.sum())} ETFs.", tags=["DECISION", "ACTIONS"])
+
+    return pd.DataFrame({
+        'ETF': book.index[keep],
+        'Action': 'BUY',
+        'Units': units[keep].astype(int),
+        'Price': np.round(gtt_price[keep], 2),
+        'Value': np.round(values[keep], 2),
+        'Reason': 'Health_Pass_Underweight'
+    })
+
+
+def _by_ticker(df: pd.DataFrame, key: str, columns: list) -> pd.DataFrame:
+    """Numeric 'columns' indexed by ticker (first row per ticker wins)."""
+    if df is None or df.empty or key not in df.columns:
+        return pd.DataFrame(columns=columns, dtype=float)
+    out = df.drop_duplicates(key).set_index(key).reindex(columns=columns)
+    return out.apply(pd.to_numeric, errors='coerce')
+
+
+def _get_param(df: Any, param_name: str, default: Any) -> Any:
+    if df is None or df.empty: return default
+    try:
+        row = df[df['Parameter'] == param_name]
+        if not row.empty: return float(row.iloc[0]['Value'])
+    except: pass
+    return default
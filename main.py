@@ -10,36 +10,46 @@ import os
 import time
 import argparse
 
-# --- PHASE 1: INIT ---
+# --- PHASE 1: INIT (eager; everything below is imported on the path that uses it) ---
+_STARTUP = time.perf_counter()
 from utils.initialize_data import initialize_universal_data
 from connectors.sheets_reader import load_config_and_portfolio
 from utils.logger import setup_logger
+from utils.lazy_import import load_attr, record_import, import_report
+record_import('main (startup imports)', time.perf_counter() - _STARTUP)
 
 # --- PHASE 2: MARKET DATA ---
-from data_pipeline.upstox_auth import process_authentication
-from data_pipeline.instrument_fetcher import sync_instrument_master
-from data_pipeline.ohlcv_downloader import process_ohlcv_sync
-from data_pipeline.indicator_calculator import process_indicator_calculation
+MARKET_DATA_STEPS = [
+    'data_pipeline.upstox_auth.process_authentication',
+    'data_pipeline.instrument_fetcher.sync_instrument_master',
+    'data_pipeline.ohlcv_downloader.process_ohlcv_sync',
+    'data_pipeline.indicator_calculator.process_indicator_calculation',
+]
 
 # --- PHASE 3: DECISION ENGINE ---
-from decision_engine.calculate_budget import calculate_weekly_budget
-from decision_engine.check_health import run_health_checks
-from decision_engine.check_harvest import find_harvest_triggers
-from decision_engine.generate_actions import generate_weekly_actions
-from decision_engine.format_outputs import format_all_sheets
+STRATEGY_STEPS = [
+    'decision_engine.calculate_budget.calculate_weekly_budget',
+    'decision_engine.check_health.run_health_checks',
+    'decision_engine.check_harvest.find_harvest_triggers',
+    'decision_engine.generate_actions.generate_weekly_actions',
+    'decision_engine.format_outputs.format_all_sheets',
+]
 
 # --- PHASE 4: OUTPUT ---
-from connectors.sheets_writer import write_all_sheets_to_excel
+OUTPUT_STEPS = ['connectors.sheets_writer.write_all_sheets_to_excel']
 
-# --- PHASE 5: LIVE UPDATE ---
-from live_update.trigger_monitor import monitor_excel_trigger
-from live_update.change_detector import detect_changes
-from live_update.pipeline_orchestrator import execute_smart_pipeline
-from live_update.status_monitor import set_status_running, set_status_success, set_status_error
+# --- BACKTEST (per mode) ---
+BACKTEST_STEPS = {
+    'backtest': ['backtest.backtest_engine.run_backtest'],
+    'fill_sim': ['backtest.backtest_engine.run_backtest', 'backtest.fill_simulator.run_fill_simulation'],
+    'sweep': ['backtest.parameter_sweep.run_parameter_sweep'],
+    'walk_forward': ['backtest.walk_forward.run_walk_forward'],
+}
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--mode', type=str, default='single_run', choices=['single_run', 'daemon'])
+    parser.add_argument('--mode', type=str, default='single_run', choices=['single_run', 'daemon', 'backtest', 'sweep', 'walk_forward', 'fill_sim'])
+    parser.add_argument('--import-report', action='store_true', help='Log how long each module import took.')
     args = parser.parse_args()
 
     log = setup_logger()
@@ -56,27 +66,32 @@ def main():
         universal_data = initialize_universal_data(project_root)
         universal_data = load_config_and_portfolio(universal_data)
 
+        # Backtest / Sweep / Walk-forward / Fill sim: replay the decision engine over the stored history, then exit
+        if args.mode in BACKTEST_STEPS:
+            universal_data = _run_steps(universal_data, BACKTEST_STEPS[args.mode])
+            return
+
         # Phase 2: Market Data
-        universal_data = process_authentication(universal_data)
-        universal_data = sync_instrument_master(universal_data)
-        universal_data = process_ohlcv_sync(universal_data)
-        universal_data = process_indicator_calculation(universal_data)
+        universal_data = _run_steps(universal_data, MARKET_DATA_STEPS)
 
         # Phase 3: Strategy
-        universal_data = calculate_weekly_budget(universal_data)
-        universal_data = run_health_checks(universal_data)
-        universal_data = find_harvest_triggers(universal_data)
-        universal_data = generate_weekly_actions(universal_data)
-        universal_data = format_all_sheets(universal_data)
+        universal_data = _run_steps(universal_data, STRATEGY_STEPS)
 
         # Phase 4: Write Initial Result
-        universal_data = write_all_sheets_to_excel(universal_data)
+        universal_data = _run_steps(universal_data, OUTPUT_STEPS)
         log.info("=== INITIALIZATION & FIRST RUN COMPLETE ===", tags=["SYSTEM"])
 
         # ---------------------------------------------------------
         # PHASE 5: DAEMON MODE (Loop)
         # ---------------------------------------------------------
         if args.mode == 'daemon':
+            monitor_excel_trigger = load_attr('live_update.trigger_monitor.monitor_excel_trigger')
+            detect_changes = load_attr('live_update.change_detector.detect_changes')
+            execute_smart_pipeline = load_attr('live_update.pipeline_orchestrator.execute_smart_pipeline')
+            set_status_running = load_attr('live_update.status_monitor.set_status_running')
+            set_status_success = load_attr('live_update.status_monitor.set_status_success')
+            set_status_error = load_attr('live_update.status_monitor.set_status_error')
+
             log.info("Entering Live Monitoring Loop...", tags=["DAEMON"])
             poll_time = universal_data['configs']['system_settings']['google_sheets'].get('poll_interval_seconds', 10)
             
@@ -109,5 +124,21 @@ def main():
         log.critical(f"FATAL SYSTEM ERROR: {e}", tags=["SYSTEM", "CRITICAL"], exc_info=True)
         sys.exit(1)
 
+    finally:
+        if args.import_report:
+            _log_import_report(log)
+
+# --- Helpers ---
+
+def _run_steps(universal_data, steps):
+    """Imports each 'module.function' step on first use and threads universal_data through it."""
+    for step in steps:
+        universal_data = load_attr(step)(universal_data)
+    return universal_data
+
+def _log_import_report(log):
+    for module, seconds in import_report():
+        log.info(f"{module:<55} {seconds * 1000:8.1f} ms", tags=["SYSTEM", "IMPORTS"])
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
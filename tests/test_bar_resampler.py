@@ -0,0 +1,69 @@
+# tests/test_bar_resampler.py
+
+"""
+BAR CACHE REGRESSION TESTS.
+Incrementally maintained cascade bars must equal a full resample of the store.
+"""
+
+import numpy as np
+import pandas as pd
+from data_pipeline.bar_resampler import REQUIRED_COLS, bin_start, load_bars, resample_cascade
+from data_pipeline.ohlcv_store import mark_days_verified, read_ohlcv, write_candles
+
+TIMEFRAMES = ['1h', '1d', '1W']
+
+
+def _minute_bars(days: pd.DatetimeIndex, seed: int = 0) -> pd.DataFrame:
+    """Full 09:15-15:30 sessions of random-walk 1-minute candles for 'days'."""
+    stamps = pd.DatetimeIndex(np.concatenate([
+        pd.date_range(day + pd.Timedelta(hours=9, minutes=15), periods=375, freq='1min', tz='Asia/Kolkata')
+        for day in days
+    ]))
+    close = 100 + np.cumsum(np.random.default_rng(seed).normal(0, 0.05, len(stamps)))
+    return pd.DataFrame({
+        'timestamp': stamps, 'open': close + 0.01, 'high': close + 0.05, 'low': close - 0.05,
+        'close': close, 'volume': 10, 'oi': 0
+    })
+
+
+def _full_rebuild(store_path: str) -> dict:
+    return resample_cascade(read_ohlcv(store_path, columns=REQUIRED_COLS))
+
+
+def test_backfilled_gap_rebuilds_whole_week(tmp_path):
+    store, cache = str(tmp_path / 'store'), str(tmp_path / 'cache')
+    candles = _minute_bars(pd.bdate_range('2024-01-01', '2024-04-30'))
+    hole = candles['timestamp'].dt.strftime('%Y-%m-%d').isin(['2024-02-27', '2024-02-28', '2024-02-29'])
+
+    write_candles(store, candles[~hole].reset_index(drop=True))
+    load_bars(store, cache, TIMEFRAMES)
+
+    write_candles(store, candles[hole].reset_index(drop=True), backfill=True)
+    mark_days_verified(store, [pd.Timestamp(d).date() for d in ('2024-02-27', '2024-02-28', '2024-02-29')])
+    bars = load_bars(store, cache, TIMEFRAMES)
+
+    full = _full_rebuild(store)
+    for tf in TIMEFRAMES:
+        pd.testing.assert_frame_equal(bars[tf], full[tf], check_freq=False)
+
+
+def test_appended_tail_matches_full_rebuild(tmp_path):
+    store, cache = str(tmp_path / 'store'), str(tmp_path / 'cache')
+    candles = _minute_bars(pd.bdate_range('2024-01-01', '2024-03-13'))
+    split = candles['timestamp'] < pd.Timestamp('2024-03-06 12:00', tz='Asia/Kolkata')
+
+    write_candles(store, candles[split].reset_index(drop=True))
+    load_bars(store, cache, TIMEFRAMES)
+    write_candles(store, candles[~split].reset_index(drop=True))
+    bars = load_bars(store, cache, TIMEFRAMES)
+
+    full = _full_rebuild(store)
+    for tf in TIMEFRAMES:
+        pd.testing.assert_frame_equal(bars[tf], full[tf], check_freq=False)
+
+
+def test_bin_start_weekly():
+    friday = pd.Timestamp('2024-03-01 10:30', tz='Asia/Kolkata')
+    assert bin_start(friday, '1W') == pd.Timestamp('2024-02-24', tz='Asia/Kolkata')
+    assert bin_start(friday, '1d') == pd.Timestamp('2024-03-01', tz='Asia/Kolkata')
+    assert bin_start(friday, '1h') == pd.Timestamp('2024-03-01 10:00', tz='Asia/Kolkata')
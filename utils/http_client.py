@@ -0,0 +1,120 @@
+"""
+Shared HTTP client for Upstox and NSE calls.
+Keeps one pooled keep-alive session, applies configured timeouts,
+and retries transient failures (429/5xx/network) with exponential backoff,
+jitter and Retry-After support. When a shared rate limiter is passed in, every
+attempt (retries included) takes a token from it.
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from utils.logger import setup_logger
+from utils.rate_limiter import TokenBucket
+
+log = setup_logger()
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+MAX_BACKOFF_SECONDS = 60.0
+
+_session = None  # Singleton instance
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size: int = 10) -> requests.Session:
+    """Get or create the singleton pooled session."""
+
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+
+    return _session
+
+
+def request_with_retry(universal_data: Dict[str, Any], method: str, url: str,
+                       timeout: Optional[float] = None, limiter: Optional[TokenBucket] = None,
+                       **kwargs) -> requests.Response:
+    """
+    Sends a request on the shared session.
+    Retries network errors and RETRYABLE_STATUS responses up to 'max_retries' times.
+    'limiter' (optional) is acquired before every attempt, so retries stay within the shared rate.
+    Returns the final response (callers check status); raises the last network error
+    if every attempt failed to connect.
+    """
+    acquisition = universal_data['configs']['system_settings']['data_acquisition']
+    max_retries = acquisition.get('max_retries', 3)
+    backoff_base = acquisition.get('retry_backoff_seconds', 1.0)
+    timeout = timeout or acquisition.get('request_timeout_seconds', 30)
+    session = get_session(max(10, acquisition.get('max_concurrent_requests', 4)))
+
+    for attempt in range(max_retries + 1):
+        is_last = (attempt == max_retries)
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            resp = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if is_last:
+                raise
+            delay = _backoff_delay(backoff_base, attempt)
+            log.warning(f"{method} {_short(url)} failed ({e.__class__.__name__}), retry {attempt + 1}/{max_retries} in {delay:.1f}s", tags=["HTTP", "RETRY"])
+            time.sleep(delay)
+            continue
+
+        if resp.status_code not in RETRYABLE_STATUS or is_last:
+            return resp
+
+        delay = _retry_after_delay(resp)
+        if delay is None:
+            delay = _backoff_delay(backoff_base, attempt)
+        log.warning(f"{method} {_short(url)} returned {resp.status_code}, retry {attempt + 1}/{max_retries} in {delay:.1f}s", tags=["HTTP", "RETRY"])
+        time.sleep(delay)
+
+    return resp
+
+
+def http_get(universal_data: Dict[str, Any], url: str, **kwargs) -> requests.Response:
+    return request_with_retry(universal_data, 'GET', url, **kwargs)
+
+
+def http_post(universal_data: Dict[str, Any], url: str, **kwargs) -> requests.Response:
+    return request_with_retry(universal_data, 'POST', url, **kwargs)
+
+
+# --- Helpers ---
+
+
+def _backoff_delay(base: float, attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, base * (2 ** attempt)))
+
+
+def _retry_after_delay(resp: requests.Response) -> Optional[float]:
+    """Parses Retry-After (delta-seconds or HTTP-date)."""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return min(MAX_BACKOFF_SECONDS, max(0.0, float(value)))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return min(MAX_BACKOFF_SECONDS, max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()))
+    except (TypeError, ValueError):
+        return None
+
+
+def _short(url: str) -> str:
+    return url.split('?')[0][:120]
@@ -92,7 +92,9 @@ def _create_data_structure(
         "market_data": {
             "etf_master_list": pd.DataFrame(),
             "ohlcv_file_paths": {},
+            "ohlcv_compaction": None,               # Background compaction thread (joined before indicators read the store)
             "indicator_snapshot_df": pd.DataFrame(),
+            "indicator_snapshot": None,             # IndicatorSnapshot accessor over the DataFrame
             "indicator_history_path": ""
         },
         
@@ -0,0 +1,43 @@
+# utils/lazy_import.py
+
+"""
+ON-DEMAND IMPORTS.
+Heavy modules (Playwright, pyotp, numba, later pipeline phases) are imported on the code path
+that uses them instead of at startup, so a run that only needs a cached token and snapshot
+never pays for the browser stack.
+'load' records how long each first import took; 'import_report' lists them (--import-report).
+"""
+
+import importlib
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+_IMPORT_TIMES: Dict[str, float] = {}
+
+
+def load(module_name: str) -> Any:
+    """Imports 'module_name' (if not loaded yet) and records the time the first import took."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _IMPORT_TIMES[module_name] = time.perf_counter() - started
+    return module
+
+
+def load_attr(path: str) -> Any:
+    """'package.module.name' -> the 'name' attribute of the lazily loaded module."""
+    module_name, _, attr = path.rpartition('.')
+    return getattr(load(module_name), attr)
+
+
+def record_import(label: str, seconds: float) -> None:
+    """Adds an externally timed import block (e.g. a module's eager imports) to the report."""
+    _IMPORT_TIMES[label] = seconds
+
+
+def import_report() -> List[Tuple[str, float]]:
+    """(module, seconds) for every timed import, slowest first."""
+    return sorted(_IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True)
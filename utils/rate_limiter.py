@@ -0,0 +1,44 @@
+"""
+Thread-safe token bucket rate limiter.
+Shared by concurrent API workers so the combined request rate stays within the broker limit.
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Token bucket that blocks callers until a request slot is available."""
+
+    def __init__(self, rate_per_second: Optional[float], capacity: float = 1.0):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_delay(cls, delay_seconds: float) -> "TokenBucket":
+        """Builds a limiter from a per-request delay (e.g. 0.5s -> 2 requests/second). 0 disables limiting."""
+        rate = (1.0 / delay_seconds) if delay_seconds and delay_seconds > 0 else None
+        return cls(rate)
+
+    def acquire(self) -> None:
+        """Blocks until one token can be taken."""
+        if not self.rate:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+
+                wait_seconds = (1.0 - self._tokens) / self.rate
+
+            time.sleep(wait_seconds)
@@ -31,6 +31,22 @@ def validate_system_config_values(config: Dict[str, Any]) -> List[str]:
     if delay < 0:
         errors.append(f"api_rate_limit_delay_seconds must be >= 0, got: {delay}")
     
+    retries = acquisition.get('max_retries', 3)
+    if retries < 0 or retries > 10:
+        errors.append(f"max_retries must be 0-10, got: {retries}")
+    
+    backoff = acquisition.get('retry_backoff_seconds', 1.0)
+    if backoff < 0:
+        errors.append(f"retry_backoff_seconds must be >= 0, got: {backoff}")
+    
+    workers = acquisition.get('max_concurrent_requests', 4)
+    if workers < 1 or workers > 32:
+        errors.append(f"max_concurrent_requests must be 1-32, got: {workers}")
+    
+    coverage = acquisition.get('gap_min_session_coverage', 0.5)
+    if not 0 <= coverage <= 1:
+        errors.append(f"gap_min_session_coverage must be 0-1, got: {coverage}")
+    
     timeout = acquisition.get('request_timeout_seconds', 0)
     if timeout < 1 or timeout > 300:
         errors.append(f"request_timeout_seconds must be 1-300, got: {timeout}")
@@ -42,6 +58,49 @@ def validate_system_config_values(config: Dict[str, Any]) -> List[str]:
     if cache_days < 0:
         errors.append(f"instrument_master_cache_days must be >= 0, got: {cache_days}")
     
+    compaction_segments = cache.get('ohlcv_compaction_segments', 8)
+    if compaction_segments < 1:
+        errors.append(f"ohlcv_compaction_segments must be >= 1, got: {compaction_segments}")
+    
+    # Validate compute settings
+    compute = config.get('compute', {})
+    
+    indicator_workers = compute.get('indicator_workers', 1)
+    if indicator_workers < 0 or indicator_workers > 64:
+        errors.append(f"indicator_workers must be 0-64 (0 = one per CPU), got: {indicator_workers}")
+    
+    backtest_workers = compute.get('backtest_workers', 0)
+    if backtest_workers < 0 or backtest_workers > 64:
+        errors.append(f"backtest_workers must be 0-64 (0 = one per CPU), got: {backtest_workers}")
+    
+    # Validate backtest settings
+    backtest = config.get('backtest', {})
+    
+    horizon = backtest.get('hit_horizon_weeks', 4)
+    if horizon < 1:
+        errors.append(f"hit_horizon_weeks must be >= 1, got: {horizon}")
+    
+    sweep = backtest.get('sweep', {})
+    
+    method = sweep.get('method', 'grid')
+    if method not in ('grid', 'random'):
+        errors.append(f"sweep method must be 'grid' or 'random', got: {method}")
+    
+    samples = sweep.get('samples', 500)
+    if samples < 1:
+        errors.append(f"sweep samples must be >= 1, got: {samples}")
+    
+    for knob, values in sweep.get('parameters', {}).items():
+        if not isinstance(values, list) or not values:
+            errors.append(f"sweep parameters[{knob}] must be a non-empty list of candidate values, got: {values}")
+    
+    walk_forward = backtest.get('walk_forward', {})
+    
+    for key in ('in_sample_weeks', 'out_of_sample_weeks'):
+        weeks = walk_forward.get(key, 13)
+        if weeks < 1:
+            errors.append(f"walk_forward {key} must be >= 1, got: {weeks}")
+    
     return errors
 
 
@@ -79,7 +138,15 @@ def validate_strategy_config_values(config: Dict[str, Any]) -> List[str]:
     atr_ceiling = risk.get('default_atr_ceiling_percent', 0)
     if not 0 < atr_ceiling <= 10:
         errors.append(f"default_atr_ceiling_percent must be 0-10, got: {atr_ceiling}")
-    
+
+    harvest_cap = risk.get('weekly_harvest_cap_percent', 12.0)
+    if not 0 < harvest_cap <= 100:
+        errors.append(f"weekly_harvest_cap_percent must be 0-100, got: {harvest_cap}")
+
+    for tag, tag_cap in risk.get('tag_caps_percent', {}).items():
+        if not 0 < tag_cap <= 100:
+            errors.append(f"tag_caps_percent[{tag}] must be 0-100, got: {tag_cap}")
+
     # Validate health gates
     health = config.get('health_gates', {})
     
@@ -105,6 +172,19 @@ def validate_strategy_config_values(config: Dict[str, Any]) -> List[str]:
         percentile = h2.get('atr_percentile', 0)
         if not 50 <= percentile <= 100:
             errors.append(f"h2_volspike atr_percentile must be 50-100, got: {percentile}")
+
+        # The rank is computed by the indicator pipeline; its window must match the trigger's
+        lookback = h2.get('lookback_weeks', 26)
+        ranks = [ind.get('params', {}).get('lookback', 26) for ind in config.get('indicators', {}).get('enabled_indicators', [])
+                 if ind.get('name') == 'atr_rank' and ind.get('enabled', True)]
+        if ranks and lookback not in ranks:
+            errors.append(f"h2_volspike lookback_weeks ({lookback}) must match an atr_rank indicator lookback, got: {ranks}")
+
+    h3 = harvest.get('h3_breakdown', {})
+    if h3.get('enabled'):
+        dma_trim = h3.get('dma_break_trim_percent', 25.0)
+        if not 0 < dma_trim <= 50:
+            errors.append(f"h3_breakdown dma_break_trim_percent must be 0-50, got: {dma_trim}")
     
     return errors
 